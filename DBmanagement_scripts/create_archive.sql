@@ -9,7 +9,8 @@ CREATE TABLE deliverables_archive (
     progress character varying,
     percent integer,
     papers character varying,
-    paper_submission_date character varying
+    paper_submission_date character varying,
+    changed integer
 );
 CREATE SEQUENCE deliverables_archive_id_seq
     AS integer
@@ -29,7 +30,8 @@ CREATE TABLE tasks_archive (
     progress character varying,
     percent integer,
     papers character varying,
-    paper_submission_date character varying
+    paper_submission_date character varying,
+    changed integer
 );
 
 CREATE SEQUENCE tasks_archive_id_seq
@@ -4,6 +4,9 @@ $ python populatePSQL.py
 Run on Heroku using:
 $ heroku run python populatePSQL.py
 
+Only DATABASE_URL needs to be set (and ARCHIVE_COLD_DIR if archive rows
+may have been moved to the cold tier); the web app is not built.
+
 Based off populatePSQL.py but adapted to leave partners and work_packages
 intact
 
@@ -13,13 +16,40 @@ the web forms.
 
 ***NB***: Running this script will first clear the tables, including any
 modifications that have been made to the data via the web app
-(e.g. updates to the progress and percent fields).
+(e.g. updates to the progress and percent fields). The change log keeps
+its events: the load is appended as a reset of each archive followed by
+the loaded revisions, and Counts recounted from them, so `manage.py
+changelog --rebuild` reproduces what was loaded. Rows moved to the cold
+tier would outlive the load, so the script refuses to run while
+ARCHIVE_COLD_DIR holds any.
 """
+import json
+import os
+import sys
+
+from sqlalchemy import select
+
+from swiftdb import connect, session_scope, read_tab, bulk_insert, delete_all
+from swiftdb import (Work_Packages_Archive, Deliverables_Archive,
+                     Tasks_Archive)
+from swiftdb.changelog import seed_events
+
+Session = connect()  # DATABASE_URL
+
 
-from SWIFTDBApp import db
-from SWIFTDBApp import (Work_Packages_Archive, Deliverables_Archive,
-                        Tasks_Archive, Counts)
-import csv
+def cold_segments(directory):
+    '''Number of cold-tier segments listed in directory's index.'''
+    path = os.path.join(directory, 'index.json')
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(len(entries) for entries in json.load(f).values())
+
+
+cold = os.environ.get('ARCHIVE_COLD_DIR', 'cold_archive')
+if cold_segments(cold):
+    sys.exit(cold + " holds archive rows moved to the cold tier, which "
+             "would outlive the load. Empty it first.")
 
 
 def yes_or_no(question):
@@ -39,29 +69,30 @@ ans = yes_or_no("***WARNING***: Running this script will populate the database\
                 progress and percent fields. Proceed?")
 
 if(ans):
-    # Delete current data (no ForeignKey relationships here):
-    print("Deleting current data")
-    Work_Packages_Archive.query.delete()
-    db.session.commit()
-    Tasks_Archive.query.delete()
-    db.session.commit()
-    Deliverables_Archive.query.delete()
-    db.session.commit()
-    Counts.query.delete()
-    db.session.commit()
-
-    # Copy new data (in normal order):
-    print("Copying new data")
-    list = [['wp_archive.tab', Work_Packages_Archive],
-            ['deliverables_archive.tab', Deliverables_Archive],
-            ['tasks_archive.tab', Tasks_Archive],
-            ['counts.tab', Counts]]
-    for l in list:
-        with open(l[0], 'r') as f:
-            reader = csv.reader(f, delimiter='\t')
-            for row in reader:
-                db_row = l[1](*row)
-                db.session.add(db_row)
-                db.session.commit()
+    # One transaction, so a failed load leaves the old data in place:
+    with session_scope(Session) as session:
+        # Delete current data (no ForeignKey relationships here):
+        print("Deleting current data")
+        delete_all(session, Work_Packages_Archive, Tasks_Archive,
+                   Deliverables_Archive)
+
+        # Copy new data (in normal order):
+        print("Copying new data")
+        list = [['wp_archive.tab', Work_Packages_Archive, 'Work_Packages'],
+                ['deliverables_archive.tab', Deliverables_Archive,
+                 'Deliverables'],
+                ['tasks_archive.tab', Tasks_Archive, 'Tasks']]
+        revisions = {}
+        for l in list:
+            n = bulk_insert(session, l[1], read_tab(l[0]))
+            print(l[0] + ': ' + str(n) + ' rows')
+            table = l[1].__table__
+            revisions[l[2]] = [dict(row) for row in session.execute(
+                select([table]).order_by(table.c.id))]
+
+        # Log the load after the earlier events (this also recounts Counts,
+        # so counts.tab is not needed):
+        n = seed_events(session.connection(), revisions, reset=True)
+        print('change_log: ' + str(n) + ' events')
 
     print("***SUCCESS***")
@@ -4,6 +4,8 @@ $ python populatePSQL.py
 Run on Heroku using:
 $ heroku run python populatePSQL.py
 
+Only DATABASE_URL needs to be set; the web app is not imported.
+
 Based off populatePSQL.py but adapted to leave partners and work_packages
 intact
 
@@ -16,10 +18,11 @@ modifications that have been made to the data via the web app
 (e.g. updates to the progress and percent fields).
 """
 
-from SWIFTDBApp import db
-from SWIFTDBApp import (Partners, Work_Packages, Deliverables, Users,
-                        Users2Work_Packages, Tasks, Users2Partners)
-import csv
+from swiftdb import connect, session_scope, read_tab, bulk_insert, delete_all
+from swiftdb import (Partners, Work_Packages, Deliverables, Users,
+                     Users2Work_Packages, Tasks, Users2Partners)
+
+Session = connect()  # DATABASE_URL
 
 
 def yes_or_no(question):
@@ -39,23 +42,18 @@ ans = yes_or_no("***WARNING***: Running this script will populate the database\
                 progress and percent fields. Proceed?")
 
 if(ans):
-    # Delete current data (in reverse order of foreign key relationships):
-    print("Deleting current data")
-    Tasks.query.delete()
-    db.session.commit()
-    Deliverables.query.delete()
-    db.session.commit()
-
-    # Copy new data (in normal order):
-    print("Copying new data")
-    list = [['deliverables.tab', Deliverables],
-            ['tasks.tab', Tasks]]
-    for l in list:
-        with open(l[0], 'r') as f:
-            reader = csv.reader(f, delimiter='\t')
-            for row in reader:
-                db_row = l[1](*row)
-                db.session.add(db_row)
-                db.session.commit()
+    # One transaction, so a failed load leaves the old data in place:
+    with session_scope(Session) as session:
+        # Delete current data (in reverse order of foreign key relationships):
+        print("Deleting current data")
+        delete_all(session, Tasks, Deliverables)
+
+        # Copy new data (in normal order):
+        print("Copying new data")
+        list = [['deliverables.tab', Deliverables],
+                ['tasks.tab', Tasks]]
+        for l in list:
+            n = bulk_insert(session, l[1], read_tab(l[0]))
+            print(l[0] + ': ' + str(n) + ' rows')
 
     print("***SUCCESS***")
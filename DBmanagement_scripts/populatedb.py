@@ -4,6 +4,8 @@ $ python populatePSQL.py
 Run on Heroku using:
 $ heroku run python populatePSQL.py
 
+Only DATABASE_URL needs to be set; the web app is not built.
+
 Based off populatePSQL.py but adapted to leave partners and work_packages
 intact
 
@@ -13,13 +15,21 @@ the web forms.
 
 ***NB***: Running this script will first clear the tables, including any
 modifications that have been made to the data via the web app
-(e.g. updates to the progress and percent fields).
+(e.g. updates to the progress and percent fields). Like any other edit,
+the load is logged in the change log (a delete event for each item not in
+the files, an insert or update for each loaded one) and a project_changes
+job is queued to archive it.
 """
+import datetime as dt
+
+from swiftdb import connect, session_scope, read_tab, bulk_insert, delete_all
+from swiftdb import (Partners, Work_Packages, Deliverables, Users,
+                     Users2Work_Packages, Tasks, Users2Partners, Jobs,
+                     Change_Log)
+from swiftdb.api import mappings
+from swiftdb.changelog import event
 
-from SWIFTDBApp import db
-from SWIFTDBApp import (Partners, Work_Packages, Deliverables, Users,
-                        Users2Work_Packages, Tasks, Users2Partners)
-import csv
+Session = connect()  # DATABASE_URL
 
 
 def yes_or_no(question):
@@ -39,23 +49,34 @@ ans = yes_or_no("***WARNING***: Running this script will populate the database\
                 progress and percent fields. Proceed?")
 
 if(ans):
-    # Delete current data (in reverse order of foreign key relationships):
-    print("Deleting current data")
-    Tasks.query.delete()
-    db.session.commit()
-    Deliverables.query.delete()
-    db.session.commit()
-
-    # Copy new data (in normal order):
-    print("Copying new data")
-    list = [['deliverables.tab', Deliverables],
-            ['tasks.tab', Tasks]]
-    for l in list:
-        with open(l[0], 'r') as f:
-            reader = csv.reader(f, delimiter='\t')
-            for row in reader:
-                db_row = l[1](*row)
-                db.session.add(db_row)
-                db.session.commit()
+    # One transaction, so a failed load leaves the old data in place:
+    with session_scope(Session) as session:
+        # Codes before the load, to log deletes and tell inserts from updates:
+        old = dict((name, set(code for (code,) in session.query(model.code)))
+                   for name, model in [('Deliverables', Deliverables),
+                                       ('Tasks', Tasks)])
+
+        # Delete current data (in reverse order of foreign key relationships):
+        print("Deleting current data")
+        delete_all(session, Tasks, Deliverables)
+
+        # Copy new data (in normal order):
+        print("Copying new data")
+        list = [['deliverables.tab', Deliverables, 'Deliverables'],
+                ['tasks.tab', Tasks, 'Tasks']]
+        for l in list:
+            rows = [row for row in mappings(l[1], read_tab(l[0]))]
+            n = bulk_insert(session, l[1], rows)
+            print(l[0] + ': ' + str(n) + ' rows')
+            codes = set(row['code'] for row in rows)
+            events = [event(l[2], code, 'delete')
+                      for code in sorted(old[l[2]] - codes)]
+            events += [event(l[2], row['code'],
+                             'update' if row['code'] in old[l[2]]
+                             else 'insert', row) for row in rows]
+            bulk_insert(session, Change_Log, events)
+
+        # Archive the load (jobs.enqueue needs the web app's session):
+        session.add(Jobs('project_changes', '{}', dt.datetime.utcnow()))
 
     print("***SUCCESS***")
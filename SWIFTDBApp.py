@@ -8,7 +8,9 @@ project management website hosted on heroku.
 
 Example:
     To use::
-        python manage.py
+        python manage.py runserver
+    or under gunicorn (see gunicorn.conf.py)::
+        gunicorn -c gunicorn.conf.py "SWIFTDBApp:create_app()"
 
 Attributes:
     endMonth(int): Project length in months
@@ -16,43 +18,102 @@ Attributes:
 .. CEMAC_swiftdb:
    https://github.com/cemac/SWIFTDB
 '''
-from flask import Flask, render_template, flash, redirect, url_for, request
+from flask import Flask, Blueprint, render_template, flash, redirect, url_for
+from flask import request, current_app, jsonify, Response, stream_with_context
 from flask import g, session, abort
-from wtforms import Form, validators, StringField, SelectField, TextAreaField
-from wtforms import IntegerField, PasswordField, SelectMultipleField, widgets
-from wtforms.fields.html5 import DateField
-from wtforms_components import DateRange
 import datetime as dt
 import os
-import pandas as pd
-from flask_sqlalchemy import SQLAlchemy
+import re
+import uuid
 from functools import wraps
 from sqlalchemy.exc import IntegrityError
-from passlib.hash import sha256_crypt
 
+from extensions import db
+from lazy import lazy_import
+from forms import (Dateform, Period_Form, Partners_Form, Work_Packages_Form,
+                   Deliverables_Form, Your_Work_Packages_Form,
+                   Your_Deliverables_Form, Users_Form, ChangePwdForm,
+                   AccessForm, Tasks_Form, Your_Tasks_Form, Import_Form)
+from swiftdb import read_frame
+from swiftdb.models import (Partners, Work_Packages, Deliverables, Users,
+                            Counts, Users2Work_Packages, Tasks, Users2Partners,
+                            Work_Packages_Archive, Deliverables_Archive,
+                            Tasks_Archive)
+from snapshots import as_of, to_date
+from deltas import history, previous_reports
+from series import percent_series
+from revisions import (item_revisions, PER_PAGE as HISTORY_PER_PAGE,
+                       MAX_PER_PAGE as HISTORY_MAX_PER_PAGE)
+from reporting import period_changes, period_changes_chunks
+from search import search_items
+from rollups import rollup_keys, rollup_rows, check_rollups
+from overdue import overdue_items, queue_summary
+from summary import wp_summary_page, summary_changed
+from cache import cache_get, cache_set
+from bus import publish, start_listener
+from routing import init_routing, read_only, primary
+from profiler import (init_profiling, list_profiles, merged_profile,
+                      profile_path)
+from querylog import (init_query_log, slow_queries, slow_query_summary,
+                      clear_slow_queries)
+from memory import (init_memory, check_frame, memory_report,
+                    clear_memory_report, FrameTooLarge)
+from tracing import init_tracing, span, traced
+from jobs import enqueue, schedule, jobs_committed
+from changelog import record_change
+from bulk import apply_updates, FIELDS as BULK_FIELDS
+from importer import (preview_import, apply_import, InvalidFile,
+                      EXTENSIONS as IMPORT_EXTENSIONS)
+
+# Heavy modules, imported on first use (or preloaded by gunicorn.conf.py):
+pd = lazy_import('pandas')
+passlib_hash = lazy_import('passlib.hash')
+
+# Rendering is a span of traced requests (see tracing.py):
+render_template = traced('render_template', 'template')(render_template)
+
+main = Blueprint('main', __name__)
 
-app = Flask(__name__)
-
-# Set config variables:
-assert "APP_SETTINGS" in os.environ, "APP_SETTINGS environment variable not set"
-assert "SECRET_KEY" in os.environ, "SECRET_KEY environment variable not set"
-assert "ADMIN_PWD" in os.environ, "ADMIN_PWD environment variable not set"
-assert "DATABASE_URL" in os.environ, "DATABASE_URL environment variable not set"
-app.config.from_object(os.environ['APP_SETTINGS'])
-
-# Configure postgresql database:
-db = SQLAlchemy(app)
 # Set any other parameters:
 endMonth = 51  # End month (from project start month)
+# Config keys that must be set, and the environment variable supplying each:
+REQUIRED_SETTINGS = [('SECRET_KEY', 'SECRET_KEY'), ('ADMIN_PWD', 'ADMIN_PWD'),
+                     ('SQLALCHEMY_DATABASE_URI', 'DATABASE_URL')]
+
+
+def create_app(settings=None):
+    '''
+    Build the web app. settings is a config object or import path, by
+    default the APP_SETTINGS environment variable. No database connection
+    is opened here, so the app is safe to create before gunicorn forks.
+    '''
+    settings = settings or os.environ.get('APP_SETTINGS')
+    if not settings:
+        raise RuntimeError("APP_SETTINGS environment variable not set")
+    app = Flask(__name__)
+    app.config.from_object(settings)
+    for key, variable in REQUIRED_SETTINGS:
+        if not app.config.get(key):
+            raise RuntimeError(variable + " environment variable not set")
+    init_tracing(app)
+    init_routing(app)
+    init_profiling(app)
+    init_query_log(app)
+    init_memory(app)
+    db.init_app(app)
+    app.register_blueprint(main)
+    # Each (forked) worker listens for cache invalidations from the others:
+    app.before_first_request(start_listener)
+    return app
 
-from models import Partners, Work_Packages, Deliverables, Users, Counts
-from models import Users2Work_Packages, Tasks, Users2Partners
-from models import Work_Packages_Archive, Deliverables_Archive, Tasks_Archive
 # ~~~~~~ PSQL FUNCTIONS ~~~~~~~ #
 
 def psql_to_pandas(query):
-    df = pd.read_sql(query.statement, db.session.bind)
-    return df
+    with span('psql_to_pandas') as current:
+        df = read_frame(db.session, query)
+        if current is not None:
+            current['attributes']['rows'] = len(df)
+    return check_frame(df, 'psql_to_pandas')
 
 def psql_insert(row, flashMsg=True):
     try:
@@ -79,6 +140,84 @@ def psql_delete(row, flashMsg=True):
               ' reference this one', 'danger')
         flash('If trying to delete user please deselect all access settings before removing', 'warning')
     return
+
+
+def partner_items(model, username):
+    # Tasks or deliverables of the partners a user leads, joined in SQL so
+    # only those rows are read:
+    return (model.query.join(Users2Partners,
+                             Users2Partners.partner == model.partner)
+            .filter(Users2Partners.username == username)
+            .order_by(model.id))
+
+
+def wp_items(model, username):
+    # Tasks or deliverables in the work packages a user leads:
+    return (model.query.join(Users2Work_Packages,
+                             Users2Work_Packages.work_package ==
+                             model.work_package)
+            .filter(Users2Work_Packages.username == username)
+            .order_by(model.id))
+
+
+def led_partners(username):
+    # Cached until the user's access changes (see access()); read from the
+    # primary, as edits trust it and a lagging replica may still list a
+    # revoked partner:
+    key = ('user', username, 'partners')
+    partners = cache_get(key)
+    if partners is None:
+        with primary():
+            partners = [p for (p,) in db.session.query(Users2Partners.partner)
+                        .filter_by(username=username)
+                        .order_by(Users2Partners.id)]
+        cache_set(key, partners, ttl=86400)
+    return list(partners)
+
+
+def led_work_packages(username):
+    key = ('user', username, 'work_packages')
+    wps = cache_get(key)
+    if wps is None:
+        query = (db.session.query(Users2Work_Packages.work_package)
+                 .filter_by(username=username)
+                 .order_by(Users2Work_Packages.id))
+        with primary():
+            wps = [wp for (wp,) in query]
+        cache_set(key, wps, ttl=86400)
+    return list(wps)
+
+
+def items_changed(keys):
+    # Queue the refresh of data derived from tasks and deliverables (commit
+    # to enqueue), keys being the (work_package, partner) pairs touched, and
+    # evict this worker's cached views of them:
+    enqueue('refresh_rollups', keys=[list(key) for key in keys if key])
+    publish(('overdue',))
+    summary_changed([key[0] for key in keys if key is not None])
+
+
+def archive_changed(tableClass, values, action='update'):
+    # Log an edit (commit to record it); its archive revision is projected
+    # from the change log by a job:
+    record_change(tableClass, values['code'], action, values)
+    schedule('project_changes')
+
+
+def previous_report(tableClass, code, stored=None):
+    # Progress before the latest edit, derived from the archive, else the
+    # stored report (items with fewer than two archive revisions):
+    return previous_reports(tableClass, [code]).get(code, stored)
+
+
+def with_previous_reports(tableClass, data):
+    # Fill the previous_report column of a tasks/deliverables frame, keeping
+    # stored reports the archive can't derive:
+    derived = data['code'].map(previous_reports(tableClass, data['code']))
+    if 'previous_report' in data:
+        derived = derived.where(derived.notnull(), data['previous_report'])
+    data['previous_report'] = derived.fillna('')
+    return data
 ####################################
 # ######### LOGGED-IN FUNCTIONS ##########
 # Check if user is logged in
@@ -91,7 +230,7 @@ def is_logged_in(f):
             return f(*args, **kwargs)
         else:
             flash('Unauthorised, please login', 'danger')
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
     return wrap
 
 # Check if user is logged in as admin
@@ -106,7 +245,7 @@ def is_logged_in_as_admin(f):
             return f(*args, **kwargs)
         else:
             flash('Unauthorised, please login as admin', 'danger')
-            return redirect(url_for('index'))
+            return redirect(url_for('.index'))
     return wrap
 #########################################
 
@@ -114,207 +253,31 @@ def is_logged_in_as_admin(f):
 
 
 def table_list(tableClass, col):
-    DF = psql_to_pandas(eval(tableClass).query.order_by(eval(tableClass).id))
-    list = [('blank', '--Please select--')]
-    for element in DF[col]:
-        list.append((element, element))
-    return list
+    # Choice lists are cached until the table is edited (see add/edit/delete):
+    key = ('table', tableClass, col)
+    list = cache_get(key)
+    if list is None:
+        DF = psql_to_pandas(eval(tableClass).query.order_by(eval(tableClass).id))
+        list = [('blank', '--Please select--')]
+        for element in DF[col]:
+            list.append((element, element))
+        cache_set(key, list, ttl=86400)
+    return [choice for choice in list]
+
+
+def frame_to_records(df):
+    # JSON-safe list of dicts (dates as ISO strings, NaN as null):
+    df = df.astype(object).where(pd.notnull(df), None)
+    records = df.to_dict('records')
+    for record in records:
+        for key, value in record.items():
+            if isinstance(value, (dt.date, dt.datetime)):
+                record[key] = value.isoformat()
+    return records
 #########################################
 
-# ######### FORM CLASSES ##########
-
-class Dateform(Form):
-    dat = DateField('DatePicker', format='%Y-%m-%d')
-
-class Partners_Form(Form):
-    name = StringField(u'*Partner Name',
-                       [validators.InputRequired()],
-                       render_kw={"placeholder": "e.g. Leeds"})
-    country = StringField(u'Country',
-                          render_kw={"placeholder": "e.g. UK"})
-    role = StringField(u'Role', render_kw={"placeholder":
-                                           "e.g. 'Academic' or 'Operational'"})
-
-
-class Work_Packages_Form(Form):
-    code = StringField(u'*Work Package Code',
-                       [validators.InputRequired()],
-                       render_kw={"placeholder": "e.g. WP-C1"})
-    name = StringField(u'*Name',
-                       [validators.InputRequired()],
-                       render_kw={"placeholder": "e.g. Training"})
-    previous_report = TextAreaField(u'Previous Update',
-                          [validators.Optional()],
-                          render_kw={"placeholder": "auto filled previous submission"})
-    status = TextAreaField(u'Work Package Status',
-                         [validators.Optional()],
-                         render_kw={"placeholder": "e.g. Optional - Overview of Progress as a whole"})
-    issues = TextAreaField(u'Issues',
-                         [validators.Optional()],
-                         render_kw={"placeholder": "e.g. Optional - Highlight any potential issues or risks"})
-    next_deliverable = TextAreaField(u'Next Quarter Deliverables',
-                                   [validators.Optional()],
-                                   render_kw={"placeholder": "e.g. Upcomming deliverables due"})
-    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
-
-
-class Deliverables_Form(Form):
-    code = StringField(u'*Deliverable Code',
-                       [validators.InputRequired()],
-                       render_kw={"placeholder": "e.g. D-R1.1"})
-    work_package = SelectField(u'*Work Package',
-                               [validators.NoneOf(('blank'),
-                                                  message='Please select')])
-    description = TextAreaField(u'*Description',
-                                [validators.InputRequired()],
-                                render_kw={"placeholder": "e.g. Report on current state of knowledge regarding user needs for forecasts at different timescales in each sector."})
-    partner = SelectField(u'*Partner', [validators.NoneOf(('blank'),
-                                                          message='Please select')])
-    person_responsible = StringField(u'Person Responsible',
-                                   [validators.Optional()],
-                                   render_kw={"placeholder": "e.g. Name of person responsible"})
-    month_due = DateField(u'*Month Due', validators=[DateRange(min=dt.date(2017, 1, 1),
-                                         max=dt.date(2024, 1, 1))],
-                       render_kw={"placeholder": "must be YYYYMMDD Date String e.g. 2019-01-29"})
-    previous_report = TextAreaField(u'Previous Report',
-                             validators=[validators.Optional()])
-    progress = TextAreaField(u'Progress',
-                             validators=[validators.Optional()])
-    percent = IntegerField(u'*Percentage Complete',
-                           [validators.NumberRange(min=0, max=100,
-                                                   message="Must be between 0 and 100")])
-    papers = TextAreaField(u'Papers',
-                             validators=[validators.Optional()])
-    paper_submission_date = StringField(u'Paper Submission Date',
-                                validators=[validators.Optional()],
-                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
-    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
-
-
-class Your_Work_Packages_Form(Form):
-    code = StringField(u'Work Package Code')
-    name = StringField(u'Name')
-    previous_report = TextAreaField(u'Previous Update')
-    status = TextAreaField(u'Work Package Status',
-                         [validators.Optional()],
-                         render_kw={"placeholder": "e.g. Overview of Progress as a whole"})
-    issues = TextAreaField(u'Issues',
-                         [validators.Optional()],
-                         render_kw={"placeholder": "e.g. Highlight any potential issues or risks"})
-    next_deliverable = TextAreaField(u'Next Quarter Deliverables',
-                                   [validators.Optional()],
-                                   render_kw={"placeholder": "e.g. Upcomming deliverables due"})
-
-
-class Your_Deliverables_Form(Form):
-    code = StringField(u'Deliverable Code')
-    work_package = StringField(u'Work Package')
-    description = TextAreaField(u'Description')
-    partner = StringField(u'Partner')
-    person_responsible = StringField(u'*Person Responsible', validators=[validators.Optional()])
-    month_due = StringField(u'Month Due')
-    previous_report = TextAreaField(u'Previous Report')
-    progress = TextAreaField(u'Progress',
-                             validators=[validators.Optional()])
-    percent = IntegerField(u'*Percentage Complete',
-                           [validators.NumberRange(min=0, max=100,
-                                                   message="Must be between 0 and 100")])
-    papers = TextAreaField(u'Papers',
-                             validators=[validators.Optional()])
-    paper_submission_date = StringField(u'Paper Submission Date',
-                                validators=[validators.Optional()],
-                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
-
-
-class Users_Form(Form):
-    username = StringField('Username', [validators.Length(min=4, max=25)])
-    password = PasswordField('Password',
-                             [validators.Regexp('^([a-zA-Z0-9]{8,})$',
-                                                message='Password must be mimimum 8 characters and contain only uppercase letters, \
-        lowercase letters and numbers')])
-
-
-class ChangePwdForm(Form):
-    current = PasswordField('Current password', [validators.DataRequired()])
-    new = PasswordField('New password',
-                        [validators.Regexp('^([a-zA-Z0-9]{8,})$',
-                                           message='Password must be mimimum 8 characters and contain only uppercase letters, \
-        lowercase letters and numbers')])
-    confirm = PasswordField('Confirm new password',
-                            [validators.EqualTo('new',
-                                                message='Passwords do no match')])
-
-
-class MultiCheckboxField(SelectMultipleField):
-    widget = widgets.ListWidget(prefix_label=False)
-    option_widget = widgets.CheckboxInput()
-
-
-class AccessForm(Form):
-    username = StringField('Username')
-    AdminReader = MultiCheckboxField(
-        'ADMIN: (Grant Admin privileges):')
-    work_packages = MultiCheckboxField(
-        'WORK PACKAGE LEADERS: Can update Work Package progress and view associated Task and Deliverables:')
-    partners = MultiCheckboxField(
-        'PARTNER LEADER: Can update progress on tasks and deliverables for which they are the responsible partner:')
-
-
-class Tasks_Form(Form):
-    code = StringField(u'*Task Code',
-                       [validators.InputRequired()],
-                       render_kw={"placeholder": "e.g. T-R1.1.1"})
-    work_package = SelectField(u'*Work Package',
-                               [validators.NoneOf(('blank'),
-                                                  message='Please select')])
-    description = TextAreaField(u'*Description',
-                                [validators.InputRequired()],
-                                render_kw={"placeholder": "e.g. Report on current state of knowledge regarding user needs for forecasts at different timescales in each sector."})
-    partner = SelectField(u'*Partner', [validators.NoneOf(('blank'),
-                                                          message='Please select')])
-    person_responsible = StringField(u'*Person Responsible',
-                                   [validators.Optional()],
-                                   render_kw={"placeholder": "e.g. Name of person responsible"})
-    month_due = DateField(u'*Month Due', validators=[DateRange(min=dt.date(2017, 1, 1),
-                                         max=dt.date(2024, 1, 1))],
-                       render_kw={"placeholder": "must be YYYYMMDD Date String e.g. 2019-01-29"})
-    previous_report = TextAreaField(u'Previous Report',
-                             validators=[validators.Optional()])
-    progress = TextAreaField(u'Progress',
-                             validators=[validators.Optional()])
-    percent = IntegerField(u'*Percentage Complete',
-                           [validators.NumberRange(min=0, max=100,
-                                                   message="Must be between 0 and 100")])
-    papers = TextAreaField(u'Papers',
-                             validators=[validators.Optional()])
-    paper_submission_date = StringField(u'Paper Submission Date',
-                                validators=[validators.Optional()],
-                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
-    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
-
-
-class Your_Tasks_Form(Form):
-    code = StringField(u'Task Code')
-    work_package = StringField(u'Work Package')
-    description = TextAreaField(u'Description')
-    partner = StringField(u'Partner')
-    person_responsible = StringField(u'Person Responsible', validators=[validators.Optional()])
-    month_due = StringField(u'Month Due')
-    previous_report = TextAreaField(u'Previous Report')
-    progress = TextAreaField(u'Progress',
-                             validators=[validators.Optional()])
-    percent = IntegerField(u'*Percentage Complete',
-                           [validators.NumberRange(min=0, max=100,
-                                                   message="Must be between 0 and 100")])
-    papers = TextAreaField(u'Papers',
-                             validators=[validators.Optional()])
-    paper_submission_date = StringField(u'Paper Submission Date',
-                                validators=[validators.Optional()],
-                             render_kw={"placeholder": "must be Date String e.g. 01-12-2019"})
-
-
 # Index
-@app.route('/', methods=["GET"])
+@main.route('/', methods=["GET"])
 def index():
     WP = 'none'
     Ps = 'none'
@@ -347,7 +310,7 @@ def index():
 
 
 # Add entry
-@app.route('/add/<string:tableClass>', methods=["GET", "POST"])
+@main.route('/add/<string:tableClass>', methods=["GET", "POST"])
 @is_logged_in_as_admin
 def add(tableClass):
     if tableClass not in ['Partners', 'Work_Packages', 'Deliverables', 'Users', 'Tasks']:
@@ -363,11 +326,11 @@ def add(tableClass):
     if request.method == 'POST' and form.validate():
         # Get form fields:
         if tableClass == 'Users':
-            form.password.data = sha256_crypt.encrypt(str(form.password.data))
+            form.password.data = passlib_hash.sha256_crypt.encrypt(str(form.password.data))
         formdata = []
         fieldname = []
         db_string = ""
-        archive_string = ""
+        archive_values = {}
         if tableClass == 'Work_Packages':
             archivelist = ['date_edited', 'code', 'status', 'issues',
                            'next_deliverable']
@@ -382,27 +345,39 @@ def add(tableClass):
                 now = dt.datetime.now().strftime("%Y-%m-%d")
                 formdata[f] = now
             if field.name in archivelist:
-                archive_string += str(field.name) + "=formdata[" + str(f)+"],"
+                archive_values[field.name] = formdata[f]
             if field.name == "code":
                 code = formdata[0]
             db_string += str(field.name) + "=formdata[" + str(f) + "],"
         # Add to DB:
         db_string = tableClass + "(" + db_string[:-1] + ")"
         db_row = eval(db_string)
-        psql_insert(db_row)
-        db.session.commit()
-        if tableClass in ['Work_Packages', 'Deliverables', 'Tasks']:
-            archive_string = tableClass + "_Archive(" + archive_string[:-1]+")"
-            db_arow = eval(archive_string.encode('unicode_escape'))
-            psql_insert(db_arow, flashMsg=False)
+        # The row, its change event and the jobs derived from it are
+        # committed together, or not at all:
+        try:
+            db.session.add(db_row)
+            db.session.flush()
+            publish(('table', tableClass))
+            if tableClass in ['Deliverables', 'Tasks']:
+                items_changed([rollup_keys(db_row)])
+            if tableClass in ['Work_Packages', 'Deliverables', 'Tasks']:
+                archive_changed(tableClass, archive_values, action='insert')
             db.session.commit()
-        return redirect(url_for('add', tableClass=tableClass))
+        except IntegrityError:
+            db.session.rollback()
+            flash('Integrity Error: Violation of unique constraint(s)',
+                  'danger')
+        else:
+            flash('Added to database', 'success')
+            jobs_committed()
+        return redirect(url_for('.add', tableClass=tableClass))
     return render_template('add.html.j2', title=title, tableClass=tableClass,
                            form=form)
 
 
 # View table
-@app.route('/view/<string:tableClass>')
+@main.route('/view/<string:tableClass>')
+@read_only
 @is_logged_in_as_admin
 def view(tableClass):
     if tableClass not in ['Partners', 'Work_Packages', 'Deliverables', 'Users', 'Tasks']:
@@ -410,6 +385,7 @@ def view(tableClass):
     # Retrieve all DB data for given table:
     data = psql_to_pandas(eval(tableClass).query.order_by(eval(tableClass).id))
     data.fillna(value="", inplace=True)
+    check_frame(data, 'fillna')
     if tableClass == 'Users':
         data['password'] = '********'
     # Set title:
@@ -422,6 +398,9 @@ def view(tableClass):
         data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
     except KeyError:
         pass
+    if tableClass in ['Deliverables', 'Tasks']:
+        data = check_frame(with_previous_reports(tableClass, data),
+                           'with_previous_reports')
     # Set table column names:
     description = ('Admin access to ' + tableClass.replace("_", " "))
     colnames = [s.replace("_", " ").title() for s in data.columns.values[1:]]
@@ -430,7 +409,7 @@ def view(tableClass):
 
 
 # Delete entry
-@app.route('/delete/<string:tableClass>/<string:id>', methods=['POST'])
+@main.route('/delete/<string:tableClass>/<string:id>', methods=['POST'])
 @is_logged_in_as_admin
 def delete(tableClass, id):
     # Retrieve DB entry:
@@ -456,12 +435,25 @@ def delete(tableClass, id):
                 username=user.username, partner=p).first()
             psql_delete(db_row1, flashMsg=False)
     # Delete from DB:
+    if tableClass in ['Deliverables', 'Tasks']:
+        old_keys = rollup_keys(db_row)
+    if tableClass in ['Work_Packages', 'Deliverables', 'Tasks']:
+        # Committed together with the delete:
+        record_change(tableClass, db_row.code, 'delete',
+                      date_edited=dt.date.today())
     psql_delete(db_row)
-    return redirect(url_for('view', tableClass=tableClass))
+    publish(('table', tableClass))
+    if tableClass == 'Users':
+        publish(('user', db_row.username))
+    if tableClass in ['Deliverables', 'Tasks']:
+        items_changed([old_keys])
+    db.session.commit()
+    jobs_committed()
+    return redirect(url_for('.view', tableClass=tableClass))
 
 
 # Edit entry
-@app.route('/edit/<string:tableClass>/<string:id>', methods=['GET', 'POST'])
+@main.route('/edit/<string:tableClass>/<string:id>', methods=['GET', 'POST'])
 @is_logged_in_as_admin
 def edit(tableClass, id):
     if tableClass not in ['Partners', 'Work_Packages', 'Deliverables', 'Tasks']:
@@ -487,17 +479,16 @@ def edit(tableClass, id):
                        'progress', 'percent', 'papers',
                        'paper_submission_date']
     if request.method == 'POST' and form.validate():
-        if tableClass not in ['Partners', 'Users']:
-            if tableClass == 'Work_Packages':
-                exec("db_row.previous_report = db_row.status")
-            else:
-                #  Get each form field and update DB:
-                exec("db_row.previous_report = db_row.progress")
+        # Tasks and deliverables derive previous_report from the archive:
+        if tableClass == 'Work_Packages':
+            exec("db_row.previous_report = db_row.status")
         now = dt.datetime.now().strftime("%Y-%m-%d")
-        archive_string = "date_edited = '"+str(now) +"',"
+        archive_values = {'date_edited': now}
         # Get each form field and update DB:
         if tableClass == 'Users':
-            form.password.data = sha256_crypt.encrypt(str(form.password.data))
+            form.password.data = passlib_hash.sha256_crypt.encrypt(str(form.password.data))
+        if tableClass in ['Deliverables', 'Tasks']:
+            old_keys = rollup_keys(db_row)
         for field in form:
             if field.name == "previous_report":
                 continue
@@ -505,7 +496,9 @@ def edit(tableClass, id):
                 now = dt.datetime.now().strftime("%Y-%m-%d")
                 field.data = now
             exec("db_row." + field.name + " = field.data")
-        db.session.commit()
+        publish(('table', tableClass))
+        if tableClass in ['Deliverables', 'Tasks']:
+            items_changed([old_keys, rollup_keys(db_row)])
         if tableClass in ['Work_Packages', 'Deliverables', 'Tasks']:
             formdata = []
             fieldname = []
@@ -518,14 +511,14 @@ def edit(tableClass, id):
                     now = dt.datetime.now().strftime("%Y-%m-%d")
                     formdata[f] = now
                 if field.name in archivelist:
-                    archive_string += str(field.name) + "=formdata[" + str(f)+"],"
-            archive_string = tableClass+ "_Archive(" + archive_string[:-1] +")"
-            db_arow = eval(archive_string)
-            psql_insert(db_arow, flashMsg=False)
-            db.session.commit()
+                    archive_values[field.name] = formdata[f]
+            archive_changed(tableClass, archive_values)
+        # One commit for the edit and the jobs it queues:
+        db.session.commit()
+        jobs_committed()
         # Return with success:
         flash('Edits successful', 'success')
-        return redirect(url_for('view', tableClass=tableClass))
+        return redirect(url_for('.view', tableClass=tableClass))
     # Set title:
     title = "Edit " + tableClass[:-1].replace("_", " ")
     # Pre-populate form fields with existing data:
@@ -534,12 +527,90 @@ def edit(tableClass, id):
             field.render_kw = {'readonly': 'readonly'}
         if not request.method == 'POST':
             exec("field.data = db_row." + field.name)
+    if tableClass in ['Deliverables', 'Tasks'] and not request.method == 'POST':
+        form.previous_report.data = previous_report(
+            tableClass, db_row.code, db_row.previous_report)
     return render_template('edit.html.j2', title=title, tableClass=tableClass,
                            id=id, form=form)
 
 
+# Uploaded import files are named <uuid4 hex><extension>:
+IMPORT_NAME = re.compile(r'^[0-9a-f]{32}\.(tab|tsv|csv|xlsx)$')
+
+
+def import_path(name):
+    if not IMPORT_NAME.match(name or ''):
+        abort(404)
+    path = os.path.join(current_app.config['IMPORT_FOLDER'], name)
+    if not os.path.exists(path):
+        abort(404)
+    return path
+
+
+# Bulk import: upload and preview
+@main.route('/import', methods=['GET', 'POST'])
+@is_logged_in_as_admin
+def import_upload():
+    form = Import_Form(request.form)
+    title = "Import from file"
+    if request.method == 'POST' and form.validate():
+        upload = request.files.get('file')
+        ext = os.path.splitext(upload.filename if upload else '')[1].lower()
+        if ext not in IMPORT_EXTENSIONS:
+            flash('Please choose a .tab, .csv or .xlsx file', 'danger')
+            return redirect(url_for('.import_upload'))
+        # Streamed to disk, then read in chunks for the preview and apply:
+        name = uuid.uuid4().hex + ext
+        path = os.path.join(current_app.config['IMPORT_FOLDER'], name)
+        upload.save(path)
+        try:
+            report = preview_import(form.table.data, path)
+        except InvalidFile as e:
+            os.remove(path)
+            flash(str(e), 'danger')
+            return redirect(url_for('.import_upload'))
+        return render_template('import.html.j2', title=title, form=form,
+                               report=report, name=name,
+                               filename=upload.filename)
+    return render_template('import.html.j2', title=title, form=form,
+                           report=None)
+
+
+# Bulk import: apply a previewed file
+@main.route('/import/apply', methods=['POST'])
+@is_logged_in_as_admin
+def import_apply():
+    form = Import_Form(request.form)
+    path = import_path(request.form.get('name'))
+    if request.form.get('action') != 'apply' or not form.validate():
+        os.remove(path)
+        flash('Import cancelled', 'info')
+        return redirect(url_for('.import_upload'))
+    tableClass = form.table.data
+    try:
+        report = apply_import(tableClass, path,
+                              delete_missing=form.delete_missing.data)
+    except (InvalidFile, IntegrityError) as e:
+        db.session.rollback()
+        flash('Import failed, nothing was changed: ' + str(e), 'danger')
+        return redirect(url_for('.import_upload'))
+    finally:
+        os.remove(path)
+    enqueue('rebuild_rollups')
+    schedule('project_changes')
+    publish(('table', tableClass), ('overdue',), ('wp_summary',))
+    # One commit for every chunk of the import:
+    db.session.commit()
+    jobs_committed()
+    flash('Imported {}: {} inserted, {} updated, {} deleted'.format(
+        tableClass.replace('_', ' '), report['inserts'], report['updates'],
+        report['deletes'] if form.delete_missing.data else 0), 'success')
+    return redirect(url_for('.view', tableClass=tableClass))
+
+
 # WP list for WP leaders
-@app.route('/wp-list')
+@main.route('/wp-list')
+@read_only
 @is_logged_in
 def wp_list():
     # Retrieve all work packages:
@@ -562,7 +633,8 @@ def wp_list():
 
 
 # WP list for WP leaders
-@app.route('/wp-view')
+@main.route('/wp-view')
+@read_only
 @is_logged_in
 def wp_view():
     # Retrieve all work packages:
@@ -584,7 +656,8 @@ def wp_view():
 
 
 # WP list for read only
-@app.route('/wp-reader', methods=["GET", "POST"])
+@main.route('/wp-reader', methods=["GET", "POST"])
+@read_only
 @is_logged_in
 def wp_readers():
     form = Dateform(request.form)
@@ -604,7 +677,7 @@ def wp_readers():
         for ind, row in accessible_wps.iterrows():
             code = row.code
             try:
-                old_wp = psql_to_pandas(Work_Packages_Archive.query.filter_by(code=code))
+                old_wp = history('Work_Packages', code=code)
                 s = pd.to_datetime(old_wp['date_edited'])- pd.to_datetime(form.dat.data.strftime('%Y-%m-%d'))
                 idx = abs(s).idxmin()
                 closest = old_wp.iloc[idx]
@@ -624,7 +697,7 @@ def wp_readers():
 
 
 # WP edit status for WP leaders
-@app.route('/wp-edit/<string:id>', methods=['GET', 'POST'])
+@main.route('/wp-edit/<string:id>', methods=['GET', 'POST'])
 @is_logged_in
 def wp_edit(id):
     # Retrieve DB entry:
@@ -636,15 +709,14 @@ def wp_edit(id):
     # Check user has access to this wp:
     if not session['username'] == 'admin':
         wp_code = db_row.code
-        user_wps = psql_to_pandas(Users2Work_Packages.query.filter_by(
-            username=session['username']))['work_package'].tolist()
+        user_wps = led_work_packages(session['username'])
         if wp_code not in user_wps:
             abort(403)
     # Get form:
     form = Your_Work_Packages_Form(request.form)
     archivelist = ['date_edited', 'code', 'status', 'issues','next_deliverable']
     now = dt.datetime.now().strftime("%Y-%m-%d")
-    archive_string = "date_edited = '"+str(now) +"',"
+    archive_values = {'date_edited': now}
     # If user submits edit entry form:
     if request.method == 'POST' and form.validate():
         exec("db_row.previous_report = db_row.status")
@@ -661,15 +733,14 @@ def wp_edit(id):
                 now = dt.datetime.now().strftime("%Y-%m-%d")
                 formdata[f] = now
             if field.name in archivelist:
-                archive_string += str(field.name) + "=formdata[" + str(f)+"],"
+                archive_values[field.name] = formdata[f]
         exec("db_row.date_edited = now")
+        archive_changed('Work_Packages', archive_values)
+        # One commit for the edit and the jobs it queues:
         db.session.commit()
-        archive_string = "Work_Packages_Archive(" + archive_string[:-1] +")"
-        db_arow = eval(archive_string)
-        psql_insert(db_arow, flashMsg=False)
-        db.session.commit()
+        jobs_committed()
         flash('Edits successful', 'success')
-        return redirect(url_for('wp_list'))
+        return redirect(url_for('.wp_list'))
     # Pre-populate form fields with existing data:
     for i, field in enumerate(form):
         if i <= 1:  # Grey out immutable fields
@@ -682,58 +753,49 @@ def wp_edit(id):
                            id=id, form=form, editLink="wp-edit")
 
 
-@app.route('/wp-summary/<string:id>', methods=['GET', 'POST'])
+@main.route('/wp-summary/<string:id>', methods=['GET', 'POST'])
 @is_logged_in
 def wp_summary(id):
-    form = Dateform()
-    # Retrieve all tasks:
     db_row = Work_Packages.query.filter_by(id=id).first()
+    if db_row is None:
+        abort(404)
     code = db_row.code
-    all_tasks = psql_to_pandas(Tasks.query.filter_by(work_package=code))
-    all_deliverables = psql_to_pandas(Deliverables.query.filter_by(work_package=code))
-    all_tasks = pd.concat([all_deliverables, all_tasks])
-    all_tasks.fillna(value="", inplace=True)
-    data = all_tasks.drop_duplicates(keep='first', inplace=False)
-    data.drop('previous_report',axis=1, inplace=True)
-    data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
-    data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 500, type=int), 1), 5000)
+    # One ordered, formatted page of tasks and deliverables:
+    data, total = wp_summary_page(code, page=page, per_page=per_page)
+    pages = max((total + per_page - 1) // per_page, 1)
     # Set title:
     title = "Tasks and Deliverables for Work Package " + str(code)
-    description = 'Displaying summary'
+    description = 'Displaying summary of {} items'.format(total)
     # Set table column names:
     colnames = [s.replace("_", " ").title()
-                for s in data.columns.values[1:]]
-    return render_template('view.html.j2', title=title, colnames=colnames,
-                           tableClass='Summary', editLink="none", reader='True',
-                           data=data, description=description)
+                for s in data.columns.values if s != 'id']
+    return render_template('wp-summary.html.j2', title=title,
+                           colnames=colnames, data=data, id=id,
+                           description=description, page=page, pages=pages,
+                           per_page=per_page)
 # Tasks for a given user
 
-@app.route('/task-list')
+@main.route('/task-list')
+@read_only
 @is_logged_in
 def task_list():
-    # Retrieve all tasks:
-    all_tasks = psql_to_pandas(Tasks.query.order_by(Tasks.id))
-    # Select only the accessible tasks for this user:
+    # Retrieve the accessible tasks for this user:
     if session['username'] == 'admin':
-        accessible_tasks = all_tasks
+        accessible_tasks = psql_to_pandas(Tasks.query.order_by(Tasks.id))
         description = 'Admin view (read-only), please use admin menu to edit'
     else:
-        user_partners = psql_to_pandas(Users2Partners.query.filter_by(
-            username=session['username']))['partner'].tolist()
-        accessible_tasks = all_tasks[all_tasks.partner.isin(user_partners)]
-        try:
-            user_partners.remove('ViewAll')
-        except ValueError:
-            pass
-        try:
-            user_partners.remove('admin')
-        except ValueError:
-            pass
-        description = 'You are Partner Leader for: ' + ", ".join(user_partners)
+        accessible_tasks = psql_to_pandas(partner_items(Tasks,
+                                                        session['username']))
+        partners = [p for p in led_partners(session['username'])
+                    if p not in ('ViewAll', 'admin')]
+        description = 'You are Partner Leader for: ' + ", ".join(partners)
     accessible_tasks.fillna(value="", inplace=True)
     data = accessible_tasks.drop_duplicates(keep='first', inplace=False)
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
     data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
+    data = with_previous_reports('Tasks', data)
     # Set title:
     title = "Tasks associated with your partner lead"
     # Set table column names:
@@ -744,22 +806,18 @@ def task_list():
                            data=data, description=description)
 
 
-@app.route('/task-view')
+@main.route('/task-view')
+@read_only
 @is_logged_in
 def task_view():
-    # Retrieve all tasks:
-    all_tasks = psql_to_pandas(Tasks.query.order_by(Tasks.id))
-    # Select only the accessible tasks for this user:
+    # Retrieve the accessible tasks for this user:
     if session['username'] == 'admin':
-        accessible_tasks = all_tasks
+        accessible_tasks = psql_to_pandas(Tasks.query.order_by(Tasks.id))
         description = 'Read-only - Displaying All Tasks'
     else:
-        user_wps = psql_to_pandas(Users2Work_Packages.query.filter_by(
-            username=session['username']))['work_package'].tolist()
-        accessible_tasks = all_tasks[all_tasks.work_package.isin(user_wps)]
-        accessible_tasks.fillna(value="", inplace=True)
+        accessible_tasks = psql_to_pandas(wp_items(Tasks, session['username']))
         description = 'Displaying Tasks associated with Work Package(s): ' + ", ".join(
-            user_wps)
+            led_work_packages(session['username']))
     accessible_tasks.fillna(value="", inplace=True)
     data = accessible_tasks.drop_duplicates(keep='first', inplace=False)
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
@@ -774,7 +832,8 @@ def task_view():
                            data=data, description=description)
 
 
-@app.route('/task-reader', methods=['GET', 'POST'])
+@main.route('/task-reader', methods=['GET', 'POST'])
+@read_only
 @is_logged_in
 def task_reader():
     form = Dateform(request.form)
@@ -784,7 +843,9 @@ def task_reader():
     accessible_tasks = all_tasks
     description = 'Read-only - Displaying All Tasks'
     accessible_tasks.fillna(value="", inplace=True)
-    data = accessible_tasks.drop_duplicates(keep='first', inplace=False)
+    data = check_frame(accessible_tasks.drop_duplicates(keep='first',
+                                                        inplace=False),
+                       'drop_duplicates')
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
     data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
     data.drop('previous_report',axis=1, inplace=True)
@@ -799,7 +860,7 @@ def task_reader():
         for ind, row in all_tasks.iterrows():
             code = row.code
             try:
-                old_tasks = psql_to_pandas(Tasks_Archive.query.filter_by(code=code))
+                old_tasks = history('Tasks', code=code)
                 s = pd.to_datetime(old_tasks['date_edited'])- pd.to_datetime(form.dat.data.strftime('%Y-%m-%d'))
                 idx=abs(s).idxmin()
                 closest = old_tasks.iloc[idx]
@@ -819,7 +880,7 @@ def task_reader():
 
 
 # Edit task as non-admin
-@app.route('/task-edit/<string:id>', methods=['GET', 'POST'])
+@main.route('/task-edit/<string:id>', methods=['GET', 'POST'])
 @is_logged_in
 def task_edit(id):
     # Retrieve DB entry:
@@ -831,8 +892,7 @@ def task_edit(id):
     # Check user has access to this task:
     if not session['username'] == 'admin':
         partner_name = db_row.partner
-        user_partners = psql_to_pandas(Users2Partners.query.filter_by(
-            username=session['username']))['partner'].tolist()
+        user_partners = led_partners(session['username'])
         if partner_name not in user_partners:
             abort(403)
     # Get form:
@@ -841,11 +901,11 @@ def task_edit(id):
                     'progress', 'percent', 'papers',
                     'paper_submission_date']
     now = dt.datetime.now().strftime("%Y-%m-%d")
-    archive_string = "date_edited = '"+str(now) +"',"
+    archive_values = {'date_edited': now}
     # If user submits edit entry form:
     if request.method == 'POST' and form.validate():
         # Get each form field and update DB:
-        exec("db_row.previous_report = db_row.progress")
+        old_keys = rollup_keys(db_row)
         formdata = []
         fieldname = []
         for f, field in enumerate(form):
@@ -858,15 +918,15 @@ def task_edit(id):
                 now = dt.datetime.now().strftime("%Y-%m-%d")
                 formdata[f] = now
             if field.name in archivelist:
-                archive_string += str(field.name) + "=formdata[" + str(f)+"],"
+                archive_values[field.name] = formdata[f]
         exec("db_row.date_edited = now")
+        items_changed([old_keys, rollup_keys(db_row)])
+        archive_changed('Tasks', archive_values)
+        # One commit for the edit and the jobs it queues:
         db.session.commit()
-        archive_string = "Tasks_Archive(" + archive_string[:-1] +")"
-        db_arow = eval(archive_string)
-        psql_insert(db_arow, flashMsg=False)
-        db.session.commit()
+        jobs_committed()
         flash('Edits successful', 'success')
-        return redirect(url_for('task_list'))
+        return redirect(url_for('.task_list'))
     # Pre-populate form fields with existing data:
     for i, field in enumerate(form):
         if i <= 3:  # Grey out immutable fields
@@ -875,39 +935,34 @@ def task_edit(id):
             field.render_kw = {'readonly': 'readonly'}
         if not request.method == 'POST':
             exec("field.data = db_row." + field.name)
+    if not request.method == 'POST':
+        form.previous_report.data = previous_report(
+            'Tasks', db_row.code, db_row.previous_report)
     return render_template('alt-edit.html.j2', id=id, form=form,
                            title="Edit Task", editLink="task-edit")
 
 
 # Tasks for a given user
-@app.route('/deliverables-list')
+@main.route('/deliverables-list')
+@read_only
 @is_logged_in
 def deliverables_list():
-    # Retrieve all work packages:
-    all_wps = psql_to_pandas(Work_Packages.query.order_by(Work_Packages.id))
-    # Retrieve all tasks:
-    all_tasks = psql_to_pandas(Deliverables.query.order_by(Deliverables.id))
-    # Select only the accessible tasks for this user:
+    # Retrieve the accessible deliverables for this user:
     if session['username'] == 'admin':
-        accessible_data = all_tasks
+        accessible_data = psql_to_pandas(
+            Deliverables.query.order_by(Deliverables.id))
         description = 'Admin view (read-only), please use admin menu to edit'
     else:
-        user_partners = psql_to_pandas(Users2Partners.query.filter_by(
-            username=session['username']))['partner'].tolist()
-        accessible_data = all_tasks[all_tasks.partner.isin(user_partners)]
-        try:
-            user_partners.remove('admin')
-        except ValueError:
-            pass
-        try:
-            user_partners.remove('ViewAll')
-        except ValueError:
-            pass
-        description = 'You are Partner Leader for: ' + ", ".join(user_partners)
+        accessible_data = psql_to_pandas(partner_items(Deliverables,
+                                                       session['username']))
+        partners = [p for p in led_partners(session['username'])
+                    if p not in ('admin', 'ViewAll')]
+        description = 'You are Partner Leader for: ' + ", ".join(partners)
     accessible_data.fillna(value="", inplace=True)
     data = accessible_data.drop_duplicates(keep='first', inplace=False)
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
     data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
+    data = with_previous_reports('Deliverables', data)
     title = "Deliverables for which you are Partner Leader "
     # Set table column names:
     colnames = [s.replace("_", " ").title() for s in
@@ -918,24 +973,20 @@ def deliverables_list():
                            description=description)
 
 
-@app.route('/deliverables-view')
+@main.route('/deliverables-view')
+@read_only
 @is_logged_in
 def deliverables_view():
-    # Retrieve all work packages:
-    all_wps = psql_to_pandas(Work_Packages.query.order_by(Work_Packages.id))
-    # Retrieve all tasks:
-    all_tasks = psql_to_pandas(Deliverables.query.order_by(Deliverables.id))
-    # Select only the accessible tasks for this user:
+    # Retrieve the accessible deliverables for this user:
     if session['username'] == 'admin':
-        accessible_data = all_tasks
+        accessible_data = psql_to_pandas(
+            Deliverables.query.order_by(Deliverables.id))
         description = 'Read-only - Displaying All Deliverables'
     else:
-        user_wps = psql_to_pandas(Users2Work_Packages.query.filter_by(
-            username=session['username']))['work_package'].tolist()
-        accessible_data = all_tasks[all_tasks.work_package.isin(user_wps)]
-        accessible_data.fillna(value="", inplace=True)
+        accessible_data = psql_to_pandas(wp_items(Deliverables,
+                                                  session['username']))
         description = 'Displaying Deliverables associated with Work Package(s): ' + ", ".join(
-            user_wps)
+            led_work_packages(session['username']))
     accessible_data.fillna(value="", inplace=True)
     data = accessible_data.drop_duplicates(keep='first', inplace=False)
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
@@ -950,7 +1001,8 @@ def deliverables_view():
                            description=description)
 
 
-@app.route('/deliverables-reader', methods=['GET', 'POST'])
+@main.route('/deliverables-reader', methods=['GET', 'POST'])
+@read_only
 @is_logged_in
 def deliverables_reader():
     form = Dateform(request.form)
@@ -962,7 +1014,9 @@ def deliverables_reader():
     accessible_data = all_tasks
     description = 'Read-only - Displaying All Tasks'
     accessible_data.fillna(value="", inplace=True)
-    data = accessible_data.drop_duplicates(keep='first', inplace=False)
+    data = check_frame(accessible_data.drop_duplicates(keep='first',
+                                                       inplace=False),
+                       'drop_duplicates')
     data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
     data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
     data.drop('previous_report',axis=1, inplace=True)
@@ -976,7 +1030,7 @@ def deliverables_reader():
         for ind, row in all_tasks.iterrows():
             code = row.code
             try:
-                old_deliv = psql_to_pandas(Deliverables_Archive.query.filter_by(code=code))
+                old_deliv = history('Deliverables', code=code)
                 s = pd.to_datetime(old_deliv['date_edited'])- pd.to_datetime(form.dat.data.strftime('%Y-%m-%d'))
                 idx=abs(s).idxmin()
                 closest = old_deliv.iloc[idx]
@@ -997,7 +1051,7 @@ def deliverables_reader():
 
 
 # Edit deliverable as WP leader
-@app.route('/deliverables-edit/<string:id>', methods=['GET', 'POST'])
+@main.route('/deliverables-edit/<string:id>', methods=['GET', 'POST'])
 @is_logged_in
 def deliverables_edit(id):
     # Retrieve DB entry:
@@ -1010,8 +1064,7 @@ def deliverables_edit(id):
     # Check user has access to this task:
     if not session['username'] == 'admin':
         partner_name = db_row.partner
-        user_partners = psql_to_pandas(Users2Partners.query.filter_by(
-            username=session['username']))['partner'].tolist()
+        user_partners = led_partners(session['username'])
         if partner_name not in user_partners:
             abort(403)
     # Get form:
@@ -1020,10 +1073,10 @@ def deliverables_edit(id):
                        'progress', 'percent', 'papers',
                        'paper_submission_date']
     now = dt.datetime.now().strftime("%Y-%m-%d")
-    archive_string = "date_edited = '"+str(now) +"',"
+    archive_values = {'date_edited': now}
     # If user submits edit entry form:
     if request.method == 'POST' and form.validate():
-        exec("db_row.previous_report = db_row.progress")
+        old_keys = rollup_keys(db_row)
         formdata = []
         fieldname = []
         for f, field in enumerate(form):
@@ -1036,16 +1089,16 @@ def deliverables_edit(id):
                 now = dt.datetime.now().strftime("%Y-%m-%d")
                 formdata[f] = now
             if field.name in archivelist:
-                archive_string += str(field.name) + "=formdata[" + str(f)+"],"
+                archive_values[field.name] = formdata[f]
         exec("db_row.date_edited = now")
+        items_changed([old_keys, rollup_keys(db_row)])
+        archive_changed('Deliverables', archive_values)
+        # One commit for the edit and the jobs it queues:
         db.session.commit()
-        archive_string = "Deliverables_Archive(" + archive_string[:-1] +")"
-        db_arow = eval(archive_string)
-        psql_insert(db_arow, flashMsg=False)
-        db.session.commit()
+        jobs_committed()
         # Return with success:
         flash('Edits successful', 'success')
-        return redirect(url_for('deliverables_list', id=id))
+        return redirect(url_for('.deliverables_list', id=id))
     # Pre-populate form fields with existing data:
     for i, field in enumerate(form):
         if i <= 3:  # Grey out immutable fields
@@ -1054,13 +1107,300 @@ def deliverables_edit(id):
             field.render_kw = {'readonly': 'readonly'}
         if not request.method == 'POST':
             exec("field.data = db_row." + field.name)
+    if not request.method == 'POST':
+        form.previous_report.data = previous_report(
+            'Deliverables', db_row.code, db_row.previous_report)
     return render_template('alt-edit.html.j2', id=id, form=form,
                            title="Edit Deliverable",
                            editLink="deliverables-edit")
 
 
+# Spreadsheet-style progress update of all of a partner leader's items
+@main.route('/bulk-update', methods=['GET'])
+@is_logged_in
+def bulk_update():
+    frames = []
+    for tableClass, model in [('Tasks', Tasks), ('Deliverables', Deliverables)]:
+        if session['username'] == 'admin':
+            query = model.query.order_by(model.id)
+        else:
+            query = partner_items(model, session['username'])
+        df = psql_to_pandas(query)
+        df.insert(0, 'type', tableClass)
+        frames.append(df)
+    data = check_frame(pd.concat(frames, sort=False), 'concat')
+    data = data[['type', 'id', 'code', 'work_package', 'partner',
+                 'description', 'month_due'] + BULK_FIELDS]
+    data.fillna(value="", inplace=True)
+    data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
+    return render_template('bulk-update.html.j2', title="Update progress",
+                           data=data, fields=BULK_FIELDS)
+
+
+# Apply many progress updates in one request and one transaction
+@main.route('/api/bulk-update', methods=['POST'])
+@is_logged_in
+def bulk_update_api():
+    payload = request.get_json(silent=True) or {}
+    if session['username'] == 'admin':
+        partners = None
+    else:
+        partners = led_partners(session['username'])
+    try:
+        result = apply_updates(payload.get('updates'), session['username'],
+                               partners)
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 400
+    except LookupError as e:
+        db.session.rollback()
+        return jsonify(error='Unknown items',
+                       items=[list(k) for k in e.args[0]]), 404
+    except PermissionError as e:
+        db.session.rollback()
+        return jsonify(error='Not your partner\'s items',
+                       items=[list(k) for k in e.args[0]]), 403
+    if result['updated']:
+        items_changed(result['keys'])
+        # One commit for the rows, their archive entries and the jobs:
+        db.session.commit()
+        jobs_committed()
+    return jsonify(updated=result['updated'], unchanged=result['unchanged'],
+                   items=result['items'])
+
+
+# Project state as of a given date
+@main.route('/as-of', methods=['GET', 'POST'])
+@is_logged_in
+def as_of_picker():
+    form = Dateform(request.form)
+    if request.method == 'POST' and form.validate() and form.dat.data:
+        return redirect(url_for('.as_of_view',
+                                date=form.dat.data.strftime('%Y-%m-%d')))
+    return redirect(url_for('.as_of_view',
+                            date=dt.date.today().strftime('%Y-%m-%d')))
+
+
+@main.route('/as-of/<string:date>', methods=['GET'])
+@is_logged_in
+def as_of_view(date):
+    try:
+        date = to_date(date)
+    except ValueError:
+        abort(404)
+    form = Dateform(request.form)
+    frames, snapshot_date = as_of(date)
+    for tableClass, data in frames.items():
+        data.fillna(value="", inplace=True)
+        data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
+        if 'month_due' in data.columns:
+            data['month_due'] = pd.to_datetime(data['month_due']).dt.strftime('%b %Y')
+    title = "Project as of " + date.strftime('%d/%m/%Y')
+    if snapshot_date is None:
+        description = ('No snapshot on or before this date yet (they are '
+                       'created daily by the worker, after the first edit '
+                       'without one, or by python manage.py snapshot)')
+    else:
+        description = ('From snapshot of ' + snapshot_date.strftime('%d/%m/%Y') +
+                       ' plus later archived edits')
+    return render_template('as-of.html.j2', title=title, frames=frames,
+                           description=description, form=form)
+
+
+@main.route('/api/as-of/<string:date>', methods=['GET'])
+@is_logged_in
+def as_of_api(date):
+    try:
+        date = to_date(date)
+    except ValueError:
+        abort(404)
+    frames, snapshot_date = as_of(date)
+    return jsonify(date=date.isoformat(),
+                   snapshot_date=(snapshot_date.isoformat()
+                                  if snapshot_date is not None else None),
+                   work_packages=frame_to_records(frames['Work_Packages']),
+                   tasks=frame_to_records(frames['Tasks']),
+                   deliverables=frame_to_records(frames['Deliverables']))
+
+
+# percent over time for items and rollups, for charts
+@main.route('/api/series', methods=['GET', 'POST'])
+@read_only
+@is_logged_in
+def series_api():
+    if request.method == 'POST':
+        args = request.get_json(silent=True) or {}
+        items = args.get('items') or []
+    else:
+        args = request.args
+        items = [item for value in request.args.getlist('items')
+                 for item in value.split(',') if item]
+    resolution = args.get('resolution', 'week')
+    try:
+        start = to_date(args['start']) if args.get('start') else None
+        end = to_date(args['end']) if args.get('end') else None
+        series = percent_series(items, resolution=resolution, start=start,
+                                end=end)
+    except (TypeError, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(resolution=resolution,
+                   start=start.isoformat() if start else None,
+                   end=end.isoformat() if end else None,
+                   series=[{'type': kind, 'key': key,
+                            'points': [[date.isoformat(), percent]
+                                       for date, percent in points]}
+                           for (kind, key), points in series.items()])
+
+
+# Changes between two reporting dates
+@main.route('/period-diff', methods=['GET'])
+@read_only
+@is_logged_in
+def period_diff():
+    form = Period_Form(request.args)
+    title = "Changes between reporting dates"
+    if 'start' not in request.args or not form.validate():
+        return render_template('period-diff.html.j2', title=title, form=form,
+                               data=None)
+    start, end = sorted([form.start.data, form.end.data])
+    fmt = request.args.get('format', 'html')
+    if fmt == 'csv':
+        def generate():
+            header = True
+            for chunk in period_changes_chunks(start, end):
+                yield chunk.to_csv(index=False, header=header)
+                header = False
+        filename = 'changes_{}_{}.csv'.format(start, end)
+        return Response(stream_with_context(generate()), mimetype='text/csv',
+                        headers={'Content-Disposition':
+                                 'attachment; filename=' + filename})
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 100, type=int), 1), 1000)
+    data, total = period_changes(start, end, page=page, per_page=per_page)
+    if fmt == 'json':
+        return jsonify(start=start.isoformat(), end=end.isoformat(),
+                       page=page, per_page=per_page, total=total,
+                       changes=frame_to_records(data))
+    for col in ['before_percent', 'after_percent']:
+        data[col] = data[col].map(lambda x: "" if pd.isnull(x) else int(x))
+    data.fillna(value="", inplace=True)
+    for col in ['before_date', 'after_date']:
+        data[col] = pd.to_datetime(data[col]).dt.strftime('%d/%m/%Y')
+        data[col] = data[col].fillna("")
+    pages = max((total + per_page - 1) // per_page, 1)
+    description = '{} items changed between {} and {}'.format(
+        total, start.strftime('%d/%m/%Y'), end.strftime('%d/%m/%Y'))
+    return render_template('period-diff.html.j2', title=title, form=form,
+                           data=data, description=description, page=page,
+                           pages=pages, per_page=per_page, start=start,
+                           end=end)
+
+
+# Edit history of one work package, task or deliverable
+@main.route('/history/<string:tableClass>/<path:code>', methods=['GET'])
+@read_only
+@is_logged_in
+def item_history(tableClass, code):
+    if tableClass not in ['Work_Packages', 'Tasks', 'Deliverables']:
+        abort(404)
+    per_page = min(max(request.args.get('per_page', HISTORY_PER_PAGE,
+                                        type=int), 1), HISTORY_MAX_PER_PAGE)
+    before = request.args.get('before')
+    try:
+        data, cursor = item_revisions(tableClass, code, before=before,
+                                      per_page=per_page)
+    except ValueError:
+        abort(404)
+    if request.args.get('format') == 'json':
+        revisions = frame_to_records(data.drop(columns='changes'))
+        for record, changes in zip(revisions, data['changes']):
+            record['changes'] = [
+                dict((key, value.isoformat()
+                      if isinstance(value, (dt.date, dt.datetime)) else value)
+                     for key, value in change.items())
+                for change in changes]
+        return jsonify(table=tableClass, code=code, per_page=per_page,
+                       next=cursor, revisions=revisions)
+    data['date_edited'] = pd.to_datetime(data['date_edited']).dt.strftime('%d/%m/%Y')
+    fields = [c for c in data.columns if c not in ('id', 'date_edited', 'changes')]
+    data = data.astype(object).where(data.notnull(), "")
+    title = "History of " + tableClass[:-1].replace("_", " ") + " " + code
+    description = 'Archived revisions, newest first, with the fields each changed'
+    return render_template('history.html.j2', title=title, data=data,
+                           fields=fields, description=description,
+                           tableClass=tableClass, code=code, cursor=cursor,
+                           before=before, per_page=per_page)
+
+
+# Full-text search
+@main.route('/search', methods=['GET'])
+@is_logged_in
+def search():
+    query = request.args.get('q', '')
+    restricted = not (session['username'] == 'admin' or
+                      session.get('admin') == 'True' or
+                      session.get('reader') == 'True')
+    hits = search_items(query, session['username'], restricted=restricted)
+    title = "Search"
+    if restricted:
+        description = 'Searching work packages, tasks and deliverables you lead'
+    else:
+        description = 'Searching all work packages, tasks and deliverables'
+    return render_template('search.html.j2', title=title, query=query,
+                           hits=hits, description=description)
+
+
+# Completion dashboard (reads the precomputed rollups only)
+@main.route('/dashboard', methods=['GET'])
+@is_logged_in
+def dashboard():
+    wp_rollups = rollup_rows('work_package')
+    partner_rollups = rollup_rows('partner')
+    title = "Completion Dashboard"
+    description = ('Tasks and deliverables per work package and partner. '
+                   'Overdue items are past their month due and below 100%.')
+    return render_template('dashboard.html.j2', title=title,
+                           description=description, wp_rollups=wp_rollups,
+                           partner_rollups=partner_rollups)
+
+
+@main.route('/dashboard/check', methods=['GET'])
+@is_logged_in_as_admin
+def dashboard_check():
+    mismatches = check_rollups()
+    return jsonify(consistent=not mismatches,
+                   mismatches=[dict(zip(['scope', 'key', 'column', 'stored',
+                                         'expected'], m))
+                               for m in mismatches])
+
+
+# Overdue and soon-due tasks and deliverables
+@main.route('/overdue', methods=['GET'])
+@is_logged_in
+def overdue():
+    windows = current_app.config.get('OVERDUE_WINDOWS', [30])
+    days = request.args.get('days', windows[0], type=int)
+    if days not in windows:
+        days = windows[0]
+    if (session['username'] == 'admin' or session.get('admin') == 'True' or
+            session.get('reader') == 'True'):
+        queue = overdue_items(days=days)
+        description = 'All incomplete tasks and deliverables'
+    else:
+        queue = overdue_items(username=session['username'], days=days)
+        description = ('Incomplete tasks and deliverables for the partners '
+                       'and work packages you lead')
+    summary = queue_summary(queue)
+    queue.fillna(value="", inplace=True)
+    queue['month_due'] = pd.to_datetime(queue['month_due']).dt.strftime('%b %Y')
+    title = "Overdue and due within {} days".format(days)
+    return render_template('overdue.html.j2', title=title, data=queue,
+                           summary=summary, description=description,
+                           days=days, windows=windows)
+
+
 # Access settings for a given user
-@app.route('/access/<string:id>', methods=['GET', 'POST'])
+@main.route('/access/<string:id>', methods=['GET', 'POST'])
 @is_logged_in_as_admin
 def access(id):
     form = AccessForm(request.form)
@@ -1103,9 +1443,12 @@ def access(id):
         for partner in partners_to_add:
             db_row = Users2Partners(username=user.username, partner=partner)
             psql_insert(db_row, flashMsg=False)
+        # Every worker drops its cached permissions and queue for this user:
+        publish(('user', user.username), ('overdue', user.username))
+        db.session.commit()
         # Return with success
         flash('Edits successful', 'success')
-        return redirect(url_for('access', id=id))
+        return redirect(url_for('.access', id=id))
     # Pre-populate form fields with existing data:
     form.username.render_kw = {'readonly': 'readonly'}
     form.username.data = user.username
@@ -1115,7 +1458,7 @@ def access(id):
 
 
 # Login
-@app.route('/login', methods=["GET", "POST"])
+@main.route('/login', methods=["GET", "POST"])
 def login():
     WP = 'none'
     Ps = 'none'
@@ -1128,7 +1471,7 @@ def login():
         if user is not None:
             password = user.password
             # Compare passwords
-            if sha256_crypt.verify(password_candidate, password):
+            if passlib_hash.sha256_crypt.verify(password_candidate, password):
                 # Passed
                 session['logged_in'] = True
                 session['username'] = username
@@ -1166,42 +1509,42 @@ def login():
                     flash('You are now logged in', 'success')
             else:
                 flash('Incorrect password', 'danger')
-                return redirect(url_for('login'))
-            return redirect(url_for('index'))
+                return redirect(url_for('.login'))
+            return redirect(url_for('.index'))
         # Finally check admin account:
         if username == 'admin':
-            password = app.config['ADMIN_PWD']
+            password = current_app.config['ADMIN_PWD']
             if password_candidate == password:
                 # Passed
                 session['logged_in'] = True
                 session['username'] = 'admin'
                 # session['usertype'] = 'admin'
                 flash('You are now logged in as admin', 'success')
-                return redirect(url_for('index'))
+                return redirect(url_for('.index'))
             else:
                 flash('Incorrect password', 'danger')
-                return redirect(url_for('login'))
+                return redirect(url_for('.login'))
         # Username not found:
         flash('Username not found', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     if 'logged_in' in session:
         flash('Already logged in', 'warning')
-        return redirect(url_for('index'))
+        return redirect(url_for('.index'))
     # Not yet logged in:
     return render_template('login.html.j2', WP=WP, P=Ps)
 
 
 # Logout
-@app.route('/logout')
+@main.route('/logout')
 @is_logged_in
 def logout():
     session.clear()
     flash('You are now logged out', 'success')
-    return redirect(url_for('index'))
+    return redirect(url_for('.index'))
 
 
 # Change password
-@app.route('/change-pwd', methods=["GET", "POST"])
+@main.route('/change-pwd', methods=["GET", "POST"])
 @is_logged_in
 def change_pwd():
     form = ChangePwdForm(request.form)
@@ -1209,52 +1552,139 @@ def change_pwd():
         user = Users.query.filter_by(username=session['username']).first()
         password = user.password
         current = form.current.data
-        if sha256_crypt.verify(current, password):
-            user.password = sha256_crypt.encrypt(str(form.new.data))
+        if passlib_hash.sha256_crypt.verify(current, password):
+            user.password = passlib_hash.sha256_crypt.encrypt(str(form.new.data))
             db.session.commit()
             flash('Password changed', 'success')
-            return redirect(url_for('change_pwd'))
+            return redirect(url_for('.change_pwd'))
         else:
             flash('Current password incorrect', 'danger')
-            return redirect(url_for('change_pwd'))
+            return redirect(url_for('.change_pwd'))
     return render_template('change-pwd.html.j2', form=form)
 
 
-@app.route('/privacy', methods=["GET"])
+# Saved CPU profiles (see profiler.py)
+@main.route('/profiles', methods=['GET'])
+@is_logged_in_as_admin
+def profiles():
+    route = request.args.get('route')
+    if route is not None:
+        # Every profile of one route as a single flame graph input:
+        if profile_path(route) is None:
+            abort(404)
+        return Response(merged_profile(route), mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; '
+                                 'filename=' + route + '.folded'})
+    return render_template('profiles.html.j2', title='CPU profiles',
+                           profiles=list_profiles(),
+                           rate=current_app.config.get('PROFILE_SAMPLE_RATE'))
+
+
+@main.route('/profiles/<string:route>/<string:name>', methods=['GET'])
+@is_logged_in_as_admin
+def profile_file(route, name):
+    path = profile_path(route, name)
+    if path is None:
+        abort(404)
+    with open(path) as f:
+        return Response(f.read(), mimetype='text/plain',
+                        headers={'Content-Disposition':
+                                 'attachment; filename=' + name})
+
+
+# Slow SQL statements of this worker (see querylog.py)
+@main.route('/slow-queries', methods=['GET'])
+@is_logged_in_as_admin
+def slow_query_log():
+    entries = slow_queries()
+    if request.args.get('format') == 'json':
+        return jsonify(threshold=current_app.config.get('SLOW_QUERY_SECONDS'),
+                       queries=[dict(entry, date=entry['date'].isoformat(),
+                                     explained=entry['explained'].isoformat()
+                                     if entry['explained'] else None)
+                                for entry in entries])
+    return render_template('slow-queries.html.j2', title='Slow queries',
+                           entries=entries,
+                           summary=slow_query_summary(entries),
+                           threshold=current_app.config.get(
+                               'SLOW_QUERY_SECONDS'))
+
+
+@main.route('/slow-queries/clear', methods=['POST'])
+@is_logged_in_as_admin
+def slow_query_clear():
+    clear_slow_queries()
+    flash('Slow query log cleared', 'success')
+    return redirect(url_for('.slow_query_log'))
+
+
+# Peak memory per route and the biggest requests (see memory.py)
+@main.route('/memory', methods=['GET'])
+@is_logged_in_as_admin
+def memory_report_page():
+    routes, worst = memory_report()
+    if request.args.get('format') == 'json':
+        return jsonify(routes=routes,
+                       worst=[dict(entry, date=entry['date'].isoformat())
+                              for entry in worst])
+    return render_template('memory.html.j2', title='Memory use',
+                           routes=routes, worst=worst,
+                           rate=current_app.config.get('MEMORY_SAMPLE_RATE'),
+                           budget=current_app.config.get(
+                               'DATAFRAME_BUDGET_MB'),
+                           guard=current_app.config.get('DATAFRAME_GUARD'))
+
+
+@main.route('/memory/clear', methods=['POST'])
+@is_logged_in_as_admin
+def memory_clear():
+    clear_memory_report()
+    flash('Memory report cleared', 'success')
+    return redirect(url_for('.memory_report_page'))
+
+
+@main.route('/privacy', methods=["GET"])
 def privacy():
     return render_template('privacy.html.j2')
 
 
 # ssl
-@app.route('/.well-known/acme-challenge/0pQ9Y9nneRwz6xitl6qTxzdBRC38pHJYgw-ey0JMJgI')
+@main.route('/.well-known/acme-challenge/0pQ9Y9nneRwz6xitl6qTxzdBRC38pHJYgw-ey0JMJgI')
 def letsencrypt_check():
     return '0pQ9Y9nneRwz6xitl6qTxzdBRC38pHJYgw-ey0JMJgI.eo3R_jzJhz37owhBTH73qvPeAHxNjuWt8W-FQJOCpeg'
 
 
-@app.errorhandler(404)
+@main.app_errorhandler(404)
 def page_not_found(e):
     # note that we set the 404 status explicitly
     return render_template('404.html.j2'), 404
 
 
-@app.errorhandler(403)
+@main.app_errorhandler(403)
 def page_not_found(e):
     # note that we set the 403 status explicitly
     return render_template('403.html.j2'), 403
 
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def internal_error(error):
-    app.logger.error('Server Error: %s', (error))
+    current_app.logger.error('Server Error: %s', (error))
     db.session.rollback()
     return render_template('500.html.j2'), 500
 
 
-@app.errorhandler(Exception)
+@main.app_errorhandler(FrameTooLarge)
+def frame_too_large(e):
+    # Already logged by check_frame:
+    db.session.rollback()
+    return render_template('503.html.j2'), 503
+
+
+@main.app_errorhandler(Exception)
 def unhandled_exception(e):
-    app.logger.error('Unhandled Exception: %s', (e))
+    current_app.logger.error('Unhandled Exception: %s', (e))
     return render_template('500.html.j2'), 500
 
 
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
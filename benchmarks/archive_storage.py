@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+'''
+archive_storage.py:
+
+Storage benchmark for delta-encoded archives (deltas.py). Builds a synthetic
+task and deliverable history in a scratch SQLite database, measures it
+stored as full rows, re-encodes it as keyframes and deltas and measures it
+again. Every revision is then reconstructed and checked against the
+original, and the time to reconstruct the whole table, one code and an
+as-of replay window is reported.
+
+The history mimics real use: most edits move percent and rewrite the
+progress text, few touch the person responsible, papers or submission date.
+
+Example:
+    To use::
+        python benchmarks/archive_storage.py
+        python benchmarks/archive_storage.py --items 2000 --revisions 40
+'''
+import argparse
+import datetime as dt
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Chance that an edit changes each field:
+CHANGES = {'person_responsible': 0.05, 'progress': 0.6, 'percent': 0.8,
+           'papers': 0.1, 'paper_submission_date': 0.03}
+WORDS = ('model run completed data analysis draft report delayed field '
+         'campaign partners workshop forecast validation submitted review '
+         'awaiting results observations training').split()
+
+
+def synthetic_history(items, revisions, seed=1):
+    '''{tableClass: [full revision dicts]} in insertion order.'''
+    rng = random.Random(seed)
+    start = dt.date(2018, 1, 1)
+    state = {}
+    for i in range(items):
+        state[i] = {'code': ('T-' if i % 2 else 'D-') + str(i),
+                    'person_responsible': 'Person ' + str(rng.randrange(300)),
+                    'progress': ' '.join(rng.choice(WORDS)
+                                         for _ in range(25)),
+                    'percent': 0, 'papers': None,
+                    'paper_submission_date': None}
+    # Edits of all items interleave over time, as in the live archive:
+    edits = sorted((start + dt.timedelta(days=rng.randrange(3 * 365)), i)
+                   for i in range(items) for _ in range(revisions))
+    history = {'Tasks': [], 'Deliverables': []}
+    for date, i in edits:
+        item = state[i]
+        if rng.random() < CHANGES['person_responsible']:
+            item['person_responsible'] = 'Person ' + str(rng.randrange(300))
+        if rng.random() < CHANGES['progress']:
+            item['progress'] = ' '.join(rng.choice(WORDS)
+                                        for _ in range(rng.randrange(5, 60)))
+        if rng.random() < CHANGES['percent']:
+            item['percent'] = min(100, item['percent'] + rng.randrange(1, 10))
+        if rng.random() < CHANGES['papers']:
+            item['papers'] = 'doi:10.{}/{}'.format(rng.randrange(1000, 9999),
+                                                   rng.randrange(10 ** 6))
+        if rng.random() < CHANGES['paper_submission_date']:
+            item['paper_submission_date'] = date
+        history['Tasks' if i % 2 else 'Deliverables'].append(
+            dict(item, date_edited=date))
+    return history
+
+
+def database_bytes(db):
+    db.session.commit()
+    db.session.execute('VACUUM')
+    return db.session.execute('PRAGMA page_count').scalar() * \
+        db.session.execute('PRAGMA page_size').scalar()
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[3])
+    parser.add_argument('--items', type=int, default=1000,
+                        help='tasks plus deliverables')
+    parser.add_argument('--revisions', type=int, default=30,
+                        help='archive revisions per item')
+    args = parser.parse_args()
+    path = os.path.join(tempfile.mkdtemp(), 'archive.db')
+    os.environ.update({'APP_SETTINGS': 'config.DevelopmentConfig',
+                       'SECRET_KEY': 'benchmark', 'ADMIN_PWD': 'benchmark',
+                       'DATABASE_URL': 'sqlite:///' + path})
+    import pandas as pd
+    import SWIFTDBApp
+    from extensions import db
+    from swiftdb.api import bulk_insert
+    from deltas import DELTA_ARCHIVES, FIELDS, encode_history, history
+    app = SWIFTDBApp.create_app()
+    app.config['CACHE_BUS'] = False
+    with app.app_context():
+        db.create_all()
+        revisions = synthetic_history(args.items, args.revisions)
+        for tableClass, archive in DELTA_ARCHIVES.items():
+            bulk_insert(db.session, archive, revisions[tableClass])
+        rows = sum(len(r) for r in revisions.values())
+        full_bytes = database_bytes(db)
+        for tableClass in DELTA_ARCHIVES:
+            encode_history(db.session.connection(), tableClass)
+        delta_bytes = database_bytes(db)
+        print('{} revisions of {} items'.format(rows, args.items))
+        print('{:<14} {:>12} {:>12}'.format('', 'bytes', 'bytes/row'))
+        for name, size in [('full rows', full_bytes),
+                           ('deltas', delta_bytes)]:
+            print('{:<14} {:>12} {:>12.1f}'.format(name, size, size / rows))
+        print('delta / full: {:.2f}'.format(delta_bytes / full_bytes))
+        print()
+        for tableClass in DELTA_ARCHIVES:
+            df, seconds = timed(history, tableClass)
+            expected = pd.DataFrame(revisions[tableClass])
+            expected['id'] = range(1, len(expected) + 1)
+            got = df.sort_values('id').reset_index(drop=True)
+            matches = all(
+                (got[f].astype(str) == expected[f].astype(str)).all()
+                for f in FIELDS)
+            code = expected['code'].iloc[0]
+            _, one = timed(history, tableClass, code=code)
+            upto = expected['date_edited'].max()
+            _, window = timed(history, tableClass,
+                              after=upto - dt.timedelta(days=31), upto=upto)
+            print('{}: reconstructed {} rows in {:.3f}s, identical: {}; '
+                  'one code {:.1f}ms; last month {:.1f}ms'.format(
+                      tableClass, len(df), seconds, matches, one * 1000,
+                      window * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+'''
+import_time.py:
+
+Cold-start benchmark: time to import the models, the web app and to build
+the app, each in a fresh interpreter. Absolute times depend on the machine,
+so every target is also reported as a multiple of a bare interpreter start
+(python -c pass) measured in the same run, which is comparable across
+machines and CI runners.
+
+Example:
+    To use::
+        python benchmarks/import_time.py
+        python benchmarks/import_time.py --repeat 9 --top 15
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Settings so the app can be built without a real environment; nothing
+# connects to the database at import or create_app() time:
+ENVIRON = {'APP_SETTINGS': 'config.ProductionConfig',
+           'SECRET_KEY': 'benchmark', 'ADMIN_PWD': 'benchmark',
+           'DATABASE_URL': 'sqlite://'}
+TARGETS = [('interpreter', 'pass'),
+           ('swiftdb', 'import swiftdb'),
+           ('extensions', 'import extensions'),
+           ('SWIFTDBApp', 'import SWIFTDBApp'),
+           ('create_app()', 'import SWIFTDBApp; SWIFTDBApp.create_app()'),
+           ('create_app() + preload',
+            'import SWIFTDBApp, lazy; SWIFTDBApp.create_app(); lazy.preload()')]
+
+
+def environ():
+    env = dict(os.environ)
+    env.update(ENVIRON)
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+
+def time_once(code, env):
+    start = time.perf_counter()
+    subprocess.check_call([sys.executable, '-c', code], cwd=ROOT, env=env)
+    return time.perf_counter() - start
+
+
+def slowest_imports(code, env, top):
+    '''
+    (cumulative microseconds, module) for the slowest modules imported by
+    code. Nested modules are counted in their parents' times too.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, env=env, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[3])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='fresh interpreters per target (median used)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='slowest top-level imports listed (0 for none)')
+    args = parser.parse_args()
+    env = environ()
+    baseline = None
+    print('{:<24} {:>10} {:>10}'.format('target', 'median ms', 'x python'))
+    for name, code in TARGETS:
+        median = statistics.median(time_once(code, env)
+                                   for _ in range(args.repeat))
+        baseline = baseline or median
+        print('{:<24} {:>10.1f} {:>10.2f}'.format(name, median * 1000,
+                                                  median / baseline))
+    if args.top:
+        print('\nSlowest imports for create_app() (cumulative ms):')
+        for cumulative, module in slowest_imports(TARGETS[4][1], env,
+                                                  args.top):
+            print('{:>10.1f}  {}'.format(cumulative / 1000.0, module))
+
+
+if __name__ == '__main__':
+    main()
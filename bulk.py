@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+'''
+bulk.py:
+
+Batch progress updates of tasks and deliverables for partner leaders.
+
+A batch is a list of {'type': 'Tasks' | 'Deliverables', 'id': ..., field:
+value, ...} updates limited to the FIELDS below. The user's partners are
+looked up once and checked against every row; a batch containing any row
+the user may not edit is refused as a whole. Only fields whose value
+actually changes are written; each change log event (see changelog.py)
+holds every archived field of the updated row. Live rows and events are
+written in bulk in one transaction, and the archive projection and rollup
+refreshes are queued as jobs in it.
+
+Example:
+    To use::
+        result = apply_updates([{'type': 'Tasks', 'id': 3, 'percent': 80}],
+                               username='bob')
+'''
+import datetime as dt
+
+from extensions import db
+from jobs import schedule
+from changelog import event, record_changes
+from snapshots import FIELDS as ARCHIVED
+from swiftdb.models import Tasks, Deliverables
+
+ITEMS = {'Tasks': Tasks, 'Deliverables': Deliverables}
+FIELDS = ['person_responsible', 'progress', 'percent', 'papers']
+MAX_UPDATES = 2000
+
+
+def clean_update(update):
+    '''Validated (tableClass, id, {field: value}) for one update.'''
+    if not isinstance(update, dict):
+        raise ValueError('Each update must be an object')
+    tableClass = update.get('type')
+    if tableClass not in ITEMS:
+        raise ValueError('Unknown type: ' + str(tableClass))
+    try:
+        item_id = int(update.get('id'))
+    except (TypeError, ValueError):
+        raise ValueError('Missing or invalid id')
+    unknown = set(update) - set(FIELDS) - {'type', 'id'}
+    if unknown:
+        raise ValueError('Fields cannot be bulk updated: ' +
+                         ', '.join(sorted(unknown)))
+    values = {}
+    for field in FIELDS:
+        if field not in update:
+            continue
+        value = update[field]
+        if field == 'percent':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError('percent must be a whole number')
+            if not 0 <= value <= 100:
+                raise ValueError('percent must be between 0 and 100')
+        elif value is not None:
+            value = str(value)
+        values[field] = value
+    return tableClass, item_id, values
+
+
+def clean_updates(updates):
+    '''Validate a batch, merging repeated updates of the same item.'''
+    if not isinstance(updates, list) or not updates:
+        raise ValueError('Expected a non-empty list of updates')
+    if len(updates) > MAX_UPDATES:
+        raise ValueError('At most {} updates per batch'.format(MAX_UPDATES))
+    cleaned = {}
+    for update in updates:
+        tableClass, item_id, values = clean_update(update)
+        cleaned.setdefault((tableClass, item_id), {}).update(values)
+    return cleaned
+
+
+def load_rows(cleaned):
+    '''Current rows for every item in the batch, one query per table.'''
+    rows = {}
+    for tableClass, model in ITEMS.items():
+        ids = [i for (t, i) in cleaned if t == tableClass]
+        if ids:
+            for row in model.query.filter(model.id.in_(ids)):
+                rows[(tableClass, row.id)] = row
+    return rows
+
+
+def apply_updates(updates, username, partners=None):
+    '''
+    Apply a batch for username, who may edit items of partners (None means
+    every partner, i.e. admin). Returns a summary dict; raises ValueError
+    for an invalid batch, LookupError for unknown items and PermissionError
+    for items of other partners, with nothing written.
+    '''
+    cleaned = clean_updates(updates)
+    rows = load_rows(cleaned)
+    missing = sorted(key for key in cleaned if key not in rows)
+    if missing:
+        raise LookupError(missing)
+    if partners is not None:
+        partners = set(partners)
+        forbidden = sorted(key for key, row in rows.items()
+                           if row.partner not in partners)
+        if forbidden:
+            raise PermissionError(forbidden)
+    today = dt.date.today()
+    changes = {tableClass: [] for tableClass in ITEMS}
+    events = []
+    keys = set()
+    for (tableClass, item_id), values in sorted(cleaned.items()):
+        row = rows[(tableClass, item_id)]
+        changed = {field: value for field, value in values.items()
+                   if getattr(row, field) != value}
+        if not changed:
+            continue
+        changed['date_edited'] = today
+        changes[tableClass].append(dict(changed, id=item_id))
+        # The whole row after the update, as an item may have no earlier
+        # revision to take the other fields from:
+        values = dict((field, changed.get(field, getattr(row, field)))
+                      for field in ARCHIVED[tableClass])
+        events.append(event(tableClass, row.code, 'update', values, today))
+        keys.add((row.work_package, row.partner))
+    updated = 0
+    for tableClass, model in ITEMS.items():
+        if changes[tableClass]:
+            db.session.bulk_update_mappings(model, changes[tableClass])
+            updated += len(changes[tableClass])
+    if updated:
+        record_changes(events)
+        schedule('project_changes')
+    return {'updated': updated, 'unchanged': len(cleaned) - updated,
+            'keys': sorted(keys),
+            'items': [{'type': t, 'id': c['id'],
+                       'fields': sorted(f for f in c
+                                        if f in FIELDS)}
+                      for t in ITEMS for c in changes[t]]}
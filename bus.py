@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+'''
+bus.py:
+
+Cache invalidation bus keeping the in-process caches (cache.py) of every
+gunicorn worker coherent.
+
+A write publishes the cache keys it makes stale, e.g. ('user', 'bob') after
+an access change or ('wp_summary', 'WP-C1') after a task edit. On
+PostgreSQL publishing sends NOTIFY on the cache_bus channel with the keys;
+elsewhere it bumps the keys' rows in the cache_versions table. Either way
+it happens in the writer's transaction, so other workers only hear of the
+change once it is committed. NOTIFY takes no row locks, so concurrent
+edits publishing the same key (every task edit publishes ('overdue',))
+don't wait on each other; the versions, which do, are only used on SQLite,
+where writes are serialised anyway.
+
+Every worker runs a background listener that evicts just the published
+keys: LISTEN on PostgreSQL, or polling cache_versions for versions it has
+not seen on SQLite. If the listener loses its connection it clears the
+whole cache before resuming, so a missed message can't leave stale data.
+
+Example:
+    To use::
+        publish(('user', username), ('table', 'Partners'))
+        db.session.commit()
+'''
+import json
+import select
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, text
+
+from extensions import db
+from cache import cache_invalidate
+from swiftdb.models import Cache_Versions
+
+CHANNEL = 'cache_bus'
+_listener = None
+
+
+def _key(key):
+    return list(key) if isinstance(key, (tuple, list)) else [key]
+
+
+def publish(*keys):
+    '''
+    Announce that cached data under each key prefix is stale. Evicted here
+    straight away and in other workers once the caller commits.
+    '''
+    keys = [_key(key) for key in keys]
+    if not keys:
+        return
+    for key in keys:
+        cache_invalidate(tuple(key))
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                           {'channel': CHANNEL, 'payload': json.dumps(keys)})
+        return
+    version = (db.session.query(func.max(Cache_Versions.version)).scalar()
+               or 0) + 1
+    for key in keys:
+        name = json.dumps(key)
+        updated = (db.session.query(Cache_Versions)
+                   .filter(Cache_Versions.key == name)
+                   .update({'version': version}, synchronize_session=False))
+        if not updated:
+            db.session.add(Cache_Versions(key=name, version=version))
+
+
+def evict(keys):
+    for key in keys:
+        cache_invalidate(tuple(key))
+
+
+# ~~~~~~ LISTENERS ~~~~~~~ #
+
+def listen_postgres(app, timeout=5.0):
+    '''Evict keys as NOTIFY messages arrive, until the connection fails.'''
+    with app.app_context():
+        connection = db.engine.raw_connection()
+    try:
+        raw = connection.connection
+        raw.autocommit = True
+        cursor = raw.cursor()
+        cursor.execute('LISTEN ' + CHANNEL)
+        while True:
+            if select.select([raw], [], [], timeout) == ([], [], []):
+                continue
+            raw.poll()
+            while raw.notifies:
+                evict(json.loads(raw.notifies.pop(0).payload))
+    finally:
+        connection.close()
+
+
+def poll_versions(app, interval):
+    '''Evict keys whose version moved past the last one seen.'''
+    with app.app_context():
+        seen = (db.session.query(func.max(Cache_Versions.version)).scalar()
+                or 0)
+        db.session.remove()
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            rows = (db.session.query(Cache_Versions.key,
+                                     Cache_Versions.version)
+                    .filter(Cache_Versions.version > seen).all())
+            db.session.remove()
+        for key, version in rows:
+            evict([json.loads(key)])
+            seen = max(seen, version)
+
+
+def run_listener(app):
+    interval = app.config.get('CACHE_BUS_POLL_SECONDS', 2)
+    while True:
+        try:
+            with app.app_context():
+                dialect = db.engine.dialect.name
+            if dialect == 'postgresql':
+                listen_postgres(app)
+            else:
+                poll_versions(app, interval)
+        except Exception:
+            app.logger.exception('Cache bus listener failed, restarting')
+        # Messages may have been missed while disconnected:
+        cache_invalidate()
+        time.sleep(interval)
+
+
+def start_listener(app=None):
+    '''
+    Start this process's listener thread, once. Called on the first request
+    so that under gunicorn each forked worker gets its own.
+    '''
+    global _listener
+    app = app or current_app._get_current_object()
+    if not app.config.get('CACHE_BUS', True):
+        return
+    if _listener is not None and _listener.is_alive():
+        return
+    _listener = threading.Thread(target=run_listener, args=(app,),
+                                 name='cache-bus', daemon=True)
+    _listener.start()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''
+cache.py:
+
+Small in-process cache for query results shared between requests served by
+one worker. Entries expire after a TTL and write routes evict the keys they
+make stale by prefix, e.g. cache_invalidate('overdue').
+
+Example:
+    To use::
+        data = cache_get(key)
+        if data is None:
+            data = expensive_query()
+            cache_set(key, data, ttl=300)
+'''
+import threading
+import time
+
+_entries = {}
+_lock = threading.Lock()
+
+
+def _key(key):
+    return key if isinstance(key, tuple) else (key,)
+
+
+def cache_get(key):
+    '''Cached value for key, or None if missing or expired.'''
+    key = _key(key)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            del _entries[key]
+            return None
+        return value
+
+
+def cache_set(key, value, ttl=300):
+    '''Store value under key for ttl seconds.'''
+    with _lock:
+        _entries[_key(key)] = (time.time() + ttl, value)
+
+
+def cache_invalidate(prefix=None):
+    '''
+    Evict every key starting with prefix, or everything when prefix is None.
+    A tuple prefix matches the leading elements of tuple keys, e.g.
+    ('wp_summary', 'WP-C1') evicts one work package's cached pages.
+    '''
+    with _lock:
+        if prefix is None:
+            _entries.clear()
+            return
+        prefix = _key(prefix)
+        for key in [k for k in _entries if k[:len(prefix)] == prefix]:
+            del _entries[key]
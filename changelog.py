@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+'''
+changelog.py:
+
+Append-only change log of work package, task and deliverable edits, and
+the archive projections built from it.
+
+Every write path records a Change_Log event in the same transaction as the
+edit it describes: the insert, update or delete of one item, its
+date_edited and a JSON payload of the archived fields (snapshots.FIELDS)
+after the change. Events are never changed or removed, so the log alone
+says how every item came to its current state.
+
+The *_Archive tables and Counts are projections of the log. Each insert or
+update event is one archive revision, fields missing from its payload
+keeping the item's previous value, and Counts holds the revisions per code.
+Deletes are logged but project nothing; the archive keeps a deleted item's
+history. A reset starts a table's history over: its earlier events project
+nothing, as when populate_archvie.py reloads the archives. project() applies the events after the projection's watermark
+(the Projections table) and is run by the 'project_changes' job queued with
+every edit. rebuild() empties the projections and replays the whole log at
+once, vectorised: payloads become columns, missing fields are forward
+filled per code and the revisions are written in bulk as deltas (see
+deltas.py), after which snapshots and rollups are rebuilt too.
+
+Event ids come from a sequence, so on PostgreSQL a transaction can commit
+an event below one already projected. The projection stops at a gap in the
+ids until the event after it is SETTLE_SECONDS old; after that the gap is
+taken to be a rolled back transaction.
+
+For large replays, or to rebuild another database, the log can be dumped
+to a compressed columnar segment file (the cold tier's format, see cold.py)
+and replayed from it.
+
+The events themselves are defined in swiftdb/changelog.py, which the
+populate scripts use without the web app.
+
+Example:
+    To record an edit (projected by a job once committed)::
+        record_change('Tasks', 'T-R1.1.1', 'update', values)
+        schedule('project_changes')
+        db.session.commit()
+
+    To rebuild the archives from a dump::
+        python manage.py changelog --dump changes.npz
+        python manage.py changelog --rebuild --source changes.npz
+'''
+import datetime as dt
+import json
+
+from sqlalchemy import Date, Integer, bindparam, func, select
+
+from extensions import db
+from lazy import lazy_import
+from swiftdb.api import batches, bulk_insert
+from swiftdb.changelog import PROJECTION, REVISIONS, event
+from swiftdb.models import Change_Log, Projections, Counts, Snapshots, \
+    Snapshot_Rows
+from cold import cold_rows, drop_cold, read_segment, write_segment
+from deltas import (DELTA_ARCHIVES, encode_frame, encode_revisions,
+                    fill_from_last, latest_revisions, read_table, reconstruct)
+from snapshots import ARCHIVES, FIELDS, create_snapshot, refresh_snapshots
+from rollups import rebuild_rollups
+from bus import publish
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+# Events applied per projection pass, and rows per bulk write:
+BATCH_SIZE = 5000
+# Seconds before a gap in event ids is taken to be a rollback:
+SETTLE_SECONDS = 30
+
+
+# ~~~~~~ RECORDING ~~~~~~~ #
+
+def record_change(tableClass, code, action='update', values=None,
+                  date_edited=None):
+    '''Add an event to the session; it is logged when the caller commits.'''
+    row = Change_Log(**event(tableClass, code, action, values, date_edited))
+    db.session.add(row)
+    return row
+
+
+def record_changes(events, session=None):
+    '''Add event mappings (see event()) to a session (db's) in bulk.'''
+    return bulk_insert(session or db.session, Change_Log, events,
+                       batch_size=BATCH_SIZE)
+
+
+# ~~~~~~ READING ~~~~~~~ #
+
+def log_frame(after=0, limit=None):
+    '''Events with id above after, in id order.'''
+    query = (db.session.query(Change_Log).filter(Change_Log.id > after)
+             .order_by(Change_Log.id))
+    if limit is not None:
+        query = query.limit(limit)
+    return pd.read_sql(query.statement, db.session.connection())
+
+
+def dump_segment(path):
+    '''Write the whole log to a segment file. Returns the event count.'''
+    df = log_frame()
+    write_segment(path, df, Change_Log)
+    return len(df)
+
+
+def load_segment(path):
+    '''
+    Events of a dumped log, appending any missing from change_log (e.g. in
+    a new database) with their ids, plus events logged after the dump.
+    '''
+    df = read_segment(path, Change_Log)
+    df['id'] = df['id'].astype('int64')
+    df['recorded_at'] = pd.to_datetime(df['recorded_at'])
+    logged = db.session.query(func.max(Change_Log.id)).scalar() or 0
+    missing = df[df['id'] > logged]
+    if not missing.empty:
+        rows = missing.astype(object).where(missing.notnull(), None)
+        rows = rows.to_dict('records')
+        for row in rows:
+            row['id'] = int(row['id'])
+            row['recorded_at'] = row['recorded_at'].to_pydatetime()
+        bulk_insert(db.session, Change_Log, rows, batch_size=BATCH_SIZE)
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # Explicit ids don't advance the sequence:
+            db.session.execute(
+                "SELECT setval(pg_get_serial_sequence('change_log', 'id'), "
+                "(SELECT max(id) FROM change_log))")
+    dumped = int(df['id'].max()) if not df.empty else 0
+    later = log_frame(after=dumped)
+    return pd.concat([df, later], sort=False).reset_index(drop=True)
+
+
+# ~~~~~~ PROJECTION ~~~~~~~ #
+
+def revisions(events, tableClass, previous=None):
+    '''
+    Full archive revisions, in event order, for the insert and update
+    events of tableClass. A field an event doesn't record takes the code's
+    value from its earlier events, or from previous ({code: values}).
+    '''
+    fields = FIELDS[tableClass]
+    events = events[events['table_name'] == tableClass]
+    resets = events.loc[events['action'] == 'reset', 'id']
+    if len(resets):
+        events = events[events['id'] > resets.max()]
+    events = events[events['action'].isin(REVISIONS)]
+    payloads = [json.loads(p) if p else {} for p in events['payload']]
+    df = pd.DataFrame.from_records(payloads, columns=fields)
+    df.insert(0, 'event_id', events['id'].to_numpy(dtype='int64'))
+    df.insert(1, 'code', events['code'].to_numpy())
+    df.insert(2, 'date_edited', pd.to_datetime(
+        events['date_edited']).dt.date.to_numpy())
+    for field in fields:
+        df['_' + field] = [field in p for p in payloads]
+    if df.empty:
+        return df[['event_id', 'code', 'date_edited'] + fields]
+    if previous:
+        base = pd.DataFrame([dict(values, code=code)
+                             for code, values in previous.items()
+                             if code in set(df['code'])],
+                            columns=['code'] + fields)
+        base['event_id'] = 0
+        for field in fields:
+            base['_' + field] = True
+        df = pd.concat([base, df], sort=False)
+    df = (df.sort_values(['code', 'event_id'], kind='mergesort')
+          .reset_index(drop=True))
+    full = fill_from_last(df, dict((field, df['_' + field].to_numpy(
+        dtype=bool)) for field in fields))
+    full = full[full['event_id'] > 0].sort_values('event_id')
+    archive = ARCHIVES[tableClass]
+    for column in archive.__table__.columns:
+        if column.name == 'date_edited' or column.name not in fields:
+            continue
+        values = full[column.name]
+        if isinstance(column.type, Date):
+            dates = pd.to_datetime(values, errors='coerce')
+            full[column.name] = dates.dt.date.astype(object).where(
+                dates.notnull(), None)
+        elif isinstance(column.type, Integer):
+            full[column.name] = values.where(
+                values.isnull(), pd.to_numeric(values)).astype(object)
+    full['date_edited'] = full['date_edited'].where(
+        full['date_edited'].notnull(), None)
+    return full[['event_id', 'code', 'date_edited'] + fields].reset_index(
+        drop=True)
+
+
+def records(df, archive):
+    '''Row dicts of archive columns in df, nulls as None and ints as int.'''
+    columns = [c for c in archive.__table__.columns
+               if c.name != 'id' and c.name in df]
+    rows = df[[c.name for c in columns]].astype(object)
+    rows = rows.where(rows.notnull(), None).to_dict('records')
+    integers = [c.name for c in columns if isinstance(c.type, Integer)]
+    for row in rows:
+        for name in integers:
+            if row[name] is not None:
+                row[name] = int(row[name])
+    return rows
+
+
+def latest_values(tableClass, codes):
+    '''{code: archived fields of its latest database revision}.'''
+    if tableClass in DELTA_ARCHIVES:
+        return dict((code, values) for code, (values, since)
+                    in latest_revisions(db.session, tableClass,
+                                        codes).items())
+    table = ARCHIVES[tableClass].__table__
+    rank = func.row_number().over(partition_by=table.c.code,
+                                  order_by=table.c.id.desc()).label('rn')
+    ranked = (select([table, rank])
+              .where(table.c.code.in_(bindparam('codes', expanding=True)))
+              .alias('ranked'))
+    df = pd.read_sql(select([ranked]).where(ranked.c.rn == 1),
+                     db.session.connection(), params={'codes': list(codes)})
+    df = df.astype(object).where(df.notnull(), None)
+    return dict((row['code'], row) for row in
+                df[['code'] + FIELDS[tableClass]].to_dict('records'))
+
+
+def add_counts(counts):
+    '''Add {code: new revisions} to Counts.'''
+    for batch in batches(sorted(counts), BATCH_SIZE):
+        existing = dict((row.code, row) for row in
+                        Counts.query.filter(Counts.code.in_(batch)))
+        for code in batch:
+            if code in existing:
+                existing[code].count += counts[code]
+            else:
+                db.session.add(Counts(code=code, count=counts[code]))
+
+
+def projection_mark(name=PROJECTION):
+    '''The projection's watermark row, locked until the caller commits.'''
+    mark = (db.session.query(Projections).filter_by(name=name)
+            .with_for_update().first())
+    if mark is None:
+        mark = Projections(name=name)
+        db.session.add(mark)
+        db.session.flush()
+    return mark
+
+
+def settled(events, after):
+    '''
+    (events up to the first gap in ids whose next event is recent, whether
+    any were held back).
+    '''
+    if events.empty:
+        return events, False
+    ids = events['id'].to_numpy(dtype='int64')
+    gaps = np.nonzero(np.diff(np.concatenate([[after], ids])) != 1)[0]
+    cutoff = dt.datetime.utcnow() - dt.timedelta(seconds=SETTLE_SECONDS)
+    recorded = pd.to_datetime(events['recorded_at']).to_numpy()
+    recent = [i for i in gaps if recorded[i] > np.datetime64(cutoff)]
+    if not recent:
+        return events, False
+    return events.iloc[:recent[0]], True
+
+
+def project(limit=BATCH_SIZE):
+    '''
+    Apply up to limit events after the watermark to the archives and
+    Counts, then fold the new revisions into snapshots. Returns (events
+    applied, whether later events wait for a gap to settle).
+    '''
+    mark = projection_mark()
+    events, waiting = settled(log_frame(after=mark.event_id, limit=limit),
+                              mark.event_id)
+    if events.empty:
+        db.session.commit()
+        return 0, waiting
+    if (events['action'] == 'reset').any():
+        # Earlier revisions must go, which only a replay does:
+        rebuild()
+        return len(events), waiting
+    counts = {}
+    dates = []
+    keys = []
+    for tableClass, archive in ARCHIVES.items():
+        codes = events.loc[(events['table_name'] == tableClass) &
+                           events['action'].isin(REVISIONS), 'code'].unique()
+        if not len(codes):
+            continue
+        full = revisions(events, tableClass,
+                         previous=latest_values(tableClass, list(codes)))
+        bulk_insert(db.session, archive, encode_revisions(
+            db.session, tableClass, records(full, archive)))
+        for code, n in full['code'].value_counts().items():
+            counts[code] = counts.get(code, 0) + int(n)
+        dates += [date for date in full['date_edited'] if date is not None]
+        if tableClass in DELTA_ARCHIVES:
+            keys += [('series', tableClass, code) for code in codes]
+    add_counts(counts)
+    mark.event_id = int(events['id'].max())
+    mark.date_refreshed = dt.datetime.utcnow()
+    if keys:
+        publish(*keys)
+    db.session.commit()
+    if dates:
+        refresh_snapshots(since=min(dates))
+    return len(events), waiting
+
+
+def rebuild(source=None):
+    '''
+    Empty the archives (both tiers), Counts and snapshots and replay the
+    whole log into them, from the segment file source if given; then
+    recreate the snapshots that existed and the rollups. Returns
+    {tableClass: revisions written}.
+    '''
+    mark = projection_mark()
+    events = load_segment(source) if source is not None else log_frame()
+    taken = [(row.snapshot_date, row.label) for row in
+             Snapshots.query.order_by(Snapshots.snapshot_date)]
+    db.session.query(Snapshot_Rows).delete(synchronize_session=False)
+    db.session.query(Snapshots).delete(synchronize_session=False)
+    db.session.query(Counts).delete(synchronize_session=False)
+    written = {}
+    counts = []
+    for tableClass, archive in ARCHIVES.items():
+        db.session.execute(archive.__table__.delete())
+        full = revisions(events, tableClass)
+        stored = full
+        if tableClass in DELTA_ARCHIVES and not full.empty:
+            stored = encode_frame(full.sort_values(['code', 'event_id'])
+                                  .reset_index(drop=True))
+            stored = stored.sort_values('event_id')
+        written[tableClass] = bulk_insert(db.session, archive,
+                                          records(stored, archive),
+                                          batch_size=BATCH_SIZE)
+        counts.append(full['code'])
+    counts = pd.concat(counts).value_counts()
+    bulk_insert(db.session, Counts,
+                [{'code': code, 'count': int(n)}
+                 for code, n in counts.items()], batch_size=BATCH_SIZE)
+    if not events.empty:
+        mark.event_id = max(mark.event_id, int(events['id'].max()))
+    mark.date_refreshed = dt.datetime.utcnow()
+    db.session.commit()
+    # Cold rows are replaced by the rows just written:
+    for tableClass in ARCHIVES:
+        drop_cold(tableClass)
+    for date, label in taken:
+        create_snapshot(date, label)
+    rebuild_rollups()
+    publish(('series',))
+    db.session.commit()
+    return written
+
+
+# ~~~~~~ SEEDING ~~~~~~~ #
+
+def archive_revisions(bind, directory=None):
+    '''
+    {tableClass: full revisions (dicts) in id order} of every existing
+    archive row, both tiers (cold segments under directory, default
+    ARCHIVE_COLD_DIR), on a Connection; for swiftdb.changelog.seed_events().
+    '''
+    revisions = {}
+    for tableClass, archive in ARCHIVES.items():
+        df = pd.concat([cold_rows(tableClass, directory),
+                        read_table(bind, archive)],
+                       sort=False)
+        df = df.drop_duplicates('id', keep='last')
+        if tableClass in DELTA_ARCHIVES:
+            df = reconstruct(df)
+        df = df.sort_values('id')
+        df['date_edited'] = pd.to_datetime(df['date_edited']).dt.date
+        df = df[['code', 'date_edited'] + FIELDS[tableClass]].astype(object)
+        revisions[tableClass] = df.where(df.notnull(), None).to_dict('records')
+    return revisions
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+'''
+cold.py:
+
+Cold tier for old archive history. Archive revisions dated more than
+ARCHIVE_COLD_DAYS ago are moved out of the database into compressed
+columnar segment files under ARCHIVE_COLD_DIR, one directory per table.
+
+A segment is a compressed .npz file holding one array per column (plus a
+null mask for text and integer columns); values within a column are alike,
+so they compress far better than rows would. index.json lists every
+segment with its date and id range and row count; readers consult it
+first and only open segments overlapping the requested window. Segments
+never change once written, so decoded ones are kept in a small per-process
+LRU cache.
+
+archive_frame() is the single read path for snapshots and the reader pages:
+it combines database rows with cold rows for the same filters, so callers
+don't need to know where a revision lives. A revision can briefly be in
+both tiers if a move is interrupted; rows are de-duplicated by id.
+
+Moved rows exist only in the files, so move_to_cold() refuses to run
+(ColdDirNotShared) until an admin has confirmed the directory is on
+persistent storage shared by the web and worker processes, by creating
+the sentinel file SHARED_SENTINEL in it. A dyno's own filesystem must never
+be confirmed: its files are lost on restart and unseen by other dynos.
+
+Example:
+    To confirm the directory once it is mounted, then move old rows
+    (also run daily by the worker)::
+        touch $ARCHIVE_COLD_DIR/.shared
+        python manage.py cold
+
+    To read one code's history from both tiers::
+        df = archive_frame('Tasks', code='T-R1.1.1')
+'''
+import collections
+import datetime as dt
+import json
+import os
+import threading
+
+from flask import current_app
+from sqlalchemy import Integer, bindparam
+
+from extensions import db
+from lazy import lazy_import
+from swiftdb.api import batches
+from swiftdb.models import (Work_Packages_Archive, Tasks_Archive,
+                            Deliverables_Archive)
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+ARCHIVES = {'Work_Packages': Work_Packages_Archive,
+            'Tasks': Tasks_Archive,
+            'Deliverables': Deliverables_Archive}
+INDEX = 'index.json'
+# Created by an admin to confirm the directory is shared and persistent:
+SHARED_SENTINEL = '.shared'
+# Rows per segment file written by one move:
+SEGMENT_ROWS = 100000
+# Ids per DELETE once a segment is written:
+DELETE_BATCH = 5000
+# Decoded segments kept in memory per process:
+CACHED_SEGMENTS = 16
+
+_index = {'mtime': None, 'segments': {}}
+_segments = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+class ColdDirNotShared(Exception):
+    pass
+
+
+def cold_dir():
+    return current_app.config.get('ARCHIVE_COLD_DIR')
+
+
+def confirmed_shared(directory):
+    '''Whether an admin has confirmed directory as shared and persistent.'''
+    return os.path.isfile(os.path.join(directory, SHARED_SENTINEL))
+
+
+# ~~~~~~ SEGMENT FILES ~~~~~~~ #
+
+def write_segment(path, df, archive):
+    '''
+    Write df (all columns of archive) to a compressed columnar file. Only
+    date_edited is stored as a date; other date columns are kept as text,
+    as some databases hold them as strings.
+    '''
+    arrays = {}
+    for column in archive.__table__.columns:
+        values = df[column.name]
+        null = values.isnull().to_numpy()
+        if column.name == 'date_edited':
+            arrays[column.name] = pd.to_datetime(values).to_numpy(
+                dtype='datetime64[D]')
+        elif isinstance(column.type, Integer):
+            arrays[column.name] = values.fillna(0).to_numpy(dtype='int64')
+            arrays[column.name + '.null'] = null
+        else:
+            arrays[column.name] = values.fillna('').astype(str).to_numpy(
+                dtype='U')
+            arrays[column.name + '.null'] = null
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def read_segment(path, archive, columns=None):
+    '''DataFrame of the given columns (default all) of a segment file.'''
+    names = columns or [c.name for c in archive.__table__.columns]
+    data = {}
+    with np.load(path, allow_pickle=False) as arrays:
+        for name in names:
+            if name not in arrays:
+                # Column added since the segment was written:
+                data[name] = pd.Series([None] * len(arrays['id']),
+                                       dtype=object)
+                continue
+            values = arrays[name]
+            if values.dtype.kind == 'M':
+                dates = pd.Series(values.astype('datetime64[ns]'))
+                series = dates.dt.date.astype(object).where(dates.notnull(),
+                                                            None)
+            else:
+                series = pd.Series(values, dtype=object)
+                series[arrays[name + '.null']] = None
+            data[name] = series
+    return pd.DataFrame(data, columns=names)
+
+
+def segment(path, archive):
+    '''Whole decoded segment, from the per-process cache when possible.'''
+    with _lock:
+        if path in _segments:
+            _segments.move_to_end(path)
+            return _segments[path]
+    df = read_segment(path, archive)
+    with _lock:
+        _segments[path] = df
+        while len(_segments) > CACHED_SEGMENTS:
+            _segments.popitem(last=False)
+    return df
+
+
+# ~~~~~~ INDEX ~~~~~~~ #
+
+def load_index(directory=None):
+    '''{tableClass: [segment entries]}, re-read when index.json changes.'''
+    directory = directory or cold_dir()
+    path = os.path.join(directory or '', INDEX)
+    if not directory or not os.path.exists(path):
+        return {}
+    mtime = os.path.getmtime(path)
+    with _lock:
+        if _index['mtime'] != (path, mtime):
+            with open(path) as f:
+                _index['segments'] = json.load(f)
+            _index['mtime'] = (path, mtime)
+        return _index['segments']
+
+
+def save_index(directory, index):
+    path = os.path.join(directory, INDEX)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def cold_segments(tableClass, after=None, upto=None, min_id=None,
+                  max_id=None):
+    '''Index entries of segments that may hold rows in the window.'''
+    entries = []
+    for entry in load_index().get(tableClass, []):
+        if after is not None and entry['max_date'] <= after.isoformat():
+            continue
+        if upto is not None and entry['min_date'] > upto.isoformat():
+            continue
+        if min_id is not None and entry['max_id'] <= min_id:
+            continue
+        if max_id is not None and entry['min_id'] > max_id:
+            continue
+        entries.append(entry)
+    return entries
+
+
+def cold_bounds(tableClass):
+    '''(earliest date_edited, highest id) in the cold tier, or Nones.'''
+    entries = load_index().get(tableClass, [])
+    if not entries:
+        return None, None
+    first = min(entry['min_date'] for entry in entries)
+    return (dt.datetime.strptime(first, '%Y-%m-%d').date(),
+            max(entry['max_id'] for entry in entries))
+
+
+# ~~~~~~ READING ~~~~~~~ #
+
+def _window(df, code=None, after=None, upto=None, min_id=None, max_id=None,
+            codes=None, keyframes=False):
+    keep = pd.Series(True, index=df.index)
+    if code is not None:
+        keep &= df['code'] == code
+    if codes is not None:
+        keep &= df['code'].isin(codes)
+    if keyframes:
+        keep &= df['changed'].isnull()
+    if after is not None:
+        keep &= df['date_edited'] > after
+    if upto is not None:
+        keep &= df['date_edited'] <= upto
+    if min_id is not None:
+        keep &= df['id'] > min_id
+    if max_id is not None:
+        keep &= df['id'] <= max_id
+    return df[keep]
+
+
+def archive_frame(tableClass, code=None, after=None, upto=None, min_id=None,
+                  max_id=None, codes=None, keyframes=False):
+    '''
+    Archive revisions of tableClass from both tiers, optionally for one
+    code or a list of codes, with after < date_edited <= upto and min_id <
+    id <= max_id. Any bound left as None is open. keyframes limits delta
+    encoded tables (see deltas.py) to full rows. Rows are returned as
+    stored; deltas.history() fills in delta rows. date_edited is returned
+    as dates.
+    '''
+    archive = ARCHIVES[tableClass]
+    query = db.session.query(archive)
+    params = {}
+    if code is not None:
+        query = query.filter(archive.code == code)
+    if codes is not None:
+        codes = list(codes)
+        query = query.filter(archive.code.in_(bindparam('codes',
+                                                        expanding=True)))
+        params['codes'] = codes
+    if keyframes:
+        query = query.filter(archive.changed.is_(None))
+    if after is not None:
+        query = query.filter(archive.date_edited > after)
+    if upto is not None:
+        query = query.filter(archive.date_edited <= upto)
+    if min_id is not None:
+        query = query.filter(archive.id > min_id)
+    if max_id is not None:
+        query = query.filter(archive.id <= max_id)
+    # Read on the session's connection, so rows it has just written count:
+    df = pd.read_sql(query.statement, db.session.connection(), params=params)
+    df['date_edited'] = pd.to_datetime(df['date_edited']).dt.date
+    entries = cold_segments(tableClass, after, upto, min_id, max_id)
+    if not entries:
+        return df
+    directory = os.path.join(cold_dir(), tableClass)
+    frames = [_window(segment(os.path.join(directory, entry['file']),
+                              archive), code, after, upto, min_id, max_id,
+                      codes, keyframes)
+              for entry in entries]
+    cold = pd.concat(frames, sort=False)
+    if df.empty:
+        return cold.reset_index(drop=True)
+    df = pd.concat([cold, df], sort=False)
+    return df.drop_duplicates('id', keep='last').reset_index(drop=True)
+
+
+def cold_rows(tableClass, directory=None):
+    '''Every cold row of tableClass as stored, in id order.'''
+    archive = ARCHIVES[tableClass]
+    directory = directory or cold_dir()
+    frames = [read_segment(os.path.join(directory, tableClass,
+                                        entry['file']), archive)
+              for entry in load_index(directory).get(tableClass, [])]
+    if not frames:
+        return pd.DataFrame(columns=[c.name
+                                     for c in archive.__table__.columns])
+    df = pd.concat(frames, sort=False)
+    return df.sort_values('id').reset_index(drop=True)
+
+
+# ~~~~~~ TIERING ~~~~~~~ #
+
+def move_to_cold(before=None):
+    '''
+    Move archive rows dated before the date before (default today minus
+    ARCHIVE_COLD_DAYS) into new cold segments, then delete them from the
+    database. Returns {tableClass: rows moved}. Raises ColdDirNotShared
+    unless the directory has been confirmed (see SHARED_SENTINEL).
+    '''
+    directory = cold_dir()
+    if before is None:
+        days = current_app.config.get('ARCHIVE_COLD_DAYS')
+        if not days:
+            return {}
+        before = dt.date.today() - dt.timedelta(days=days)
+    if not confirmed_shared(directory):
+        raise ColdDirNotShared(
+            '{} is not confirmed as shared, persistent storage; mount it '
+            'and create {} in it'.format(
+                os.path.abspath(directory), SHARED_SENTINEL))
+    # Imported here, as deltas reads through this module:
+    from deltas import DELTA_ARCHIVES, keyframe_first
+    moved = {}
+    for tableClass, archive in ARCHIVES.items():
+        os.makedirs(os.path.join(directory, tableClass), exist_ok=True)
+        query = (db.session.query(archive)
+                 .filter(archive.date_edited < before)
+                 .order_by(archive.date_edited, archive.id)
+                 .limit(SEGMENT_ROWS))
+        moved[tableClass] = 0
+        while True:
+            # Each pass deletes what it read, so the next one moves on:
+            df = pd.read_sql(query.statement, db.session.connection())
+            if df.empty:
+                break
+            df['date_edited'] = pd.to_datetime(df['date_edited']).dt.date
+            entry = {'min_date': df['date_edited'].min().isoformat(),
+                     'max_date': df['date_edited'].max().isoformat(),
+                     'min_id': int(df['id'].min()),
+                     'max_id': int(df['id'].max()),
+                     'rows': len(df)}
+            entry['file'] = '{}_{}_{}_{}-{}.npz'.format(
+                tableClass, entry['min_date'], entry['max_date'],
+                entry['min_id'], entry['max_id'])
+            # File and index first, so a failed delete leaves rows in both
+            # tiers (de-duplicated on read) rather than in neither:
+            write_segment(os.path.join(directory, tableClass, entry['file']),
+                          df, archive)
+            index = dict(load_index(directory))
+            index[tableClass] = index.get(tableClass, []) + [entry]
+            save_index(directory, index)
+            delete = archive.__table__.delete().where(
+                archive.__table__.c.id.in_(bindparam('ids', expanding=True)))
+            for ids in batches([int(i) for i in df['id']], DELETE_BATCH):
+                db.session.execute(delete, {'ids': ids})
+            if tableClass in DELTA_ARCHIVES:
+                # The database rows left for these codes must start at a
+                # full row:
+                keyframe_first(tableClass, df['code'].unique())
+            db.session.commit()
+            moved[tableClass] += len(df)
+    return moved
+
+
+def drop_cold(tableClass):
+    '''
+    Remove every cold segment of tableClass, e.g. before its archive is
+    rebuilt from the change log. Returns the number of rows dropped.
+    '''
+    directory = cold_dir()
+    index = dict(load_index(directory))
+    entries = index.pop(tableClass, [])
+    if not entries:
+        return 0
+    save_index(directory, index)
+    for entry in entries:
+        path = os.path.join(directory, tableClass, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+        with _lock:
+            _segments.pop(path, None)
+    return sum(entry['rows'] for entry in entries)
@@ -1,14 +1,73 @@
 import os
+import tempfile
 
 
 class Config(object):
     DEBUG = False
     TESTING = False
     CSRF_ENABLED = True
-    SECRET_KEY = os.environ['SECRET_KEY']
-    ADMIN_PWD = os.environ['ADMIN_PWD']
-    SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+    SECRET_KEY = os.environ.get('SECRET_KEY')
+    ADMIN_PWD = os.environ.get('ADMIN_PWD')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional read replicas (comma separated), used by read-only pages:
+    SQLALCHEMY_REPLICA_URLS = [url for url in os.environ.get(
+        'DATABASE_REPLICA_URLS', '').split(',') if url]
+    # Seconds a user keeps reading from the primary after their own edit:
+    READ_YOUR_WRITES_SECONDS = 30
+    # Run background jobs in-process after each commit instead of in a
+    # worker (python manage.py worker):
+    JOBS_EAGER = False
+    # Seconds before a job left running by a dead worker is retried:
+    JOBS_TIMEOUT = 600
+    # Cross-worker cache invalidation (LISTEN/NOTIFY on Postgres, otherwise
+    # polling the cache_versions table every CACHE_BUS_POLL_SECONDS):
+    CACHE_BUS = True
+    CACHE_BUS_POLL_SECONDS = 2
+    # Where uploaded import files wait between preview and apply:
+    IMPORT_FOLDER = os.environ.get('IMPORT_FOLDER', tempfile.gettempdir())
+    # Archive tables are range partitioned by date_edited per 'year' or
+    # 'quarter' (PostgreSQL; read by the partitioning migration):
+    ARCHIVE_PARTITION_PERIOD = os.environ.get('ARCHIVE_PARTITION_PERIOD',
+                                              'year')
+    # Archive rows older than ARCHIVE_COLD_DAYS (unset: never) are moved to
+    # compressed files under ARCHIVE_COLD_DIR, which must be persistent and
+    # shared by web and worker; nothing moves until it holds a .shared file:
+    ARCHIVE_COLD_DAYS = int(os.environ.get('ARCHIVE_COLD_DAYS', 0)) or None
+    ARCHIVE_COLD_DIR = os.environ.get('ARCHIVE_COLD_DIR', 'cold_archive')
+    # Relative weight of each item type in weighted completion rollups:
+    ROLLUP_WEIGHTS = {'Tasks': 1, 'Deliverables': 2}
+    # Lookahead windows (days) offered on the overdue queue, first is default:
+    OVERDUE_WINDOWS = [30, 90, 180]
+    # Share of requests CPU profiled (admins can add ?profile=1 to any page),
+    # the seconds between stack samples, and where the newest PROFILE_KEEP
+    # profiles per route are kept:
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = 0.005
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_KEEP = 50
+    # SQL statements taking at least SLOW_QUERY_SECONDS (unset: none) are
+    # logged with their plan, the last SLOW_QUERY_BUFFER per process:
+    SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0)) or None
+    SLOW_QUERY_BUFFER = 200
+    # Share of requests whose peak memory is traced (admins can add ?memory=1
+    # to a URL), and how many of the biggest are kept per process:
+    MEMORY_SAMPLE_RATE = float(os.environ.get('MEMORY_SAMPLE_RATE', 0))
+    MEMORY_WORST = 20
+    # DataFrames over DATAFRAME_BUDGET_MB (unset: no limit) are logged, or
+    # refuse the request when DATAFRAME_GUARD is 'refuse':
+    DATAFRAME_BUDGET_MB = float(os.environ.get('DATAFRAME_BUDGET_MB', 0)) or None
+    DATAFRAME_GUARD = os.environ.get('DATAFRAME_GUARD', 'log')
+    # Share of requests traced (admins can add ?trace=1 to a URL), exported
+    # to TRACE_FILE ('jsonl') or an OTLP/HTTP collector at TRACE_ENDPOINT:
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0))
+    # Follow incoming W3C traceparent headers (only behind a gateway that
+    # sets or strips them, as clients could otherwise force tracing):
+    TRACE_TRUST_PARENT = os.environ.get('TRACE_TRUST_PARENT') == '1'
+    TRACE_EXPORT = os.environ.get('TRACE_EXPORT', 'jsonl')
+    TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+    TRACE_ENDPOINT = os.environ.get('TRACE_ENDPOINT',
+                                    'http://localhost:4318/v1/traces')
 
 
 class ProductionConfig(Config):
@@ -18,3 +77,4 @@ class ProductionConfig(Config):
 class DevelopmentConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
+    JOBS_EAGER = True
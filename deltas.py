@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+'''
+deltas.py:
+
+Delta-encoded revisions in Tasks_Archive and Deliverables_Archive.
+
+Most edits change one or two fields, yet a full archive row repeats all of
+them. A delta revision stores only the fields that differ from the code's
+previous revision (by id) and sets the changed bitmask to say which ones
+(FIELDS below, bit i for field i, so a field recorded as NULL is told apart
+from one not recorded). changed is NULL on a keyframe, a full row written
+every KEYFRAME_INTERVAL revisions of a code, for any code with no previous
+database revision, and for every row written before deltas existed. The
+first database row of each code is kept a keyframe as rows move to the cold
+tier (keyframe_first()), so SQL over the database alone, as in reporting.py
+and previous_reports(), can always reconstruct a field.
+
+history() is the read path: it returns full revisions for a window, reading
+back to the keyframe of each code that starts mid-chain. Reconstruction is
+vectorised: each field is forward filled from the last row that recorded
+it, per code. encode_revisions() turns new full revisions into rows to
+insert, and field_as_of() gives SQL the value of a field at a revision.
+
+previous_report of tasks and deliverables is no longer stored: it is the
+progress of the revision before the latest one, see previous_reports().
+Reports stored before (e.g. loaded from files) for items with fewer than
+two revisions are kept, and shown until the archive can derive one.
+
+Example:
+    To use::
+        rows = encode_revisions(db.session, 'Tasks', [values])
+        bulk_insert(db.session, Tasks_Archive, rows)
+        df = history('Tasks', code='T-R1.1.1')
+'''
+from sqlalchemy import select, func, and_, or_, bindparam
+
+from extensions import db
+from lazy import lazy_import
+from cold import archive_frame, cold_bounds
+from swiftdb.models import (Work_Packages_Archive, Tasks_Archive,
+                            Deliverables_Archive)
+
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+
+ARCHIVES = {'Work_Packages': Work_Packages_Archive,
+            'Tasks': Tasks_Archive,
+            'Deliverables': Deliverables_Archive}
+# Archive tables holding delta revisions:
+DELTA_ARCHIVES = {'Tasks': Tasks_Archive,
+                  'Deliverables': Deliverables_Archive}
+FIELDS = ['person_responsible', 'progress', 'percent', 'papers',
+          'paper_submission_date']
+BITS = dict((field, 1 << i) for i, field in enumerate(FIELDS))
+# A code gets a full row every this many revisions:
+KEYFRAME_INTERVAL = 16
+# Rows per UPDATE batch when re-encoding a table:
+BATCH_SIZE = 5000
+
+
+def is_delta(archive):
+    return archive in DELTA_ARCHIVES.values()
+
+
+def same(field, a, b):
+    '''Whether two stored values of field are equal (nulls included).'''
+    if pd.isnull(a) or pd.isnull(b):
+        return pd.isnull(a) and pd.isnull(b)
+    if field == 'percent':
+        return int(a) == int(b)
+    # Dates come back as dates or strings depending on the database:
+    return str(a) == str(b)
+
+
+# ~~~~~~ RECONSTRUCTION ~~~~~~~ #
+
+def fill_from_last(df, recorded):
+    '''
+    Copy of df (each code's rows in order) where every field of recorded,
+    {field: boolean array}, takes its value from the last row of the same
+    code up to and including this one that recorded it (else null).
+    '''
+    rows = pd.Series(np.arange(len(df)), index=df.index, dtype='float64')
+    full = df.copy()
+    for field, mask in recorded.items():
+        source = rows.where(mask).groupby(df['code']).ffill()
+        known = source.notnull().to_numpy()
+        values = np.full(len(df), None, dtype=object)
+        values[known] = df[field].to_numpy(dtype=object)[
+            source[known].to_numpy(dtype='int64')]
+        full[field] = values
+    return full
+
+
+def reconstruct(df):
+    '''
+    Full revisions for archive rows df, sorted by code and id. Each code's
+    rows must start at a keyframe; fields of a code with none stay null.
+    '''
+    df = df.sort_values(['code', 'id']).reset_index(drop=True)
+    if df.empty:
+        return df
+    keyframe = df['changed'].isnull().to_numpy()
+    changed = df['changed'].fillna(0).to_numpy(dtype='int64')
+    full = fill_from_last(df, dict(
+        (field, keyframe | ((changed & bit) != 0))
+        for field, bit in BITS.items()))
+    percent = full['percent']
+    full['percent'] = percent.where(percent.isnull(),
+                                    percent.fillna(0).astype(int))
+    return full
+
+
+def history(tableClass, code=None, codes=None, after=None, upto=None,
+            min_id=None, max_id=None):
+    '''
+    Full archive revisions of tableClass for the window of
+    cold.archive_frame(), from both tiers. Delta rows get the values of the
+    fields they didn't record from earlier revisions, read back to each
+    code's keyframe.
+    '''
+    df = archive_frame(tableClass, code=code, codes=codes, after=after,
+                       upto=upto, min_id=min_id, max_id=max_id)
+    if tableClass not in DELTA_ARCHIVES or df.empty:
+        return df
+    df = df.sort_values(['code', 'id'])
+    first = df.drop_duplicates('code').set_index('code')['id']
+    starts = df.drop_duplicates('code').set_index('code')['changed']
+    need = first[starts.notnull()]
+    if need.empty:
+        return reconstruct(df)
+    keyframes = archive_frame(tableClass, codes=need.index,
+                              max_id=int(need.max()), keyframes=True)
+    keyframes = keyframes[keyframes['id'] < keyframes['code'].map(need)]
+    bases = keyframes.groupby('code')['id'].max()
+    if bases.empty:
+        return reconstruct(df)
+    rows = archive_frame(tableClass, codes=bases.index,
+                         min_id=int(bases.min()) - 1,
+                         max_id=int(need.max()) - 1)
+    rows = rows[(rows['id'] >= rows['code'].map(bases)) &
+                (rows['id'] < rows['code'].map(need))]
+    full = reconstruct(pd.concat([rows, df], sort=False)
+                       .drop_duplicates('id'))
+    return full[full['id'].isin(df['id'])].reset_index(drop=True)
+
+
+def field_as_of(archive, revision, field, name):
+    '''
+    Scalar subquery: the value of field at the archive row revision.c.id,
+    i.e. from the latest row of the code up to it that recorded the field.
+    '''
+    table = archive.__table__.alias(name + '_' + field)
+    return (select([table.c[field]])
+            .where(and_(table.c.code == revision.c.code,
+                        table.c.id <= revision.c.id,
+                        or_(table.c.changed.is_(None),
+                            table.c.changed.op('&')(BITS[field]) != 0)))
+            .order_by(table.c.id.desc())
+            .limit(1)
+            .as_scalar())
+
+
+def previous_reports(tableClass, codes):
+    '''
+    {code: progress of the revision before the latest} for codes, the
+    previous_report shown for tasks and deliverables.
+    '''
+    codes = list(codes)
+    if not codes:
+        return {}
+    archive = DELTA_ARCHIVES[tableClass]
+    table = archive.__table__
+    rank = func.row_number().over(
+        partition_by=table.c.code,
+        order_by=(table.c.date_edited.desc(), table.c.id.desc())).label('rn')
+    ranked = (select([table.c.id, table.c.code, rank])
+              .where(table.c.code.in_(bindparam('codes', expanding=True)))
+              .alias('ranked'))
+    previous = select([ranked]).where(ranked.c.rn == 2).alias('previous')
+    query = select([previous.c.code,
+                    field_as_of(archive, previous, 'progress', 'previous')])
+    reports = dict(db.session.execute(query, {'codes': codes}).fetchall())
+    missing = [code for code in codes if code not in reports]
+    if missing and cold_bounds(tableClass)[0] is not None:
+        # Codes with fewer than two database revisions may have older ones
+        # in the cold tier:
+        df = history(tableClass, codes=missing)
+        df = df.sort_values(['date_edited', 'id'])
+        counts = df.groupby('code').size()
+        previous = df.groupby('code').tail(2).drop_duplicates('code')
+        previous = previous[previous['code'].map(counts) > 1]
+        reports.update(zip(previous['code'], previous['progress']))
+    return reports
+
+
+# ~~~~~~ ENCODING ~~~~~~~ #
+
+def latest_revisions(session, tableClass, codes):
+    '''
+    {code: (full values of its latest database revision, deltas written
+    since that code's last keyframe)} for codes with a keyframe among their
+    last KEYFRAME_INTERVAL revisions.
+    '''
+    table = DELTA_ARCHIVES[tableClass].__table__
+    rank = func.row_number().over(partition_by=table.c.code,
+                                  order_by=table.c.id.desc()).label('rn')
+    ranked = (select([table, rank])
+              .where(table.c.code.in_(bindparam('codes', expanding=True)))
+              .alias('ranked'))
+    query = select([ranked]).where(ranked.c.rn <= KEYFRAME_INTERVAL)
+    df = pd.read_sql(query, session.connection(),
+                     params={'codes': list(codes)})
+    keyframes = df[df['changed'].isnull()].groupby('code')['id'].max()
+    df = df[df['id'] >= df['code'].map(keyframes)]
+    if df.empty:
+        return {}
+    full = reconstruct(df)
+    since = full.groupby('code').size() - 1
+    latest = full.drop_duplicates('code', keep='last')
+    return dict((row['code'], (row, int(since[row['code']])))
+                for row in latest[['code'] + FIELDS].to_dict('records'))
+
+
+def encode_revisions(session, tableClass, revisions):
+    '''
+    Archive rows to insert for full revisions (dicts of archive columns),
+    as deltas against each code's latest revision where one is due. Other
+    archive tables get their revisions back unchanged.
+    '''
+    if tableClass not in DELTA_ARCHIVES or not revisions:
+        return revisions
+    latest = latest_revisions(session, tableClass,
+                              set(r['code'] for r in revisions))
+    rows = []
+    for revision in revisions:
+        code = revision['code']
+        row = dict(revision)
+        if code not in latest or latest[code][1] >= KEYFRAME_INTERVAL - 1:
+            row['changed'] = None
+            latest[code] = (revision, 0)
+        else:
+            values, since = latest[code]
+            row['changed'] = 0
+            for field, bit in BITS.items():
+                if same(field, revision.get(field), values.get(field)):
+                    row[field] = None
+                else:
+                    row['changed'] |= bit
+            latest[code] = (dict(values, **dict(
+                (f, revision.get(f)) for f in FIELDS)), since + 1)
+        rows.append(row)
+    return rows
+
+
+def encode_frame(full):
+    '''
+    Stored rows for full revisions (sorted by code and id): a keyframe
+    every KEYFRAME_INTERVAL revisions of a code and deltas in between.
+    '''
+    keyframe = full.groupby('code').cumcount() % KEYFRAME_INTERVAL == 0
+    stored = full.copy()
+    changed = pd.Series(0, index=full.index)
+    for field, bit in BITS.items():
+        values = full[field].astype(object)
+        previous = values.groupby(full['code']).shift()
+        differs = ~((values == previous) |
+                    (values.isnull() & previous.isnull()))
+        changed += differs.astype(int) * bit
+        stored[field] = values.where(keyframe | differs, None)
+    stored['changed'] = changed.astype(object).where(~keyframe, None)
+    return stored
+
+
+def _write(bind, archive, df, columns):
+    table = archive.__table__
+    update = (table.update()
+              .where(table.c.id == bindparam('_id'))
+              .values(dict((c, bindparam(c)) for c in columns)))
+    rows = df[['id'] + columns].astype(object)
+    rows = rows.where(rows.notnull(), None).to_dict('records')
+    for row in rows:
+        row['_id'] = int(row.pop('id'))
+        for c in ['percent', 'changed']:
+            if row[c] is not None:
+                row[c] = int(row[c])
+    for start in range(0, len(rows), BATCH_SIZE):
+        bind.execute(update, rows[start:start + BATCH_SIZE])
+    return len(rows)
+
+
+def read_table(bind, archive):
+    '''Every database row of an archive table, on a Connection.'''
+    df = pd.read_sql(select([archive.__table__]), bind)
+    return df.sort_values(['code', 'id']).reset_index(drop=True)
+
+
+def encode_history(bind, tableClass):
+    '''
+    Re-encode every database row of tableClass (on a Connection) as
+    keyframes and deltas. Returns the number of rows rewritten.
+    '''
+    archive = DELTA_ARCHIVES[tableClass]
+    stored = encode_frame(reconstruct(read_table(bind, archive)))
+    return _write(bind, archive, stored, FIELDS + ['changed'])
+
+
+def decode_history(bind, tableClass):
+    '''Rewrite every database row of tableClass as a full row.'''
+    archive = DELTA_ARCHIVES[tableClass]
+    full = reconstruct(read_table(bind, archive))
+    full['changed'] = None
+    return _write(bind, archive, full, FIELDS + ['changed'])
+
+
+def keyframe_first(tableClass, codes):
+    '''
+    Rewrite the first database row of each of codes as a keyframe if it is
+    a delta, e.g. once earlier rows have moved to the cold tier.
+    '''
+    archive = DELTA_ARCHIVES[tableClass]
+    table = archive.__table__
+    codes = list(codes)
+    if not codes:
+        return 0
+    firsts = (select([func.min(table.c.id)])
+              .where(table.c.code.in_(bindparam('codes', expanding=True)))
+              .group_by(table.c.code))
+    ids = [i for (i,) in db.session.execute(firsts, {'codes': codes})]
+    deltas = [i for (i,) in db.session.execute(
+        select([table.c.id]).where(and_(
+            table.c.id.in_(bindparam('ids', expanding=True)),
+            table.c.changed.isnot(None))), {'ids': ids})]
+    if not deltas:
+        return 0
+    full = history(tableClass, codes=codes, min_id=min(deltas) - 1,
+                   max_id=max(deltas))
+    full = full[full['id'].isin(deltas)].copy()
+    full['changed'] = None
+    return _write(db.session, archive, full, FIELDS + ['changed'])
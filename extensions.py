@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+'''
+extensions.py:
+
+Flask extensions created without an app, bound in create_app() (see
+SWIFTDBApp.py). db wraps the plain declarative base from the swiftdb
+package, so the models stay importable without Flask while the web app
+still gets db.session and Model.query. Its session routes read-only views
+to a replica when one is configured (see routing.py).
+'''
+from routing import RoutingSQLAlchemy
+from swiftdb import Base
+
+db = RoutingSQLAlchemy(model_class=Base)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+'''
+forms.py:
+
+WTForms classes for the SWIFT project management web app (see SWIFTDBApp.py).
+Form names follow the model they edit, e.g. Tasks_Form, so routes can look
+them up from the table name.
+'''
+from wtforms import validators, StringField, SelectField, TextAreaField
+from wtforms import Form as BaseForm
+from wtforms import IntegerField, PasswordField, SelectMultipleField, widgets
+from wtforms import BooleanField
+from wtforms.fields.html5 import DateField
+from wtforms_components import DateRange
+import datetime as dt
+
+from tracing import span
+
+
+class Form(BaseForm):
+    '''wtforms Form whose construction is a span of traced requests.'''
+
+    def __init__(self, *args, **kwargs):
+        with span('form', form=type(self).__name__):
+            BaseForm.__init__(self, *args, **kwargs)
+
+
+class Dateform(Form):
+    dat = DateField('DatePicker', format='%Y-%m-%d')
+
+
+class Period_Form(Form):
+    start = DateField('From', [validators.InputRequired()], format='%Y-%m-%d')
+    end = DateField('To', [validators.InputRequired()], format='%Y-%m-%d')
+
+
+class Import_Form(Form):
+    table = SelectField(u'Table', choices=[('Work_Packages', 'Work Packages'),
+                                          ('Tasks', 'Tasks'),
+                                          ('Deliverables', 'Deliverables')])
+    delete_missing = BooleanField(u'Delete rows whose code is not in the file')
+
+
+class Partners_Form(Form):
+    name = StringField(u'*Partner Name',
+                       [validators.InputRequired()],
+                       render_kw={"placeholder": "e.g. Leeds"})
+    country = StringField(u'Country',
+                          render_kw={"placeholder": "e.g. UK"})
+    role = StringField(u'Role', render_kw={"placeholder":
+                                           "e.g. 'Academic' or 'Operational'"})
+
+
+class Work_Packages_Form(Form):
+    code = StringField(u'*Work Package Code',
+                       [validators.InputRequired()],
+                       render_kw={"placeholder": "e.g. WP-C1"})
+    name = StringField(u'*Name',
+                       [validators.InputRequired()],
+                       render_kw={"placeholder": "e.g. Training"})
+    previous_report = TextAreaField(u'Previous Update',
+                          [validators.Optional()],
+                          render_kw={"placeholder": "auto filled previous submission"})
+    status = TextAreaField(u'Work Package Status',
+                         [validators.Optional()],
+                         render_kw={"placeholder": "e.g. Optional - Overview of Progress as a whole"})
+    issues = TextAreaField(u'Issues',
+                         [validators.Optional()],
+                         render_kw={"placeholder": "e.g. Optional - Highlight any potential issues or risks"})
+    next_deliverable = TextAreaField(u'Next Quarter Deliverables',
+                                   [validators.Optional()],
+                                   render_kw={"placeholder": "e.g. Upcomming deliverables due"})
+    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
+
+
+class Deliverables_Form(Form):
+    code = StringField(u'*Deliverable Code',
+                       [validators.InputRequired()],
+                       render_kw={"placeholder": "e.g. D-R1.1"})
+    work_package = SelectField(u'*Work Package',
+                               [validators.NoneOf(('blank'),
+                                                  message='Please select')])
+    description = TextAreaField(u'*Description',
+                                [validators.InputRequired()],
+                                render_kw={"placeholder": "e.g. Report on current state of knowledge regarding user needs for forecasts at different timescales in each sector."})
+    partner = SelectField(u'*Partner', [validators.NoneOf(('blank'),
+                                                          message='Please select')])
+    person_responsible = StringField(u'Person Responsible',
+                                   [validators.Optional()],
+                                   render_kw={"placeholder": "e.g. Name of person responsible"})
+    month_due = DateField(u'*Month Due', validators=[DateRange(min=dt.date(2017, 1, 1),
+                                         max=dt.date(2024, 1, 1))],
+                       render_kw={"placeholder": "must be YYYYMMDD Date String e.g. 2019-01-29"})
+    previous_report = TextAreaField(u'Previous Report',
+                             validators=[validators.Optional()])
+    progress = TextAreaField(u'Progress',
+                             validators=[validators.Optional()])
+    percent = IntegerField(u'*Percentage Complete',
+                           [validators.NumberRange(min=0, max=100,
+                                                   message="Must be between 0 and 100")])
+    papers = TextAreaField(u'Papers',
+                             validators=[validators.Optional()])
+    paper_submission_date = StringField(u'Paper Submission Date',
+                                validators=[validators.Optional()],
+                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
+    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
+
+
+class Your_Work_Packages_Form(Form):
+    code = StringField(u'Work Package Code')
+    name = StringField(u'Name')
+    previous_report = TextAreaField(u'Previous Update')
+    status = TextAreaField(u'Work Package Status',
+                         [validators.Optional()],
+                         render_kw={"placeholder": "e.g. Overview of Progress as a whole"})
+    issues = TextAreaField(u'Issues',
+                         [validators.Optional()],
+                         render_kw={"placeholder": "e.g. Highlight any potential issues or risks"})
+    next_deliverable = TextAreaField(u'Next Quarter Deliverables',
+                                   [validators.Optional()],
+                                   render_kw={"placeholder": "e.g. Upcomming deliverables due"})
+
+
+class Your_Deliverables_Form(Form):
+    code = StringField(u'Deliverable Code')
+    work_package = StringField(u'Work Package')
+    description = TextAreaField(u'Description')
+    partner = StringField(u'Partner')
+    person_responsible = StringField(u'*Person Responsible', validators=[validators.Optional()])
+    month_due = StringField(u'Month Due')
+    previous_report = TextAreaField(u'Previous Report')
+    progress = TextAreaField(u'Progress',
+                             validators=[validators.Optional()])
+    percent = IntegerField(u'*Percentage Complete',
+                           [validators.NumberRange(min=0, max=100,
+                                                   message="Must be between 0 and 100")])
+    papers = TextAreaField(u'Papers',
+                             validators=[validators.Optional()])
+    paper_submission_date = StringField(u'Paper Submission Date',
+                                validators=[validators.Optional()],
+                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
+
+
+class Users_Form(Form):
+    username = StringField('Username', [validators.Length(min=4, max=25)])
+    password = PasswordField('Password',
+                             [validators.Regexp('^([a-zA-Z0-9]{8,})$',
+                                                message='Password must be mimimum 8 characters and contain only uppercase letters, \
+        lowercase letters and numbers')])
+
+
+class ChangePwdForm(Form):
+    current = PasswordField('Current password', [validators.DataRequired()])
+    new = PasswordField('New password',
+                        [validators.Regexp('^([a-zA-Z0-9]{8,})$',
+                                           message='Password must be mimimum 8 characters and contain only uppercase letters, \
+        lowercase letters and numbers')])
+    confirm = PasswordField('Confirm new password',
+                            [validators.EqualTo('new',
+                                                message='Passwords do no match')])
+
+
+class MultiCheckboxField(SelectMultipleField):
+    widget = widgets.ListWidget(prefix_label=False)
+    option_widget = widgets.CheckboxInput()
+
+
+class AccessForm(Form):
+    username = StringField('Username')
+    AdminReader = MultiCheckboxField(
+        'ADMIN: (Grant Admin privileges):')
+    work_packages = MultiCheckboxField(
+        'WORK PACKAGE LEADERS: Can update Work Package progress and view associated Task and Deliverables:')
+    partners = MultiCheckboxField(
+        'PARTNER LEADER: Can update progress on tasks and deliverables for which they are the responsible partner:')
+
+
+class Tasks_Form(Form):
+    code = StringField(u'*Task Code',
+                       [validators.InputRequired()],
+                       render_kw={"placeholder": "e.g. T-R1.1.1"})
+    work_package = SelectField(u'*Work Package',
+                               [validators.NoneOf(('blank'),
+                                                  message='Please select')])
+    description = TextAreaField(u'*Description',
+                                [validators.InputRequired()],
+                                render_kw={"placeholder": "e.g. Report on current state of knowledge regarding user needs for forecasts at different timescales in each sector."})
+    partner = SelectField(u'*Partner', [validators.NoneOf(('blank'),
+                                                          message='Please select')])
+    person_responsible = StringField(u'*Person Responsible',
+                                   [validators.Optional()],
+                                   render_kw={"placeholder": "e.g. Name of person responsible"})
+    month_due = DateField(u'*Month Due', validators=[DateRange(min=dt.date(2017, 1, 1),
+                                         max=dt.date(2024, 1, 1))],
+                       render_kw={"placeholder": "must be YYYYMMDD Date String e.g. 2019-01-29"})
+    previous_report = TextAreaField(u'Previous Report',
+                             validators=[validators.Optional()])
+    progress = TextAreaField(u'Progress',
+                             validators=[validators.Optional()])
+    percent = IntegerField(u'*Percentage Complete',
+                           [validators.NumberRange(min=0, max=100,
+                                                   message="Must be between 0 and 100")])
+    papers = TextAreaField(u'Papers',
+                             validators=[validators.Optional()])
+    paper_submission_date = StringField(u'Paper Submission Date',
+                                validators=[validators.Optional()],
+                             render_kw={"placeholder": "Any Date String e.g. 01-12-2019 or June 2020"})
+    date_edited = StringField(u'Autogenerated edited date', render_kw={'readonly': 'readonly'})
+
+
+class Your_Tasks_Form(Form):
+    code = StringField(u'Task Code')
+    work_package = StringField(u'Work Package')
+    description = TextAreaField(u'Description')
+    partner = StringField(u'Partner')
+    person_responsible = StringField(u'Person Responsible', validators=[validators.Optional()])
+    month_due = StringField(u'Month Due')
+    previous_report = TextAreaField(u'Previous Report')
+    progress = TextAreaField(u'Progress',
+                             validators=[validators.Optional()])
+    percent = IntegerField(u'*Percentage Complete',
+                           [validators.NumberRange(min=0, max=100,
+                                                   message="Must be between 0 and 100")])
+    papers = TextAreaField(u'Papers',
+                             validators=[validators.Optional()])
+    paper_submission_date = StringField(u'Paper Submission Date',
+                                validators=[validators.Optional()],
+                             render_kw={"placeholder": "must be Date String e.g. 01-12-2019"})
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+'''
+gunicorn.conf.py:
+
+Gunicorn settings for the web app (see Procfile).
+
+The app is built once in the master (preload_app) and workers are forked
+from it, so the interpreter, Flask, SQLAlchemy, the models and the heavy
+modules deferred by lazy.py are shared copy-on-write instead of being
+imported again in every worker. create_app() opens no database connection,
+so no socket is shared across the fork; each worker connects on its first
+request.
+
+Example:
+    To use::
+        gunicorn -c gunicorn.conf.py "SWIFTDBApp:create_app()"
+'''
+import gc
+import os
+
+import lazy
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = True
+
+
+def on_starting(server):
+    # Import pandas, passlib etc. in the master so workers inherit them:
+    lazy.preload()
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's view, so gc
+    # passes in the workers don't touch (and so copy) the shared pages:
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
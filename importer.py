@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+'''
+importer.py:
+
+Admin bulk import of work packages, tasks and deliverables from .tab, .csv
+or .xlsx files.
+
+Files are read in chunks of CHUNK_SIZE rows (pandas read_csv chunks, or
+openpyxl's read-only row iterator for Excel), so only one chunk, the set of
+codes seen so far and a few example rows are held in memory however long
+the file is. Each chunk is validated column by column against the model:
+required values, integers, dates, known work packages and partners, and
+codes repeated within the file.
+
+An import reads the same uploaded file twice: preview_import() reports the
+inserts, updates and deletes by code, and apply_import() writes them as a
+batched upsert in the caller's transaction, logging each change (see
+changelog.py). The first row is taken as a
+header if it names a code column; otherwise columns are in the order of the
+model's constructor, as in the .tab files used by the populate scripts.
+
+Example:
+    To use::
+        report = preview_import('Tasks', '/tmp/tasks.csv')
+        if not report['n_errors']:
+            apply_import('Tasks', '/tmp/tasks.csv', delete_missing=True)
+            db.session.commit()
+'''
+import csv
+import datetime as dt
+import itertools
+import os
+
+from sqlalchemy import Date, Integer, bindparam, inspect
+
+from extensions import db
+from lazy import lazy_import
+from swiftdb.api import batches, bulk_upsert, constructor_fields
+from swiftdb.models import Work_Packages, Tasks, Deliverables
+from changelog import event, record_changes
+from snapshots import FIELDS as ARCHIVED
+
+pd = lazy_import('pandas')
+openpyxl = lazy_import('openpyxl')
+
+TABLES = {'Work_Packages': Work_Packages,
+          'Tasks': Tasks,
+          'Deliverables': Deliverables}
+# File extension -> delimiter (None for Excel):
+EXTENSIONS = {'.tab': '\t', '.tsv': '\t', '.csv': ',', '.xlsx': None}
+CHUNK_SIZE = 5000
+# Caps on what a report keeps, so huge files report in bounded memory:
+MAX_ERRORS = 100
+MAX_EXAMPLES = 50
+
+
+class InvalidFile(ValueError):
+    '''The file can't be imported: wrong type, columns or values.'''
+
+
+def import_columns(model):
+    '''Importable columns of model by name (everything but the id).'''
+    return dict((c.name, c) for c in inspect(model).columns if c.name != 'id')
+
+
+def header_name(name):
+    '''Column name for a header cell, e.g. "Person Responsible".'''
+    return str(name).strip().lower().replace(' ', '_')
+
+
+# ~~~~~~ READING ~~~~~~~ #
+
+def xlsx_rows(path):
+    '''Rows of the first sheet as tuples, skipping empty rows.'''
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            if any(value is not None for value in row):
+                yield row
+    finally:
+        workbook.close()
+
+
+def read_chunks(model, path, chunksize=CHUNK_SIZE):
+    '''
+    DataFrames of up to chunksize rows of the file at path, with columns
+    named after model columns and indexed by line number in the file.
+    '''
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in EXTENSIONS:
+        raise InvalidFile('Unsupported file type: ' + ext)
+    delimiter = EXTENSIONS[ext]
+    if delimiter is None:
+        rows = xlsx_rows(path)
+        first = next(rows, None)
+    else:
+        with open(path, 'r', newline='') as f:
+            first = next(csv.reader(f, delimiter=delimiter), None)
+    if first is None:
+        return
+    names = [header_name(c) for c in first if c is not None]
+    header = 'code' in names
+    fields = names if header else constructor_fields(model)[:len(first)]
+    known = import_columns(model)
+    unknown = [f for f in fields if f not in known]
+    if unknown:
+        raise InvalidFile('Unknown columns: ' + ', '.join(unknown))
+    missing = [name for name, column in known.items()
+               if not column.nullable and name not in fields]
+    if missing:
+        raise InvalidFile('Missing required columns: ' + ', '.join(missing))
+    if delimiter is None:
+        if not header:
+            rows = itertools.chain([first], rows)
+        chunks = (pd.DataFrame([list(row[:len(fields)]) +
+                                [None] * (len(fields) - len(row))
+                                for row in batch], columns=fields)
+                  for batch in batches(rows, chunksize))
+    else:
+        chunks = pd.read_csv(path, sep=delimiter, header=None, names=fields,
+                             skiprows=1 if header else 0, dtype=str,
+                             keep_default_na=False, chunksize=chunksize)
+    line = 2 if header else 1
+    for chunk in chunks:
+        chunk.index = range(line, line + len(chunk))
+        line += len(chunk)
+        yield chunk
+
+
+# ~~~~~~ VALIDATION ~~~~~~~ #
+
+def references(model):
+    '''{column name: set of allowed values} for each foreign key column.'''
+    refs = {}
+    for name, column in import_columns(model).items():
+        for fk in column.foreign_keys:
+            refs[name] = set(v for (v,) in db.session.query(fk.column))
+    return refs
+
+
+def convert(model, df):
+    '''
+    Convert a chunk's columns to their model types. Returns the converted
+    frame (blanks as null) and {column: boolean Series of bad values}.
+    '''
+    known = import_columns(model)
+    values = pd.DataFrame(index=df.index)
+    bad = {}
+    for name in df.columns:
+        raw = df[name]
+        stripped = raw.astype(str).str.strip()
+        blank = raw.isnull() | (stripped == '')
+        column_type = known[name].type
+        if isinstance(column_type, Integer):
+            number = pd.to_numeric(raw.where(~blank), errors='coerce')
+            bad[name] = ~blank & (number.isnull() | (number % 1 != 0))
+            values[name] = number
+        elif isinstance(column_type, Date):
+            date = pd.to_datetime(raw.where(~blank), errors='coerce')
+            bad[name] = ~blank & date.isnull()
+            values[name] = date.dt.date
+        else:
+            bad[name] = pd.Series(False, index=df.index)
+            values[name] = stripped.where(~blank)
+    return values, bad
+
+
+def validate(model, df, refs, seen):
+    '''
+    Converted chunk and a list of (line, column, value, error) problems.
+    seen is the set of codes in earlier chunks, updated in place.
+    '''
+    values, bad = convert(model, df)
+    checks = []
+    for name, column in import_columns(model).items():
+        if name not in values:
+            continue
+        checks.append((name, bad[name], 'not a valid ' +
+                       column.type.__class__.__name__.lower()))
+        if not column.nullable:
+            checks.append((name, values[name].isnull() & ~bad[name],
+                           'required'))
+        if name in refs:
+            checks.append((name, values[name].notnull() &
+                           ~values[name].isin(refs[name]),
+                           'unknown ' + name.replace('_', ' ')))
+    codes = values['code']
+    checks.append(('code', codes.notnull() &
+                   (codes.duplicated() | codes.isin(seen)),
+                   'code repeated in file'))
+    seen.update(codes.dropna())
+    problems = []
+    for name, mask, error in checks:
+        for line in mask[mask].index:
+            problems.append((line, name, df.at[line, name], error))
+    return values, sorted(problems, key=lambda p: (p[0], p[1]))
+
+
+# ~~~~~~ DIFF AND APPLY ~~~~~~~ #
+
+def changes(model, values):
+    '''
+    Split a converted chunk into inserts and updates against the live
+    table. Returns (inserts, updates, unchanged count); updates carry a
+    {column: (old, new)} dict under '_changes'.
+    '''
+    fields = list(values.columns)
+    codes = values['code'].tolist()
+    # An expanding parameter renders the IN list at execution time, which is
+    # far cheaper than building thousands of bind parameters per chunk:
+    query = (db.session.query(*[getattr(model, f) for f in fields])
+             .filter(model.code.in_(bindparam('codes', expanding=True))))
+    # Read on the session's connection, so earlier chunks are visible:
+    existing = pd.read_sql(query.statement, db.session.connection(),
+                           params={'codes': codes})
+    existing = convert(model, existing)[0]
+    existing = existing.set_index('code')
+    new = values.set_index('code')
+    is_new = ~new.index.isin(existing.index)
+    old = existing.reindex(new.index[~is_new])
+    current = new[~is_new]
+    differs = pd.DataFrame(index=current.index)
+    for name in [f for f in fields if f != 'code']:
+        differs[name] = ~((current[name] == old[name]) |
+                          (current[name].isnull() & old[name].isnull()))
+    changed = differs.any(axis=1).reindex(current.index, fill_value=False)
+    updates = current[changed].reset_index()
+    updates['_changes'] = [
+        dict((name, (old.at[code, name], current.at[code, name]))
+             for name in differs.columns if differs.at[code, name])
+        for code in updates['code']]
+    inserts = new[is_new].reset_index()
+    return inserts, updates, int((~changed).sum())
+
+
+def records(model, df):
+    '''Row dicts for bulk writes, with nulls as None and integers as int.'''
+    integers = [name for name, column in import_columns(model).items()
+                if isinstance(column.type, Integer) and name in df]
+    rows = df.drop(columns=['_changes'], errors='ignore').astype(object)
+    rows = rows.where(rows.notnull(), None).to_dict('records')
+    for row in rows:
+        for name in integers:
+            if row[name] is not None:
+                row[name] = int(row[name])
+    return rows
+
+
+def written_values(tableClass, codes):
+    '''{code: archived fields} of live rows, as the import left them.'''
+    model = TABLES[tableClass]
+    fields = ['code'] + ARCHIVED[tableClass]
+    query = (db.session.query(*[getattr(model, f) for f in fields])
+             .filter(model.code.in_(bindparam('codes', expanding=True))))
+    return dict((row[0], dict(zip(fields, row))) for row in
+                db.session.execute(query.statement, {'codes': list(codes)}))
+
+
+def change_events(tableClass, rows, action):
+    '''
+    Change log events for imported rows, holding every archived field of
+    the row as written: fields the file leaves out are read back from the
+    live table, as an item may have no earlier revision to take them from.
+    '''
+    if not rows:
+        return []
+    today = dt.date.today()
+    written = written_values(tableClass, [row['code'] for row in rows])
+    return [event(tableClass, row['code'], action, written[row['code']],
+                  row.get('date_edited') or today) for row in rows]
+
+
+def _example(row, changes=None):
+    example = {'code': row['code']}
+    if changes is not None:
+        example['changes'] = ', '.join(
+            '{}: {} -> {}'.format(name, '' if pd.isnull(old) else old,
+                                  '' if pd.isnull(new) else new)
+            for name, (old, new) in changes.items())
+    return example
+
+
+def run_import(tableClass, path, apply=False, delete_missing=False):
+    '''
+    Validate and diff the file chunk by chunk, writing each chunk's inserts
+    and updates when apply is set. Returns a report dict of counts, the
+    first MAX_ERRORS problems and MAX_EXAMPLES examples of each change.
+    '''
+    model = TABLES[tableClass]
+    refs = references(model)
+    seen = set()
+    report = {'table': tableClass, 'rows': 0, 'inserts': 0, 'updates': 0,
+              'unchanged': 0, 'deletes': 0, 'n_errors': 0, 'errors': [],
+              'examples': {'inserts': [], 'updates': [], 'deletes': []}}
+    for chunk in read_chunks(model, path):
+        report['rows'] += len(chunk)
+        values, problems = validate(model, chunk, refs, seen)
+        report['n_errors'] += len(problems)
+        report['errors'] += problems[:MAX_ERRORS - len(report['errors'])]
+        if report['n_errors']:
+            if apply:
+                raise InvalidFile('Line {}, {}: {}'.format(
+                    problems[0][0], problems[0][1], problems[0][3]))
+            # No diff once the file is known to be unusable:
+            continue
+        inserts, updates, unchanged = changes(model, values)
+        report['inserts'] += len(inserts)
+        report['updates'] += len(updates)
+        report['unchanged'] += unchanged
+        examples = report['examples']
+        for row in inserts.head(MAX_EXAMPLES - len(examples['inserts']))\
+                .to_dict('records'):
+            examples['inserts'].append(_example(row))
+        for row in updates.head(MAX_EXAMPLES - len(examples['updates']))\
+                .to_dict('records'):
+            examples['updates'].append(_example(row, row['_changes']))
+        if apply:
+            inserted = records(model, inserts)
+            updated = records(model, updates)
+            bulk_upsert(db.session, model, inserted + updated,
+                        batch_size=CHUNK_SIZE)
+            record_changes(
+                change_events(tableClass, inserted, 'insert') +
+                change_events(tableClass, updated, 'update'))
+    if report['n_errors']:
+        return report
+    missing = sorted(set(code for (code,) in db.session.query(model.code))
+                     - seen)
+    report['deletes'] = len(missing)
+    report['examples']['deletes'] = [{'code': code}
+                                     for code in missing[:MAX_EXAMPLES]]
+    if apply and delete_missing:
+        for batch in batches(missing, CHUNK_SIZE):
+            (db.session.query(model).filter(model.code.in_(batch))
+             .delete(synchronize_session=False))
+            record_changes([event(tableClass, code, 'delete',
+                                  date_edited=dt.date.today())
+                            for code in batch])
+    return report
+
+
+def preview_import(tableClass, path):
+    '''Report of what importing the file would change; nothing is written.'''
+    return run_import(tableClass, path)
+
+
+def apply_import(tableClass, path, delete_missing=False):
+    '''
+    Upsert the file's rows (and with delete_missing, delete rows whose code
+    is not in the file) without committing. Raises InvalidFile if any row
+    is invalid, after which the caller must roll back.
+    '''
+    return run_import(tableClass, path, apply=True,
+                      delete_missing=delete_missing)
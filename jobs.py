@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+'''
+jobs.py:
+
+Durable background jobs. Request handlers enqueue derived work (archive
+projection, snapshot and rollup refreshes) in the same transaction as the edit
+that causes it, so a job exists exactly when its edit was committed, and
+return without waiting for it. A worker process runs the jobs, retrying
+failures with exponential backoff up to each job's max_attempts.
+
+On PostgreSQL several workers can run side by side; each claims jobs with
+SELECT ... FOR UPDATE SKIP LOCKED. With JOBS_EAGER set (development and
+tests) no worker is needed: jobs run in-process right after the commit.
+
+The DAILY upkeep jobs queue their next run when they succeed. A worker
+also checks every DAILY_CHECK seconds that each one is queued or running,
+and queues it again a day after its last run otherwise, so a job that
+failed for good doesn't stop running until the worker is restarted.
+
+Example:
+    To start a worker::
+        python manage.py worker
+
+    To enqueue work from a handler::
+        enqueue('refresh_rollups', keys=[['WP-C1', 'Leeds']])
+        db.session.commit()
+        jobs_committed()
+'''
+import datetime as dt
+import json
+import os
+import socket
+import time
+import traceback
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from extensions import db
+from swiftdb.models import Jobs, Snapshots
+from snapshots import refresh_snapshots, ensure_month_end_snapshots
+from rollups import refresh_rollups, rebuild_rollups
+from partitions import ensure_partitions
+from cold import ColdDirNotShared, move_to_cold
+from changelog import SETTLE_SECONDS, BATCH_SIZE, project, record_change
+
+HANDLERS = {}
+# Daily upkeep jobs, and the config setting each needs (None: always):
+DAILY = {'ensure_partitions': None,
+         'month_end_snapshots': None,
+         'move_to_cold': 'ARCHIVE_COLD_DAYS'}
+# Seconds between a worker's checks that the daily jobs are queued:
+DAILY_CHECK = 3600
+
+
+def job(kind):
+    '''Register a function as the handler for jobs of kind.'''
+    def register(f):
+        HANDLERS[kind] = f
+        return f
+    return register
+
+
+def enqueue(kind, max_attempts=5, run_after=None, **payload):
+    '''
+    Add a job to the session. It is only queued once the caller commits,
+    together with the change it derives from, and runs no earlier than
+    run_after (UTC, default now).
+    '''
+    if kind not in HANDLERS:
+        raise ValueError('Unknown job kind: ' + kind)
+    row = Jobs(kind=kind, payload=json.dumps(payload, default=str),
+               run_after=run_after or dt.datetime.utcnow(),
+               max_attempts=max_attempts)
+    db.session.add(row)
+    return row
+
+
+def schedule(kind, run_after=None, **payload):
+    '''Enqueue a job unless one of the same kind is already queued.'''
+    queued = (db.session.query(Jobs.id)
+              .filter(Jobs.kind == kind, Jobs.status == 'queued').first())
+    if queued is None:
+        return enqueue(kind, run_after=run_after, **payload)
+
+
+def schedule_daily():
+    '''
+    Queue each DAILY job that is neither queued nor running, to run a day
+    after its last one finished (at once if it never ran). Returns the
+    kinds queued.
+    '''
+    queued = []
+    for kind, setting in DAILY.items():
+        if setting is not None and not current_app.config.get(setting):
+            continue
+        pending = (db.session.query(Jobs.id)
+                   .filter(Jobs.kind == kind,
+                           Jobs.status.in_(['queued', 'running'])).first())
+        if pending is not None:
+            continue
+        last = (db.session.query(func.max(Jobs.finished_at))
+                .filter(Jobs.kind == kind).scalar())
+        enqueue(kind, run_after=(last + dt.timedelta(days=1)
+                                 if last is not None else None))
+        queued.append(kind)
+    return queued
+
+
+def jobs_committed():
+    '''Call after committing enqueued jobs; runs them now in eager mode.'''
+    if current_app.config.get('JOBS_EAGER'):
+        work(burst=True)
+
+
+def backoff(attempts):
+    '''Seconds to wait before retry number attempts (30s, 1m, 2m, ...).'''
+    return min(30 * 2 ** (attempts - 1), 3600)
+
+
+def claim(worker):
+    '''
+    Mark the oldest runnable job as running and return it, or None. Jobs
+    left running by a dead worker are reclaimed after JOBS_TIMEOUT seconds.
+    '''
+    now = dt.datetime.utcnow()
+    timeout = current_app.config.get('JOBS_TIMEOUT', 600)
+    runnable = or_((Jobs.status == 'queued') & (Jobs.run_after <= now),
+                   (Jobs.status == 'running') &
+                   (Jobs.started_at < now - dt.timedelta(seconds=timeout)))
+    candidate = (db.session.query(Jobs.id, Jobs.status).filter(runnable)
+                 .order_by(Jobs.run_after, Jobs.id)
+                 .with_for_update(skip_locked=True).first())
+    if candidate is None:
+        db.session.rollback()
+        return None
+    # Conditional update, so two workers can't both take it (SQLite):
+    claimed = (db.session.query(Jobs)
+               .filter(Jobs.id == candidate.id,
+                       Jobs.status == candidate.status)
+               .update({'status': 'running', 'started_at': now,
+                        'attempts': Jobs.attempts + 1,
+                        'worker': worker},
+                       synchronize_session=False))
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.query(Jobs).get(candidate.id)
+
+
+def run_job(row):
+    '''Run one claimed job, recording success, a retry or a failure.'''
+    job_id, kind = row.id, row.kind
+    try:
+        HANDLERS[kind](**json.loads(row.payload or '{}'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        row = db.session.query(Jobs).get(job_id)
+        row.last_error = traceback.format_exc()
+        if row.attempts >= row.max_attempts:
+            row.status = 'failed'
+            row.finished_at = dt.datetime.utcnow()
+            current_app.logger.error('Job %s (%s) failed: %s', job_id, kind,
+                                     row.last_error)
+        else:
+            row.status = 'queued'
+            row.run_after = (dt.datetime.utcnow() +
+                             dt.timedelta(seconds=backoff(row.attempts)))
+        db.session.commit()
+        return False
+    row = db.session.query(Jobs).get(job_id)
+    row.status = 'done'
+    row.finished_at = dt.datetime.utcnow()
+    row.last_error = None
+    db.session.commit()
+    return True
+
+
+def work(burst=False, poll=2.0):
+    '''
+    Run jobs until stopped; with burst, until none are runnable. Returns
+    the number of jobs run.
+    '''
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    count = 0
+    checked = None
+    while True:
+        if not burst and (checked is None or
+                          time.time() - checked >= DAILY_CHECK):
+            schedule_daily()
+            db.session.commit()
+            checked = time.time()
+        row = claim(worker)
+        if row is None:
+            if burst:
+                return count
+            time.sleep(poll)
+            continue
+        run_job(row)
+        count += 1
+
+
+def purge(days=30):
+    '''Delete finished jobs older than days.'''
+    cutoff = dt.datetime.utcnow() - dt.timedelta(days=days)
+    deleted = (db.session.query(Jobs)
+               .filter(Jobs.status == 'done', Jobs.finished_at < cutoff)
+               .delete(synchronize_session=False))
+    db.session.commit()
+    return deleted
+
+
+# ~~~~~~ JOB KINDS ~~~~~~~ #
+
+@job('project_changes')
+def project_changes():
+    '''
+    Project logged changes into the archives (see changelog.py), and
+    queue the month-end snapshots if there are none yet, so as-of views
+    work without a worker's daily jobs (e.g. with JOBS_EAGER).
+    '''
+    while True:
+        applied, waiting = project()
+        if waiting:
+            # An earlier event may still commit; look again once settled:
+            schedule('project_changes', run_after=dt.datetime.utcnow() +
+                     dt.timedelta(seconds=SETTLE_SECONDS))
+            break
+        if applied < BATCH_SIZE:
+            break
+    if Snapshots.query.filter_by(label='base').first() is None:
+        schedule('month_end_snapshots')
+
+
+@job('archive')
+def archive(tableClass, values):
+    '''Log and project an edit queued before the change log existed.'''
+    record_change(tableClass, values['code'], 'update', values)
+    db.session.commit()
+    project_changes()
+
+
+@job('refresh_snapshots')
+def snapshots(since):
+    '''Fold archive rows dated on or after since into affected snapshots.'''
+    refresh_snapshots(since=since)
+
+
+@job('month_end_snapshots')
+def month_ends():
+    '''Create any missing base and month-end snapshots, then run tomorrow.'''
+    ensure_month_end_snapshots()
+    schedule('month_end_snapshots',
+             run_after=dt.datetime.utcnow() + dt.timedelta(days=1))
+
+
+@job('refresh_rollups')
+def rollups(keys):
+    '''Recompute rollups for (work_package, partner) pairs.'''
+    refresh_rollups([tuple(key) for key in keys])
+
+
+@job('rebuild_rollups')
+def all_rollups():
+    '''Recompute every rollup, e.g. after a bulk import.'''
+    rebuild_rollups()
+
+
+@job('ensure_partitions')
+def archive_partitions():
+    '''Create upcoming archive partitions, then run again tomorrow.'''
+    ensure_partitions(db.session,
+                      period=current_app.config.get('ARCHIVE_PARTITION_PERIOD',
+                                                    'year'))
+    schedule('ensure_partitions',
+             run_after=dt.datetime.utcnow() + dt.timedelta(days=1))
+
+
+@job('move_to_cold')
+def cold_tier():
+    '''Move old archive rows to the cold tier, then run again tomorrow.'''
+    try:
+        move_to_cold()
+    except ColdDirNotShared as e:
+        # Nothing was moved; keep checking in case it is confirmed later:
+        current_app.logger.warning('Cold tier skipped: %s', e)
+    schedule('move_to_cold',
+             run_after=dt.datetime.utcnow() + dt.timedelta(days=1))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+'''
+lazy.py:
+
+Deferred imports for heavy modules (pandas, passlib) so that importing the
+app, the models or a script costs only what is actually used.
+
+Under gunicorn with preload_app (see gunicorn.conf.py) preload() is called
+in the master before forking, so every worker inherits the imported modules
+copy-on-write instead of importing them again.
+
+Example:
+    To use::
+        pd = lazy_import('pandas')
+        df = pd.read_sql(...)  # pandas is imported here, on first use
+'''
+import importlib
+
+_registry = []
+
+
+class LazyModule(object):
+    '''Stand-in for a module that imports it on first attribute access.'''
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self.__dict__['_module'] is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self.__dict__['_module']
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'lazy'
+        return '<{} module {!r}>'.format(state, self._name)
+
+
+def lazy_import(name):
+    '''Module proxy for name; the real import happens on first use.'''
+    for module in _registry:
+        if module._name == name:
+            return module
+    module = LazyModule(name)
+    _registry.append(module)
+    return module
+
+
+def preload():
+    '''Import every lazily registered module now.'''
+    for module in _registry:
+        module._load()
@@ -2,14 +2,204 @@ import os
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from SWIFTDBApp import app, db
+from SWIFTDBApp import create_app
+from extensions import db
 
 
-migrate = Migrate(app, db)
-manager = Manager(app)
+def make_app():
+    app = create_app()
+    Migrate(app, db)
+    return app
+
+
+manager = Manager(make_app)
 
 manager.add_command('db', MigrateCommand)
 
 
+@manager.option('-d', '--date', dest='date', default=None,
+                help='Snapshot date YYYY-MM-DD (default: all missing month ends)')
+@manager.option('-l', '--label', dest='label', default='reporting',
+                help='Label stored with a dated snapshot')
+def snapshot(date, label):
+    """Materialise point-in-time project snapshots from the archive"""
+    from snapshots import create_snapshot, ensure_month_end_snapshots
+    if date is None:
+        created = ensure_month_end_snapshots()
+        print('Created {} month-end snapshot(s)'.format(len(created)))
+    else:
+        snapshot = create_snapshot(date, label=label)
+        print('Snapshot {} up to date'.format(snapshot.snapshot_date))
+
+
+
+@manager.option('-r', '--rebuild', dest='rebuild', action='store_true',
+                default=False, help='Repopulate an existing index')
+def search_index(rebuild):
+    """Create (or rebuild) the full-text search index"""
+    from search import ensure_search_index
+    ensure_search_index(rebuild=rebuild)
+    print('Search index up to date')
+
+
+
+@manager.option('-c', '--check', dest='check', action='store_true',
+                default=False, help='Only compare rollups with a recompute')
+def rollups(check):
+    """Rebuild (or check) the completion rollups"""
+    from rollups import rebuild_rollups, check_rollups
+    if not check:
+        rebuild_rollups()
+    mismatches = check_rollups()
+    for mismatch in mismatches:
+        print('{} {} {}: stored {} expected {}'.format(*mismatch))
+    print('{} mismatch(es)'.format(len(mismatches)))
+
+
+@manager.option('-a', '--ahead', dest='ahead', type=int, default=1,
+                help='Periods ahead of the current one to create')
+@manager.option('-d', '--detach-before', dest='before', default=None,
+                help='Detach partitions ending on or before YYYY-MM-DD')
+def partitions(ahead, before):
+    """Create upcoming archive partitions, or detach old ones (PostgreSQL)"""
+    from flask import current_app
+    from partitions import ensure_partitions, detach_partitions
+    from snapshots import to_date
+    if before is not None:
+        names = detach_partitions(db.session, to_date(before))
+    else:
+        names = ensure_partitions(
+            db.session, ahead=ahead,
+            period=current_app.config.get('ARCHIVE_PARTITION_PERIOD',
+                                          'year'))
+    db.session.commit()
+    for name in names:
+        print(name)
+    print('{} partition(s) {}'.format(
+        len(names), 'detached' if before is not None else 'created'))
+
+
+@manager.option('-b', '--before', dest='before', default=None,
+                help='Move rows dated before YYYY-MM-DD (default: older '
+                     'than ARCHIVE_COLD_DAYS)')
+def cold(before):
+    """Move old archive rows to compressed cold-tier files"""
+    from cold import ColdDirNotShared, move_to_cold
+    from snapshots import to_date
+    try:
+        moved = move_to_cold(to_date(before) if before is not None else None)
+    except ColdDirNotShared as e:
+        print(e)
+        return
+    for tableClass, n in moved.items():
+        print('{}: {} row(s) moved'.format(tableClass, n))
+    if not moved:
+        print('Set ARCHIVE_COLD_DAYS or pass --before')
+
+
+@manager.option('-d', '--dump', dest='dump', default=None,
+                help='Write the change log to this segment file')
+@manager.option('-r', '--rebuild', dest='rebuild', action='store_true',
+                help='Rebuild archives, counts and snapshots from the log')
+@manager.option('-s', '--source', dest='source', default=None,
+                help='Segment file to rebuild from (with --rebuild)')
+def changelog(dump, rebuild, source):
+    """Project pending change log events, or dump or replay the log"""
+    from changelog import dump_segment, project, rebuild as replay
+    if dump:
+        print('Dumped {} events to {}'.format(dump_segment(dump), dump))
+    elif rebuild:
+        for tableClass, rows in replay(source=source).items():
+            print('{}: {} revisions'.format(tableClass, rows))
+    else:
+        total = 0
+        while True:
+            applied, waiting = project()
+            total += applied
+            if waiting or not applied:
+                break
+        print('Projected {} events'.format(total))
+
+
+@manager.option('-b', '--base', dest='base', required=True,
+                help='Snapshot to restore: BACKUP/csvs date (YYYYMMDD), '
+                     'directory of CSVs, .xlsx or live')
+@manager.option('-c', '--cutoff', dest='cutoff', required=True,
+                help='Keep current rows edited on or after YYYY-MM-DD')
+@manager.option('-n', '--current', dest='current', default='live',
+                help='Snapshot with the changes to keep (default: live)')
+@manager.option('-a', '--apply', dest='apply', action='store_true',
+                help='Write the restore (default: dry run)')
+@manager.option('-r', '--report', dest='report', default=None,
+                help='Also write the report as JSON to this file')
+def restore(base, cutoff, current, apply, report):
+    """Restore tables from a backup, keeping changes since a cutoff"""
+    import json
+    from jobs import jobs_committed
+    from restore import restore as run_restore, format_report
+    result = run_restore(base, cutoff, current=current, apply=apply)
+    if apply:
+        db.session.commit()
+        jobs_committed()
+    print('\n'.join(format_report(result)))
+    if report:
+        with open(report, 'w') as f:
+            json.dump(result, f, indent=1, default=str)
+    if not apply:
+        print('Dry run: nothing was changed (pass --apply to write)')
+
+
+@manager.option('-b', '--burst', dest='burst', action='store_true',
+                default=False, help='Exit once no jobs are runnable')
+@manager.option('-p', '--purge', dest='purge', type=int, default=None,
+                help='Only delete finished jobs older than PURGE days')
+def worker(burst, purge):
+    """Run queued background jobs (archive rows, snapshots, rollups)"""
+    from jobs import work, purge as purge_jobs, schedule_daily
+    if purge is not None:
+        print('Deleted {} finished job(s)'.format(purge_jobs(purge)))
+        return
+    # Daily upkeep, rescheduled by the jobs themselves (and by the worker
+    # if one fails for good):
+    schedule_daily()
+    db.session.commit()
+    print('Ran {} job(s)'.format(work(burst=burst)))
+
+
+@manager.option('-f', '--file', dest='path', default=None,
+                help='JSON-lines trace file (default: TRACE_FILE)')
+@manager.option('-i', '--id', dest='trace_id', default=None,
+                help='Request ID (X-Request-ID) of the trace to print')
+@manager.option('-n', '--slowest', dest='slowest', type=int, default=1,
+                help='Print the N slowest traces (without --id)')
+def traces(path, trace_id, slowest):
+    """Print the span tree of traced requests (default: the slowest)"""
+    from flask import current_app
+    from tracing import read_traces, root_span, duration_ms, format_trace
+    records = list(read_traces(path or current_app.config['TRACE_FILE']))
+    if trace_id:
+        records = [r for r in records if r['trace_id'] == trace_id]
+    else:
+        records = sorted((r for r in records if root_span(r)),
+                         key=lambda r: duration_ms(root_span(r)),
+                         reverse=True)[:slowest]
+    for record in records:
+        print(format_trace(record))
+    if not records:
+        print('No matching traces')
+
+
+@manager.option('-p', '--port', dest='port', type=int, default=4318,
+                help='Port to receive OTLP/HTTP JSON on')
+@manager.option('-o', '--out', dest='out', default='traces.jsonl',
+                help='JSON-lines file to append received traces to')
+def trace_collector(port, out):
+    """Receive traces (TRACE_EXPORT=otlp) and append them to a file"""
+    from tracing import run_collector
+    print('Collecting traces on http://127.0.0.1:{}/v1/traces into {}'
+          .format(port, out))
+    run_collector(port, out)
+
+
 if __name__ == '__main__':
     manager.run()
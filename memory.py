@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+'''
+memory.py:
+
+Per-route memory accounting and DataFrame size guards, for finding the
+pages (view, task_reader, deliverables_reader...) whose pandas copies make
+workers balloon.
+
+A request is tracked when an admin adds ?memory=1 to its URL, or at random
+with probability MEMORY_SAMPLE_RATE. A tracked request runs with
+tracemalloc on, so its peak is the most memory Python allocated at once
+while it ran; frames passed to check_frame() are also noted with their
+size and the memory traced at that point, which shows which stage
+(psql_to_pandas, fillna, drop_duplicates...) the peak came from.
+tracemalloc slows the request down several times, so only one request per
+process is tracked at a time, and the peak of a threaded server also
+counts the other requests' allocations (gunicorn's sync workers run one
+request each).
+
+check_frame() enforces DATAFRAME_BUDGET_MB on every request: a frame over
+budget is logged, and with DATAFRAME_GUARD = 'refuse' the request is
+stopped with FrameTooLarge (a 503) before more copies of it are made.
+When no budget is set and the request isn't tracked it returns at once.
+
+Per-route totals and the MEMORY_WORST biggest requests are kept per
+process and shown on the admin page /memory.
+
+Example:
+    To measure one page::
+        /view/Tasks?memory=1
+
+    To refuse requests building frames over 500MB::
+        export DATAFRAME_BUDGET_MB=500 DATAFRAME_GUARD=refuse
+'''
+import datetime as dt
+import heapq
+import itertools
+import random
+import threading
+import tracemalloc
+
+from flask import current_app, g, has_request_context, request, session
+
+MEMORY_ARG = 'memory'
+# Never tracked (the report itself and static files):
+SKIPPED = ('main.memory_report_page', 'static')
+MB = 1024 ** 2
+
+_routes = {}
+_worst = []
+_order = itertools.count()
+_lock = threading.Lock()
+# Held by the one request being traced:
+_tracing = threading.Lock()
+
+
+class FrameTooLarge(Exception):
+    pass
+
+
+def endpoint():
+    return (request.endpoint or 'unknown').replace('main.', '', 1)
+
+
+def route_stats(route):
+    '''Running totals of a route (call with _lock held).'''
+    return _routes.setdefault(route, {
+        'route': route, 'count': 0, 'total_peak': 0, 'max_peak': 0,
+        'max_frame': 0, 'over_budget': 0, 'refused': 0})
+
+
+# ~~~~~~ DATAFRAME GUARD ~~~~~~~ #
+
+def budget():
+    megabytes = current_app.config.get('DATAFRAME_BUDGET_MB')
+    return megabytes * MB if megabytes else None
+
+
+def frame_bytes(df):
+    '''Memory held by a frame, strings included.'''
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def check_frame(df, stage):
+    '''
+    Note the size of a frame built by the current request and enforce the
+    DataFrame budget on it; returns df.
+    '''
+    if not has_request_context():
+        return df
+    limit = budget()
+    frames = g.get('memory_frames')
+    if limit is None and frames is None:
+        return df
+    size = frame_bytes(df)
+    if frames is not None:
+        frames.append({'stage': stage, 'rows': len(df), 'bytes': size,
+                       'traced': tracemalloc.get_traced_memory()[0]})
+    if limit is None or size <= limit:
+        return df
+    refuse = current_app.config.get('DATAFRAME_GUARD') == 'refuse'
+    current_app.logger.warning(
+        'DataFrame over budget: %s %s %s (%d rows, %.1fMB > %.1fMB)',
+        request.method, request.path, stage, len(df), size / MB, limit / MB)
+    with _lock:
+        stats = route_stats(endpoint())
+        stats['over_budget'] += 1
+        stats['refused'] += refuse
+        stats['max_frame'] = max(stats['max_frame'], size)
+    if refuse:
+        g.memory_refused = True
+        raise FrameTooLarge('{} frame of {} is {:.1f}MB'.format(
+            stage, request.path, size / MB))
+    return df
+
+
+# ~~~~~~ REQUEST HOOKS ~~~~~~~ #
+
+def wanted():
+    '''Whether to track the current request's memory.'''
+    rate = current_app.config.get('MEMORY_SAMPLE_RATE')
+    if rate and random.random() < rate:
+        return True
+    return (MEMORY_ARG in request.args and
+            (session.get('username') == 'admin' or
+             session.get('admin') == 'True'))
+
+
+def start_tracking():
+    if request.endpoint in SKIPPED or not wanted():
+        return
+    if not _tracing.acquire(blocking=False):
+        return
+    if tracemalloc.is_tracing():
+        # Started by someone else (PYTHONTRACEMALLOC), so not ours to stop:
+        _tracing.release()
+        return
+    tracemalloc.start()
+    g.memory_frames = []
+
+
+def stop_tracking(exc=None):
+    frames = g.pop('memory_frames', None)
+    if frames is None:
+        return
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    _tracing.release()
+    record({'date': dt.datetime.utcnow(), 'route': endpoint(),
+            'path': request.full_path.rstrip('?'), 'peak': peak,
+            'frames': frames, 'refused': g.get('memory_refused', False)})
+
+
+def init_memory(app):
+    '''Register the hooks that track flagged and sampled requests.'''
+    app.before_request(start_tracking)
+    app.teardown_request(stop_tracking)
+
+
+def record(entry):
+    largest = max([f['bytes'] for f in entry['frames']] or [0])
+    keep = current_app.config.get('MEMORY_WORST', 20)
+    with _lock:
+        stats = route_stats(entry['route'])
+        stats['count'] += 1
+        stats['total_peak'] += entry['peak']
+        stats['max_peak'] = max(stats['max_peak'], entry['peak'])
+        stats['max_frame'] = max(stats['max_frame'], largest)
+        item = (entry['peak'], next(_order), entry)
+        if len(_worst) < keep:
+            heapq.heappush(_worst, item)
+        elif item > _worst[0]:
+            heapq.heapreplace(_worst, item)
+
+
+# ~~~~~~ REPORT ~~~~~~~ #
+
+def memory_report():
+    '''(routes by worst peak, worst requests by peak), sizes in bytes.'''
+    with _lock:
+        routes = [dict(stats, mean_peak=(stats['total_peak'] // stats['count']
+                                         if stats['count'] else 0))
+                  for stats in _routes.values()]
+        worst = [entry for _, _, entry in sorted(_worst, reverse=True)]
+    routes.sort(key=lambda r: (r['max_peak'], r['max_frame']), reverse=True)
+    return routes, worst
+
+
+def clear_memory_report():
+    with _lock:
+        _routes.clear()
+        del _worst[:]
@@ -0,0 +1,51 @@
+"""change log and archive projections
+
+Revision ID: 4e8a1f6c3b92
+Revises: 9c4e1b7d2f30
+Create Date: 2026-10-19 23:14:36.520917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from changelog import archive_revisions
+from swiftdb.changelog import seed_events
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8a1f6c3b92'
+down_revision = '9c4e1b7d2f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('recorded_at', sa.DateTime(), nullable=False),
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('code', sa.String(), nullable=False),
+    sa.Column('action', sa.String(), nullable=False),
+    sa.Column('date_edited', sa.Date(), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_log_table_code', 'change_log',
+                    ['table_name', 'code'], unique=False)
+    op.create_table('projections',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('date_refreshed', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    # The existing archive history starts the log, already projected:
+    bind = op.get_bind()
+    seed_events(bind, archive_revisions(bind))
+
+
+def downgrade():
+    op.drop_table('projections')
+    op.drop_index('ix_change_log_table_code', table_name='change_log')
+    op.drop_table('change_log')
@@ -0,0 +1,66 @@
+"""point-in-time snapshots and archive indexes
+
+Revision ID: 5c1f0e6a9d2b
+Revises: 460c4a8d039d
+Create Date: 2026-10-19 09:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1f0e6a9d2b'
+down_revision = '460c4a8d039d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('snapshots',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('label', sa.String(), nullable=True),
+    sa.Column('wp_archive_id', sa.Integer(), nullable=False),
+    sa.Column('tasks_archive_id', sa.Integer(), nullable=False),
+    sa.Column('deliverables_archive_id', sa.Integer(), nullable=False),
+    sa.Column('date_created', sa.Date(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('snapshot_date')
+    )
+    op.create_table('snapshot_rows',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('snapshot_id', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(), nullable=False),
+    sa.Column('code', sa.String(), nullable=False),
+    sa.Column('archive_id', sa.Integer(), nullable=False),
+    sa.Column('date_edited', sa.Date(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('issues', sa.String(), nullable=True),
+    sa.Column('next_deliverable', sa.String(), nullable=True),
+    sa.Column('person_responsible', sa.String(), nullable=True),
+    sa.Column('progress', sa.String(), nullable=True),
+    sa.Column('percent', sa.Integer(), nullable=True),
+    sa.Column('papers', sa.String(), nullable=True),
+    sa.Column('paper_submission_date', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['snapshot_id'], ['snapshots.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('snapshot_id', 'table_name', 'code',
+                        name='_snapshot_table_code_uc')
+    )
+    # Archive tables were created outside alembic (create_archive.sql);
+    # index them for per-code history and date-window replays:
+    for table in ['work_packages_archive', 'tasks_archive',
+                  'deliverables_archive']:
+        op.create_index('ix_' + table + '_code_date', table,
+                        ['code', 'date_edited'])
+        op.create_index('ix_' + table + '_date', table, ['date_edited'])
+
+
+def downgrade():
+    for table in ['work_packages_archive', 'tasks_archive',
+                  'deliverables_archive']:
+        op.drop_index('ix_' + table + '_date', table_name=table)
+        op.drop_index('ix_' + table + '_code_date', table_name=table)
+    op.drop_table('snapshot_rows')
+    op.drop_table('snapshots')
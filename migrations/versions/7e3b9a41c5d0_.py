@@ -0,0 +1,60 @@
+"""full-text search vectors
+
+Revision ID: 7e3b9a41c5d0
+Revises: 5c1f0e6a9d2b
+Create Date: 2026-10-19 11:02:17.530664
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3b9a41c5d0'
+down_revision = '5c1f0e6a9d2b'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = {
+    'work_packages': ['code', 'name', 'status', 'issues', 'next_deliverable'],
+    'tasks': ['code', 'description', 'person_responsible', 'progress',
+              'papers'],
+    'deliverables': ['code', 'description', 'person_responsible', 'progress',
+                     'papers'],
+    'work_packages_archive': ['code', 'status', 'issues', 'next_deliverable'],
+    'tasks_archive': ['code', 'person_responsible', 'progress', 'papers'],
+    'deliverables_archive': ['code', 'person_responsible', 'progress',
+                             'papers'],
+}
+
+
+def upgrade():
+    # tsvector/GIN are PostgreSQL only; SQLite builds an FTS5 index on
+    # first search instead (see search.py).
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, columns in SEARCH_COLUMNS.items():
+        op.add_column(table, sa.Column('search_vector', postgresql.TSVECTOR(),
+                                       nullable=True))
+        op.execute(
+            "CREATE TRIGGER " + table + "_search_update BEFORE INSERT OR "
+            "UPDATE ON " + table + " FOR EACH ROW EXECUTE PROCEDURE "
+            "tsvector_update_trigger(search_vector, 'pg_catalog.english', " +
+            ", ".join(columns) + ")")
+        op.execute(
+            "UPDATE " + table + " SET search_vector = to_tsvector("
+            "'pg_catalog.english', " +
+            " || ' ' || ".join("coalesce(" + c + ", '')" for c in columns) +
+            ")")
+        op.create_index('ix_' + table + '_search', table, ['search_vector'],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in SEARCH_COLUMNS:
+        op.drop_index('ix_' + table + '_search', table_name=table)
+        op.execute("DROP TRIGGER " + table + "_search_update ON " + table)
+        op.drop_column(table, 'search_vector')
@@ -0,0 +1,51 @@
+"""delta-encoded task and deliverable archives
+
+Revision ID: 9c4e1b7d2f30
+Revises: b3d94e7a2c61
+Create Date: 2026-10-19 21:02:47.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import pandas as pd
+
+from deltas import encode_history, decode_history
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e1b7d2f30'
+down_revision = 'b3d94e7a2c61'
+branch_labels = None
+depends_on = None
+
+TABLES = {'Tasks': 'tasks', 'Deliverables': 'deliverables'}
+
+
+def upgrade():
+    bind = op.get_bind()
+    for tableClass, table in TABLES.items():
+        op.add_column(table + '_archive',
+                      sa.Column('changed', sa.Integer(), nullable=True))
+        encode_history(bind, tableClass)
+        # Now derived from the archive (deltas.previous_reports), where it
+        # holds two revisions; other stored reports are kept as a fallback:
+        op.execute('UPDATE ' + table + ' SET previous_report = NULL '
+                   'WHERE code IN (SELECT code FROM ' + table + '_archive '
+                   'GROUP BY code HAVING count(*) > 1)')
+
+
+def downgrade():
+    bind = op.get_bind()
+    for tableClass, table in TABLES.items():
+        decode_history(bind, tableClass)
+        op.drop_column(table + '_archive', 'changed')
+        archive = pd.read_sql('SELECT id, code, date_edited, progress FROM ' +
+                              table + '_archive', bind)
+        archive = archive.sort_values(['date_edited', 'id'])
+        counts = archive.groupby('code').size()
+        previous = archive.groupby('code').tail(2).drop_duplicates('code')
+        previous = previous[previous['code'].map(counts) > 1]
+        update = sa.text('UPDATE ' + table + ' SET previous_report = '
+                         ':report WHERE code = :code')
+        for code, report in zip(previous['code'], previous['progress']):
+            bind.execute(update, {'code': code, 'report': report})
@@ -0,0 +1,37 @@
+"""completion rollups
+
+Revision ID: a41d7c2e8f63
+Revises: 7e3b9a41c5d0
+Create Date: 2026-10-19 13:40:05.271918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41d7c2e8f63'
+down_revision = '7e3b9a41c5d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rollups',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('scope', sa.String(), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('n_tasks', sa.Integer(), nullable=False),
+    sa.Column('n_deliverables', sa.Integer(), nullable=False),
+    sa.Column('n_complete', sa.Integer(), nullable=False),
+    sa.Column('n_overdue', sa.Integer(), nullable=False),
+    sa.Column('mean_percent', sa.Float(), nullable=True),
+    sa.Column('weighted_percent', sa.Float(), nullable=True),
+    sa.Column('date_refreshed', sa.Date(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('scope', 'key', name='_scope_key_uc')
+    )
+
+
+def downgrade():
+    op.drop_table('rollups')
@@ -0,0 +1,106 @@
+"""partition archive tables by date_edited
+
+Revision ID: b3d94e7a2c61
+Revises: f5a0c3d9b817
+Create Date: 2026-10-19 17:05:43.118260
+
+"""
+import datetime as dt
+
+from alembic import op
+from flask import current_app
+
+from partitions import (ARCHIVE_TABLES, PERIODS, period_starts, partition_name,
+                        next_period)
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d94e7a2c61'
+down_revision = 'f5a0c3d9b817'
+branch_labels = None
+depends_on = None
+
+# Same columns as the search triggers of migration 7e3b9a41c5d0:
+SEARCH_COLUMNS = {
+    'work_packages_archive': ['code', 'status', 'issues', 'next_deliverable'],
+    'tasks_archive': ['code', 'person_responsible', 'progress', 'papers'],
+    'deliverables_archive': ['code', 'person_responsible', 'progress',
+                             'papers'],
+}
+
+
+def create_indexes(table):
+    op.execute("CREATE INDEX ix_" + table + "_code_date ON " + table +
+               " (code, date_edited)")
+    op.execute("CREATE INDEX ix_" + table + "_date ON " + table +
+               " (date_edited)")
+    op.execute("CREATE INDEX ix_" + table + "_search ON " + table +
+               " USING gin (search_vector)")
+    op.execute(
+        "CREATE TRIGGER " + table + "_search_update BEFORE INSERT OR "
+        "UPDATE ON " + table + " FOR EACH ROW EXECUTE PROCEDURE "
+        "tsvector_update_trigger(search_vector, 'pg_catalog.english', " +
+        ", ".join(SEARCH_COLUMNS[table]) + ")")
+
+
+def rebuild(table, partition_by=None):
+    '''
+    Recreate table with the same columns, optionally partitioned, copying
+    its rows and keeping its id sequence.
+    '''
+    bind = op.get_bind()
+    op.execute("ALTER TABLE " + table + " RENAME TO " + table + "_old")
+    sequence = bind.execute("SELECT pg_get_serial_sequence('" + table +
+                            "_old', 'id')").scalar()
+    if sequence:
+        op.execute("ALTER SEQUENCE " + sequence + " OWNED BY NONE")
+    op.execute("CREATE TABLE " + table + " (LIKE " + table + "_old "
+               "INCLUDING DEFAULTS)" +
+               (" PARTITION BY " + partition_by if partition_by else ""))
+    if partition_by:
+        period = current_app.config.get('ARCHIVE_PARTITION_PERIOD', 'year')
+        if period not in PERIODS:
+            raise ValueError('Unknown partition period: ' + period)
+        # Undated revisions count as older than any dated one:
+        op.execute("UPDATE " + table + "_old SET date_edited = '1970-01-01' "
+                   "WHERE date_edited IS NULL")
+        first, last = bind.execute("SELECT min(date_edited), "
+                                   "max(date_edited) FROM " + table +
+                                   "_old").first()
+        today = dt.date.today()
+        last = max(last or today, next_period(today, period))
+        for start in period_starts(first or today, last, period):
+            op.execute("CREATE TABLE " + partition_name(table, start, period) +
+                       " PARTITION OF " + table + " FOR VALUES FROM ('" +
+                       start.isoformat() + "') TO ('" +
+                       next_period(start, period).isoformat() + "')")
+        op.execute("CREATE TABLE " + table + "_default PARTITION OF " + table +
+                   " DEFAULT")
+    op.execute("INSERT INTO " + table + " SELECT * FROM " + table + "_old")
+    op.execute("DROP TABLE " + table + "_old")
+    if sequence:
+        op.execute("ALTER SEQUENCE " + sequence + " OWNED BY " + table +
+                   ".id")
+    if not partition_by:
+        op.execute("ALTER TABLE " + table + " ALTER COLUMN date_edited "
+                   "DROP NOT NULL")
+    # The partition key must be part of the primary key:
+    op.execute("ALTER TABLE " + table + " ADD PRIMARY KEY " +
+               ("(id, date_edited)" if partition_by else "(id)"))
+    create_indexes(table)
+
+
+def upgrade():
+    # Declarative partitioning (with row triggers on the partitioned table)
+    # needs PostgreSQL 13 or later; SQLite keeps plain tables.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ARCHIVE_TABLES:
+        rebuild(table, partition_by='RANGE (date_edited)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ARCHIVE_TABLES:
+        rebuild(table)
@@ -0,0 +1,29 @@
+"""partial indexes for overdue queue
+
+Revision ID: c82e5f19b7a4
+Revises: a41d7c2e8f63
+Create Date: 2026-10-19 15:21:48.602117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c82e5f19b7a4'
+down_revision = 'a41d7c2e8f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ['tasks', 'deliverables']:
+        op.create_index('ix_' + table + '_incomplete_due', table,
+                        ['month_due'],
+                        postgresql_where=sa.text('percent < 100'),
+                        sqlite_where=sa.text('percent < 100'))
+
+
+def downgrade():
+    for table in ['tasks', 'deliverables']:
+        op.drop_index('ix_' + table + '_incomplete_due', table_name=table)
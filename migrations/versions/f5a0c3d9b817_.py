@@ -0,0 +1,34 @@
+"""cache invalidation versions
+
+Revision ID: f5a0c3d9b817
+Revises: d2f86b3e1a07
+Create Date: 2026-10-19 16:21:08.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5a0c3d9b817'
+down_revision = 'd2f86b3e1a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_versions',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key')
+    )
+    op.create_index(op.f('ix_cache_versions_version'), 'cache_versions',
+                    ['version'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_cache_versions_version'),
+                  table_name='cache_versions')
+    op.drop_table('cache_versions')
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''
+overdue.py:
+
+Queue of overdue and soon-due tasks and deliverables.
+
+Only incomplete items (percent < 100) due before the end of the lookahead
+window are read. Both tables carry a partial index on month_due covering
+exactly those rows, so the query stays a short index range scan however
+many completed items accumulate. Users who are not admin or ViewAll only
+get items for the partners (Users2Partners) and work packages
+(Users2Work_Packages) they lead, filtered in SQL.
+
+Example:
+    To use::
+        queue = overdue_items(username='admin', days=30)
+'''
+import datetime as dt
+from sqlalchemy import literal, union_all, String, or_
+
+from extensions import db
+from lazy import lazy_import
+from cache import cache_get, cache_set
+from swiftdb.models import (Tasks, Deliverables, Users2Partners,
+                            Users2Work_Packages)
+
+pd = lazy_import('pandas')
+
+ITEMS = {'Tasks': Tasks, 'Deliverables': Deliverables}
+COLUMNS = ['type', 'id', 'code', 'work_package', 'partner', 'description',
+           'person_responsible', 'month_due', 'percent']
+
+
+def queue_query(model, tableClass, horizon, username=None):
+    '''Incomplete items due before horizon, optionally for one user.'''
+    query = (db.session.query(
+        literal(tableClass, String).label('type'), model.id, model.code,
+        model.work_package, model.partner, model.description,
+        model.person_responsible, model.month_due, model.percent)
+        .filter(model.percent < 100, model.month_due < horizon))
+    if username is not None:
+        partners = db.session.query(Users2Partners.partner).filter(
+            Users2Partners.username == username)
+        wps = db.session.query(Users2Work_Packages.work_package).filter(
+            Users2Work_Packages.username == username)
+        query = query.filter(or_(model.partner.in_(partners.subquery()),
+                                 model.work_package.in_(wps.subquery())))
+    return query
+
+
+def overdue_items(username=None, days=30, today=None, ttl=3600):
+    '''
+    Overdue and due-within-days items, ordered by partner, work package and
+    month due. username=None returns every item (admin / ViewAll). Results
+    are cached per user and window until a task or deliverable is edited.
+    '''
+    today = today or dt.date.today()
+    key = ('overdue', username, days, today)
+    queue = cache_get(key)
+    if queue is not None:
+        return queue.copy()
+    horizon = today + dt.timedelta(days=days)
+    statement = union_all(*[queue_query(model, tableClass, horizon,
+                                        username).statement
+                            for tableClass, model in ITEMS.items()])
+    queue = pd.read_sql(statement, db.session.get_bind())
+    queue = queue[COLUMNS]
+    due = pd.to_datetime(queue['month_due'])
+    queue['days'] = (due - pd.Timestamp(today)).dt.days
+    queue['state'] = 'Due soon'
+    queue.loc[queue['days'] < 0, 'state'] = 'Overdue'
+    queue = queue.sort_values(['partner', 'work_package', 'month_due',
+                               'code']).reset_index(drop=True)
+    cache_set(key, queue, ttl=ttl)
+    return queue.copy()
+
+
+def queue_summary(queue):
+    '''Overdue and due-soon counts per partner and work package.'''
+    summary = (queue.groupby(['partner', 'work_package', 'state']).size()
+               .unstack('state', fill_value=0))
+    for state in ['Overdue', 'Due soon']:
+        if state not in summary.columns:
+            summary[state] = 0
+    return summary[['Overdue', 'Due soon']].reset_index()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+'''
+partitions.py:
+
+Range partitions of the archive tables by date_edited (PostgreSQL only; the
+helpers do nothing on other databases or on unpartitioned tables).
+
+Migration b3d94e7a2c61 turns each *_archive table into a table partitioned
+by year or quarter (ARCHIVE_PARTITION_PERIOD in config.py), named e.g.
+tasks_archive_2020 or tasks_archive_2020q3, plus a DEFAULT partition
+(tasks_archive_default) that catches any date without a partition yet.
+Queries bounded on date_edited, as snapshot replays and period diffs are,
+only scan the partitions overlapping their window.
+
+ensure_partitions() creates the partitions for the current and next
+periods, and for any period that has rows in the default partition (those
+rows move into the new partition). It runs daily as a background job.
+detach_partitions() turns old partitions into standalone tables, which can
+then be dumped and dropped without touching the live archive.
+
+Example:
+    To use::
+        created = ensure_partitions(db.session)
+        detached = detach_partitions(db.session, dt.date(2020, 1, 1))
+'''
+import datetime as dt
+import re
+
+from sqlalchemy import text
+
+ARCHIVE_TABLES = ['work_packages_archive', 'tasks_archive',
+                  'deliverables_archive']
+PERIODS = ['year', 'quarter']
+# Partition bound as shown by pg_get_expr:
+BOUND = re.compile(r"FROM \('([0-9-]+)'\) TO \('([0-9-]+)'\)")
+
+
+def period_start(date, period):
+    '''First day of the year or quarter containing date.'''
+    if period == 'year':
+        return dt.date(date.year, 1, 1)
+    return dt.date(date.year, 3 * ((date.month - 1) // 3) + 1, 1)
+
+
+def next_period(start, period):
+    '''First day of the period after the one starting at start.'''
+    months = 12 if period == 'year' else 3
+    month = start.month - 1 + months
+    return dt.date(start.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table, start, period):
+    if period == 'year':
+        return '{}_{}'.format(table, start.year)
+    return '{}_{}q{}'.format(table, start.year, (start.month - 1) // 3 + 1)
+
+
+def period_starts(first, last, period):
+    '''Starts of every period from the one containing first to last's.'''
+    start = period_start(first, period)
+    while start <= last:
+        yield start
+        start = next_period(start, period)
+
+
+def is_postgres(bind):
+    '''Whether a Session or Connection is on PostgreSQL.'''
+    if hasattr(bind, 'get_bind'):
+        bind = bind.get_bind()
+    return bind.dialect.name == 'postgresql'
+
+
+def is_partitioned(bind, table):
+    return bind.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c "
+        "ON c.oid = p.partrelid WHERE c.relname = :table"),
+        {'table': table}).first() is not None
+
+
+def partitions(bind, table):
+    '''{name: (start, end)} of a table's range partitions.'''
+    rows = bind.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"),
+        {'table': table})
+    bounds = {}
+    for name, bound in rows:
+        match = BOUND.search(bound or '')
+        if match:
+            bounds[name] = tuple(dt.datetime.strptime(d, '%Y-%m-%d').date()
+                                 for d in match.groups())
+    return bounds
+
+
+def partition_period(bounds, default='year'):
+    '''Period of existing partitions (year unless any spans < 100 days).'''
+    if not bounds:
+        return default
+    if any((end - start).days < 100 for start, end in bounds.values()):
+        return 'quarter'
+    return 'year'
+
+
+def create_partition(bind, table, start, period):
+    '''
+    Create and attach the partition for the period starting at start,
+    moving rows for that period out of the default partition first.
+    '''
+    name = partition_name(table, start, period)
+    end = next_period(start, period)
+    bind.execute(text("CREATE TABLE " + name + " (LIKE " + table +
+                      " INCLUDING DEFAULTS)"))
+    bind.execute(text(
+        "WITH moved AS (DELETE FROM " + table + "_default WHERE "
+        "date_edited >= :start AND date_edited < :end RETURNING *) "
+        "INSERT INTO " + name + " SELECT * FROM moved"),
+        {'start': start, 'end': end})
+    # Attaching clones the parent's indexes, keys and triggers:
+    bind.execute(text("ALTER TABLE " + table + " ATTACH PARTITION " + name +
+                      " FOR VALUES FROM ('" + start.isoformat() +
+                      "') TO ('" + end.isoformat() + "')"))
+    return name
+
+
+def ensure_partitions(bind, ahead=1, today=None, period='year'):
+    '''
+    Create missing partitions for the current period, the next ahead
+    periods and any period with rows in the default partition. period is
+    only used for tables with no partitions yet. Returns the names created.
+    '''
+    if period not in PERIODS:
+        raise ValueError('Unknown partition period: ' + period)
+    if not is_postgres(bind):
+        return []
+    today = today or dt.date.today()
+    created = []
+    for table in ARCHIVE_TABLES:
+        if not is_partitioned(bind, table):
+            continue
+        bounds = partitions(bind, table)
+        table_period = partition_period(bounds, period)
+        have = set(start for start, end in bounds.values())
+        wanted = set()
+        start = period_start(today, table_period)
+        for i in range(ahead + 1):
+            wanted.add(start)
+            start = next_period(start, table_period)
+        for (date,) in bind.execute(text(
+                "SELECT DISTINCT date_edited FROM " + table + "_default "
+                "WHERE date_edited IS NOT NULL")):
+            wanted.add(period_start(date, table_period))
+        for start in sorted(wanted - have):
+            created.append(create_partition(bind, table, start, table_period))
+    return created
+
+
+def detach_partitions(bind, before):
+    '''
+    Detach every partition that ends on or before the date before. The
+    detached tables keep their rows, renamed <partition>_detached, but drop
+    out of the archive. Returns the new table names.
+    '''
+    if not is_postgres(bind):
+        return []
+    detached = []
+    for table in ARCHIVE_TABLES:
+        if not is_partitioned(bind, table):
+            continue
+        for name, (start, end) in sorted(partitions(bind, table).items()):
+            if end <= before:
+                bind.execute(text("ALTER TABLE " + table +
+                                  " DETACH PARTITION " + name))
+                # Frees the name should edits back-dated into that period
+                # ever need the partition again:
+                bind.execute(text("ALTER TABLE " + name + " RENAME TO " +
+                                  name + "_detached"))
+                detached.append(name + '_detached')
+    return detached
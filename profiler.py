@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+'''
+profiler.py:
+
+Sampled statistical CPU profiles of whole requests, for finding where a
+slow page spends its time (SQL, pandas, templates, password hashing...).
+
+A request is profiled when an admin adds ?profile=1 to its URL, or at
+random with probability PROFILE_SAMPLE_RATE. A profiled request gets a
+sampler thread that records the request thread's stack every
+PROFILE_INTERVAL seconds; when the request ends the counts are written as
+one "folded stacks" file (one "frame;frame;frame count" line per distinct
+stack), the input of flamegraph.pl, speedscope and most other flame graph
+viewers. Files go to PROFILE_DIR/<endpoint>/, newest PROFILE_KEEP kept per
+endpoint, and are listed on the admin page /profiles.
+
+When a request isn't profiled the hooks cost one random number and a
+dictionary lookup; nothing is imported or started.
+
+Example:
+    To profile one page::
+        /task-list?profile=1
+
+    To profile 1% of requests in production::
+        export PROFILE_SAMPLE_RATE=0.01
+
+    To draw a flame graph::
+        flamegraph.pl profiles/task_list/*.folded > task_list.svg
+'''
+import collections
+import datetime as dt
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import current_app, g, request, session
+
+PROFILE_ARG = 'profile'
+# Never profiled (the profile pages themselves and static files):
+SKIPPED = ('main.profiles', 'main.profile_file', 'static')
+NAME = re.compile(r'^\d{8}T\d{6}_\d+_\d+ms\.folded$')
+
+_labels = {}
+
+
+def profile_dir():
+    return current_app.config.get('PROFILE_DIR', 'profiles')
+
+
+def label(code):
+    '''Frame label of a code object, e.g. task_list (SWIFTDBApp.py:755).'''
+    text = _labels.get(code)
+    if text is None:
+        text = '{} ({}:{})'.format(code.co_name,
+                                   os.path.basename(code.co_filename),
+                                   code.co_firstlineno).replace(';', ':')
+        _labels[code] = text
+    return text
+
+
+def folded(frame):
+    '''Stack of frame, outermost first, joined by semicolons.'''
+    stack = []
+    while frame is not None:
+        stack.append(label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Sampler(threading.Thread):
+    '''Counts the stacks of one thread every interval seconds until stop().'''
+
+    def __init__(self, thread_id, interval):
+        threading.Thread.__init__(self, name='profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            self.stacks[folded(frame)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+# ~~~~~~ REQUEST HOOKS ~~~~~~~ #
+
+def wanted():
+    '''Whether to profile the current request.'''
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE')
+    if rate and random.random() < rate:
+        return True
+    return (PROFILE_ARG in request.args and
+            (session.get('username') == 'admin' or
+             session.get('admin') == 'True'))
+
+
+def start_profile():
+    if request.endpoint in SKIPPED or not wanted():
+        return
+    sampler = Sampler(threading.get_ident(),
+                      current_app.config.get('PROFILE_INTERVAL', 0.005))
+    g.profile = (sampler, time.perf_counter())
+    sampler.start()
+
+
+def stop_profile(exc=None):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return
+    sampler, started = profile
+    stacks = sampler.stop()
+    if stacks:
+        try:
+            save_profile(request.endpoint or 'unknown', stacks,
+                         time.perf_counter() - started)
+        except OSError:
+            current_app.logger.exception('Could not save profile')
+
+
+def init_profiling(app):
+    '''Register the hooks that profile flagged and sampled requests.'''
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
+
+
+# ~~~~~~ FILES ~~~~~~~ #
+
+def route_dir(endpoint):
+    return os.path.join(profile_dir(), endpoint.replace('main.', '', 1))
+
+
+def save_profile(endpoint, stacks, seconds):
+    '''Write stacks to a new folded file and prune old ones.'''
+    directory = route_dir(endpoint)
+    os.makedirs(directory, exist_ok=True)
+    name = '{}_{}_{}ms.folded'.format(
+        dt.datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+        random.randrange(10 ** 6), int(seconds * 1000))
+    path = os.path.join(directory, name)
+    with open(path + '.tmp', 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write('{} {}\n'.format(stack, count))
+    os.replace(path + '.tmp', path)
+    keep = current_app.config.get('PROFILE_KEEP', 50)
+    for old in sorted(n for n in os.listdir(directory)
+                      if NAME.match(n))[:-keep]:
+        os.remove(os.path.join(directory, old))
+    return path
+
+
+def read_folded(path):
+    '''{stack: count} of a folded file.'''
+    stacks = collections.Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def top_frames(stacks, n=5):
+    '''[(frame label, share of samples)] of the frames most often on top.'''
+    total = sum(stacks.values())
+    own = collections.Counter()
+    for stack, count in stacks.items():
+        own[stack.rsplit(';', 1)[-1]] += count
+    return [(frame, count / total) for frame, count in own.most_common(n)]
+
+
+def profile_path(route, name=None):
+    '''Path of a saved profile (or route directory), or None if unsafe.'''
+    if route != os.path.basename(route) or route.startswith('.'):
+        return None
+    if name is not None and not NAME.match(name):
+        return None
+    path = os.path.join(profile_dir(), route, *([name] if name else []))
+    return path if os.path.exists(path) else None
+
+
+def list_profiles(limit=200):
+    '''Newest saved profiles as dicts, across every route.'''
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = [(name, route) for route in os.listdir(directory)
+             if os.path.isdir(os.path.join(directory, route))
+             for name in os.listdir(os.path.join(directory, route))
+             if NAME.match(name)]
+    profiles = []
+    for name, route in sorted(names, reverse=True)[:limit]:
+        stamp, _, milliseconds = name[:-len('ms.folded')].split('_')
+        stacks = read_folded(os.path.join(directory, route, name))
+        profiles.append({
+            'route': route, 'name': name,
+            'date': dt.datetime.strptime(stamp, '%Y%m%dT%H%M%S'),
+            'milliseconds': int(milliseconds),
+            'samples': sum(stacks.values()),
+            'top': top_frames(stacks, 3)})
+    return profiles
+
+
+def merged_profile(route):
+    '''Folded text of every saved profile of a route added together.'''
+    directory = profile_path(route)
+    stacks = collections.Counter()
+    if directory is not None:
+        for name in os.listdir(directory):
+            if NAME.match(name):
+                stacks.update(read_folded(os.path.join(directory, name)))
+    return ''.join('{} {}\n'.format(stack, count)
+                   for stack, count in stacks.most_common())
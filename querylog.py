@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+'''
+querylog.py:
+
+Slow-query log. Engine hooks time every SQL statement the app runs; one
+taking SLOW_QUERY_SECONDS or longer is recorded with its normalised SQL
+(literals and IN lists folded, so repeats of a statement group together),
+its parameters, the route that issued it and its plan: EXPLAIN (ANALYZE,
+BUFFERS) on PostgreSQL, EXPLAIN QUERY PLAN on SQLite.
+
+EXPLAIN ANALYZE runs the statement again, so it is only used for SELECTs
+that can have no side effects: no locking clause (FOR UPDATE, FOR
+SHARE...) or data-modifying CTE, and no function outside
+READ_ONLY_FUNCTIONS (so never pg_notify or setval); anything else gets a
+plain EXPLAIN. It runs inside a savepoint on the same connection, and at
+most once per normalised statement every EXPLAIN_EVERY seconds;
+later entries reuse that plan. Entries are kept in a per-process ring
+buffer of the last SLOW_QUERY_BUFFER, shown on the admin page
+/slow-queries (each gunicorn worker shows its own) and downloadable there
+as JSON. Statements under the threshold cost two clock reads.
+
+Example:
+    To log statements over 200ms::
+        export SLOW_QUERY_SECONDS=0.2
+
+    To dump the log::
+        /slow-queries?format=json
+'''
+import collections
+import datetime as dt
+import re
+import threading
+import time
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Seconds before the same statement is explained again:
+EXPLAIN_EVERY = 600
+MAX_PARAMS = 500
+SAVEPOINT = 'slow_query_explain'
+
+_entries = collections.deque(maxlen=200)
+_plans = {}
+_lock = threading.Lock()
+_installed = []
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDERS = re.compile(r'%\(\w+\)s|%s|:\w+|\?')
+LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+SPACE = re.compile(r'\s+')
+IDENTIFIERS = re.compile(r'"(?:[^"]|"")*"')
+CALLS = re.compile(r'([A-Za-z_][\w.$]*)\s*\(')
+LOCKING = re.compile(r'\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b',
+                     re.IGNORECASE)
+WRITES = re.compile(r'\b(?:INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+# Words followed by a parenthesis that are not function calls:
+KEYWORDS = {'all', 'and', 'any', 'array', 'as', 'between', 'by', 'case',
+            'distinct', 'else', 'exists', 'filter', 'from', 'in', 'is',
+            'join', 'lateral', 'like', 'ilike', 'not', 'on', 'or', 'over',
+            'row', 'select', 'some', 'then', 'union', 'using', 'values',
+            'when', 'where', 'with', 'within'}
+# Functions without side effects, safe to run again under EXPLAIN ANALYZE:
+READ_ONLY_FUNCTIONS = {
+    'abs', 'age', 'array_agg', 'avg', 'bool_and', 'bool_or', 'btrim',
+    'cast', 'ceil', 'char_length', 'coalesce', 'concat', 'count', 'date',
+    'date_part', 'date_trunc', 'dense_rank', 'extract', 'first_value',
+    'floor', 'greatest', 'json_agg', 'json_build_object', 'lag', 'last_value',
+    'lead', 'least', 'left', 'length', 'lower', 'ltrim', 'max', 'min',
+    'nullif', 'plainto_tsquery', 'position', 'rank', 'replace', 'right',
+    'round', 'row_number', 'rtrim', 'split_part', 'string_agg', 'strpos',
+    'substr', 'substring', 'sum', 'to_char', 'to_date', 'to_tsquery',
+    'to_tsvector', 'trim', 'ts_headline', 'ts_rank', 'upper',
+    'websearch_to_tsquery'}
+
+
+def normalise(statement):
+    '''Statement with literals and placeholders as ? and IN lists as (...).'''
+    sql = STRINGS.sub('?', statement)
+    sql = PLACEHOLDERS.sub('?', sql)
+    sql = NUMBERS.sub('?', sql)
+    sql = LISTS.sub('(...)', sql)
+    return SPACE.sub(' ', sql).strip()
+
+
+def threshold():
+    if not has_app_context():
+        return None
+    return current_app.config.get('SLOW_QUERY_SECONDS')
+
+
+def route():
+    '''Endpoint and path of the current request, or None outside one.'''
+    if not has_request_context():
+        return None
+    return '{} {} ({})'.format(request.method, request.path,
+                               request.endpoint)
+
+
+# ~~~~~~ EXPLAIN ~~~~~~~ #
+
+def read_only(statement):
+    '''
+    Whether running statement again can have no side effects: a SELECT
+    without locking clause or write, calling only READ_ONLY_FUNCTIONS.
+    Schema-qualified or unknown functions count as writes.
+    '''
+    sql = IDENTIFIERS.sub('""', STRINGS.sub("''", statement)).strip()
+    if not sql.upper().startswith(('SELECT', 'WITH')):
+        return False
+    if LOCKING.search(sql) or WRITES.search(sql):
+        return False
+    return all(name.lower() in KEYWORDS or
+               name.lower() in READ_ONLY_FUNCTIONS
+               for name in CALLS.findall(sql))
+
+
+def explain(conn, statement, parameters):
+    '''Plan of a statement as text, run on conn's DBAPI connection.'''
+    dialect = conn.dialect.name
+    analyse = read_only(statement)
+    if dialect == 'postgresql':
+        prefix = ('EXPLAIN (ANALYZE, BUFFERS) ' if analyse else 'EXPLAIN ')
+    elif dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        return None
+    cursor = conn.connection.cursor()
+    savepoint = dialect == 'postgresql'
+    try:
+        if savepoint:
+            # A failed EXPLAIN must not abort the request's transaction:
+            cursor.execute('SAVEPOINT ' + SAVEPOINT)
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as e:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT ' + SAVEPOINT)
+            return 'EXPLAIN failed: {}'.format(e)
+        if savepoint:
+            cursor.execute('RELEASE SAVEPOINT ' + SAVEPOINT)
+    finally:
+        cursor.close()
+    if dialect == 'sqlite':
+        # (id, parent, notused, detail) rows:
+        return '\n'.join(str(row[-1]) for row in rows)
+    return '\n'.join(str(row[0]) for row in rows)
+
+
+def plan_for(conn, sql, statement, parameters):
+    '''Plan of a normalised statement, explaining it again when stale.'''
+    now = time.time()
+    with _lock:
+        cached = _plans.get(sql)
+        if cached is not None and now - cached[0] < EXPLAIN_EVERY:
+            return cached[1], cached[0]
+        # Claimed before explaining, so concurrent requests don't repeat it:
+        _plans[sql] = (now, cached[1] if cached else None)
+    plan = explain(conn, statement, parameters)
+    with _lock:
+        _plans[sql] = (now, plan)
+        if len(_plans) > 10 * _entries.maxlen:
+            _plans.clear()
+    return plan, now
+
+
+# ~~~~~~ HOOKS ~~~~~~~ #
+
+def before_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    if context is not None:
+        context.slow_query_start = time.perf_counter()
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'slow_query_start', None)
+    if started is None or conn.info.get('explaining'):
+        return
+    seconds = time.perf_counter() - started
+    limit = threshold()
+    if limit is None or seconds < limit:
+        return
+    sql = normalise(statement)
+    plan = explained = None
+    if not executemany:
+        conn.info['explaining'] = True
+        try:
+            plan, explained = plan_for(conn, sql, statement, parameters)
+        finally:
+            conn.info['explaining'] = False
+    record({'date': dt.datetime.utcnow(), 'milliseconds':
+            round(seconds * 1000, 1), 'sql': sql, 'statement': statement,
+            'parameters': repr(parameters)[:MAX_PARAMS],
+            'executemany': executemany, 'route': route(),
+            'database': conn.dialect.name, 'plan': plan,
+            'explained': (dt.datetime.utcfromtimestamp(explained)
+                          if explained else None)})
+
+
+def record(entry):
+    with _lock:
+        _entries.append(entry)
+
+
+def init_query_log(app):
+    '''Size the buffer and install the engine hooks (once per process).'''
+    global _entries
+    size = app.config.get('SLOW_QUERY_BUFFER', 200)
+    with _lock:
+        if size != _entries.maxlen:
+            _entries = collections.deque(_entries, maxlen=size)
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', before_execute)
+        event.listen(Engine, 'after_cursor_execute', after_execute)
+        _installed.append(True)
+
+
+# ~~~~~~ READING ~~~~~~~ #
+
+def slow_queries():
+    '''Logged entries, newest first.'''
+    with _lock:
+        return list(reversed(_entries))
+
+
+def clear_slow_queries():
+    with _lock:
+        _entries.clear()
+        _plans.clear()
+
+
+def slow_query_summary(entries):
+    '''Per normalised statement: count, total and worst time, routes.'''
+    groups = collections.OrderedDict()
+    for entry in entries:
+        group = groups.setdefault(entry['sql'], {
+            'sql': entry['sql'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+            'routes': collections.Counter()})
+        group['count'] += 1
+        group['total_ms'] += entry['milliseconds']
+        group['max_ms'] = max(group['max_ms'], entry['milliseconds'])
+        group['routes'][entry['route'] or '(no request)'] += 1
+    return sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
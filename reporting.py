@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+'''
+reporting.py:
+
+Reporting-period comparisons computed set-based over the *_Archive tables.
+
+For two dates the latest revision of every code on or before each date is
+picked with a window function, the two are joined by code and rows whose
+tracked fields differ are returned with their before and after values. All
+three archive tables are combined into a single UNION ALL, so one query
+returns a page of changes (plus one count query) however many items exist.
+Fields of delta-encoded revisions (see deltas.py) are filled in by
+correlated subqueries on the chosen revisions only.
+
+Example:
+    To use::
+        changes, total = period_changes(dt.date(2020, 1, 1),
+                                        dt.date(2020, 3, 31), page=1)
+'''
+from sqlalchemy import (select, func, literal, cast, null, or_, and_,
+                        union_all, String, Integer)
+
+from extensions import db
+from lazy import lazy_import
+from deltas import is_delta, field_as_of, FIELDS as DELTA_FIELDS
+from swiftdb.models import (Work_Packages_Archive, Tasks_Archive,
+                            Deliverables_Archive)
+
+pd = lazy_import('pandas')
+
+# Fields compared between the two dates, per archive table:
+COMPARED = {'Work_Packages': ['status'],
+            'Tasks': ['progress', 'percent', 'papers'],
+            'Deliverables': ['progress', 'percent', 'papers']}
+ARCHIVES = {'Work_Packages': Work_Packages_Archive,
+            'Tasks': Tasks_Archive,
+            'Deliverables': Deliverables_Archive}
+COLUMN_TYPES = {'status': String, 'progress': String, 'percent': Integer,
+                'papers': String}
+COLUMNS = ['table_name', 'code', 'before_date', 'after_date'] + [
+    prefix + field for field in ['status', 'progress', 'percent', 'papers']
+    for prefix in ['before_', 'after_']]
+
+
+def latest_as_of(archive, date, name, fields=None):
+    '''
+    Subquery: latest revision per code dated on or before date. For delta
+    encoded archives only fields (default all) are filled in.
+    '''
+    table = archive.__table__
+    rank = func.row_number().over(
+        partition_by=table.c.code,
+        order_by=(table.c.date_edited.desc(), table.c.id.desc())).label('rn')
+    ranked = (select([table, rank])
+              .where(table.c.date_edited <= date)
+              .alias(name + '_ranked'))
+    if not is_delta(archive):
+        return select([ranked]).where(ranked.c.rn == 1).alias(name)
+    # Delta rows only hold the fields they changed; each field comes from
+    # the latest revision up to the chosen one that recorded it:
+    latest = select([ranked]).where(ranked.c.rn == 1).alias(name + '_latest')
+    return select([latest.c.id, latest.c.code, latest.c.date_edited] +
+                  [field_as_of(archive, latest, field, name).label(field)
+                   for field in fields or DELTA_FIELDS]).alias(name)
+
+
+def table_changes(tableClass, start, end):
+    '''Select of the codes in one archive table changed between dates.'''
+    archive = ARCHIVES[tableClass]
+    before = latest_as_of(archive, start, 'before', COMPARED[tableClass])
+    after = latest_as_of(archive, end, 'after', COMPARED[tableClass])
+    columns = [literal(tableClass, String).label('table_name'),
+               after.c.code.label('code'),
+               before.c.date_edited.label('before_date'),
+               after.c.date_edited.label('after_date')]
+    for field in ['status', 'progress', 'percent', 'papers']:
+        for prefix, side in [('before_', before), ('after_', after)]:
+            if field in COMPARED[tableClass]:
+                column = side.c[field]
+            else:
+                column = cast(null(), COLUMN_TYPES[field])
+            columns.append(column.label(prefix + field))
+    # Every code present at start is present at end, so a left join from
+    # the later revision covers both changed and newly added items:
+    changed = or_(*[after.c[field].is_distinct_from(before.c[field])
+                    for field in COMPARED[tableClass]])
+    return (select(columns)
+            .select_from(after.outerjoin(before,
+                                         before.c.code == after.c.code))
+            .where(or_(before.c.id.is_(None),
+                       and_(before.c.id != after.c.id, changed))))
+
+
+def changes_query(start, end):
+    '''UNION ALL of the changes across work packages, tasks, deliverables.'''
+    return union_all(*[table_changes(tableClass, start, end)
+                       for tableClass in ARCHIVES]).alias('changes')
+
+
+def period_changes(start, end, page=1, per_page=100):
+    '''
+    One page of changes between start and end, ordered by table and code.
+    Returns (DataFrame, total number of changed items).
+    '''
+    changes = changes_query(start, end)
+    total = db.session.execute(
+        select([func.count()]).select_from(changes)).scalar()
+    query = (select([changes])
+             .order_by(changes.c.table_name, changes.c.code)
+             .limit(per_page).offset((page - 1) * per_page))
+    df = pd.read_sql(query, db.session.get_bind())
+    return df[COLUMNS], total
+
+
+def period_changes_chunks(start, end, chunksize=5000):
+    '''All changes between start and end as an iterator of DataFrames.'''
+    changes = changes_query(start, end)
+    query = select([changes]).order_by(changes.c.table_name,
+                                       changes.c.code)
+    for df in pd.read_sql(query, db.session.get_bind(), chunksize=chunksize):
+        yield df[COLUMNS]
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+'''
+restore.py:
+
+Restore the live tables after accidental changes, by merging two snapshots
+of the database around a cutoff date.
+
+A snapshot is the live database ('live'), a directory of table CSVs as
+written by BACKUP/dumpPSQL.sh (e.g. BACKUP/csvs/20200211), or a workbook
+with one sheet per table as written by BACKUP/dumptoexcel.py. Snapshots are
+read whole into one frame per table and converted to the model types.
+
+For every table at once the restored rows are:
+  * work packages, tasks and deliverables: the current snapshot's row where
+    it was edited on or after the cutoff (changes made since the accident,
+    including items added since), otherwise the base snapshot's row;
+  * partners and access rows, which carry no edit date: the base snapshot's
+    rows plus any only in the current one.
+The merge is a handful of vectorised set operations per table, and the
+result is diffed against the live tables by key. The report lists the
+inserts, updates and deletes per table (with examples) and any restored
+row whose work package, partner or user would not exist; it is all a dry
+run produces. Applying writes the diff through the bulk loader
+(swiftdb.api) in the caller's transaction, parents before children and
+deletes in reverse, logs the work package, task and deliverable changes
+(see changelog.py), dated the day the restore is applied so they follow
+the accidental edits in the archive, and queues the archive projection and
+rollups. Users themselves (and their passwords) are never restored.
+
+Example:
+    To compare last night's backup with the live site (dry run)::
+        python manage.py restore --base 20200211 --cutoff 2020-02-12
+
+    To apply it::
+        report = restore('20200211', '2020-02-12', apply=True)
+        db.session.commit()
+        jobs_committed()
+'''
+import datetime as dt
+import os
+
+from extensions import db
+from lazy import lazy_import
+from swiftdb.api import batches, bulk_insert, bulk_upsert
+from swiftdb.models import (Partners, Work_Packages, Tasks, Deliverables,
+                            Users2Work_Packages, Users2Partners)
+from importer import CHUNK_SIZE, MAX_EXAMPLES, convert, import_columns, \
+    records
+from changelog import event, record_changes
+from snapshots import ARCHIVES, to_date
+from jobs import enqueue, schedule
+from bus import publish
+
+pd = lazy_import('pandas')
+
+LIVE = 'live'
+BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'BACKUP', 'csvs')
+# Restored tables, parents before children:
+TABLES = {'Partners': Partners,
+          'Work_Packages': Work_Packages,
+          'Tasks': Tasks,
+          'Deliverables': Deliverables,
+          'Users2Work_Packages': Users2Work_Packages,
+          'Users2Partners': Users2Partners}
+KEYS = {'Partners': ['name'],
+        'Work_Packages': ['code'],
+        'Tasks': ['code'],
+        'Deliverables': ['code'],
+        'Users2Work_Packages': ['username', 'work_package'],
+        'Users2Partners': ['username', 'partner']}
+# Columns derived from the archive since backups were taken:
+DERIVED = {'Tasks': ['previous_report'], 'Deliverables': ['previous_report']}
+# Rows the app relies on, never deleted:
+PROTECTED = {'Partners': ['admin', 'ViewAll']}
+
+
+class RestoreError(ValueError):
+    '''The restore can't be applied: missing snapshot or broken references.'''
+
+
+# ~~~~~~ SNAPSHOTS ~~~~~~~ #
+
+def resolve(source):
+    '''Path of a snapshot given as a path or a BACKUP/csvs date, or 'live'.'''
+    if source == LIVE or os.path.exists(source):
+        return source
+    for path in [os.path.join(BACKUP_DIR, source),
+                 os.path.join(BACKUP_DIR, source + 'swiftbak.xlsx')]:
+        if os.path.exists(path):
+            return path
+    raise RestoreError('No snapshot found for ' + source)
+
+
+def raw_tables(path):
+    '''{tableClass: DataFrame as stored} of the tables a snapshot holds.'''
+    tables = {}
+    if path == LIVE:
+        for tableClass, model in TABLES.items():
+            tables[tableClass] = pd.read_sql(
+                db.session.query(model).statement, db.session.connection())
+    elif path.lower().endswith('.xlsx'):
+        sheets = pd.read_excel(path, sheet_name=None, dtype=object)
+        for tableClass, model in TABLES.items():
+            if model.__tablename__ in sheets:
+                tables[tableClass] = sheets[model.__tablename__]
+    else:
+        for tableClass, model in TABLES.items():
+            csv = os.path.join(path, model.__tablename__ + '.csv')
+            if os.path.exists(csv):
+                tables[tableClass] = pd.read_csv(csv, dtype=str,
+                                                 keep_default_na=False)
+    return tables
+
+
+def read_snapshot(source, errors):
+    '''
+    {tableClass: DataFrame of restorable columns in model types} of a
+    snapshot. Values that don't convert are appended to errors as nulls.
+    '''
+    frames = {}
+    for tableClass, df in raw_tables(resolve(source)).items():
+        model = TABLES[tableClass]
+        columns = [name for name in import_columns(model)
+                   if name in df and name not in DERIVED.get(tableClass, [])]
+        missing = [name for name in KEYS[tableClass] if name not in columns]
+        if missing:
+            errors.append('{} {}: no {} column'.format(
+                source, tableClass, ', '.join(missing)))
+            continue
+        values, bad = convert(model, df[columns])
+        for name, mask in bad.items():
+            if mask.any():
+                errors.append('{} {}: {} invalid {} value(s)'.format(
+                    source, tableClass, int(mask.sum()), name))
+        frames[tableClass] = values.dropna(subset=KEYS[tableClass])
+    return frames
+
+
+# ~~~~~~ MERGE AND DIFF ~~~~~~~ #
+
+def keys(df, key):
+    return pd.MultiIndex.from_frame(df[key].astype(str))
+
+
+def merge_table(tableClass, base, current, cutoff):
+    '''Restored rows of one table from its base and current snapshots.'''
+    key = KEYS[tableClass]
+    current = current.reindex(columns=base.columns)
+    if 'date_edited' in base:
+        recent = current[pd.to_datetime(current['date_edited']) >=
+                         pd.Timestamp(cutoff)]
+        kept = base[~keys(base, key).isin(keys(recent, key))]
+        restored = pd.concat([kept, recent], sort=False)
+    else:
+        restored = pd.concat(
+            [base, current[~keys(current, key).isin(keys(base, key))]],
+            sort=False)
+    return restored.reset_index(drop=True)
+
+
+def diff_table(tableClass, live, restored):
+    '''
+    (inserts, updates, deletes, unchanged count) turning live into
+    restored; updates carry a {column: (old, new)} dict under '_changes'.
+    '''
+    key = KEYS[tableClass]
+    fields = [name for name in restored.columns if name not in key]
+    both = live[key + fields].merge(restored, on=key, how='outer',
+                                    suffixes=('_live', ''), indicator=True)
+    inserts = both.loc[both['_merge'] == 'right_only', key + fields]
+    deletes = both.loc[(both['_merge'] == 'left_only') &
+                       ~both[key[0]].isin(PROTECTED.get(tableClass, [])), key]
+    common = both[both['_merge'] == 'both']
+    differs = pd.DataFrame(index=common.index)
+    for name in fields:
+        old, new = common[name + '_live'], common[name]
+        differs[name] = ~((old == new) | (old.isnull() & new.isnull()))
+    changed = differs.any(axis=1).reindex(common.index, fill_value=False)
+    updates = common.loc[changed, key + fields].copy()
+    updates['_changes'] = [
+        dict((name, (common.at[i, name + '_live'], common.at[i, name]))
+             for name in fields if differs.at[i, name])
+        for i in updates.index]
+    return (inserts.reset_index(drop=True), updates.reset_index(drop=True),
+            deletes.reset_index(drop=True), int((~changed).sum()))
+
+
+def broken_references(tableClass, restored, frames):
+    '''Problems with restored rows referring to rows that won't exist.'''
+    problems = []
+    for name, column in import_columns(TABLES[tableClass]).items():
+        for fk in column.foreign_keys:
+            parent = [t for t, model in TABLES.items()
+                      if model.__tablename__ == fk.column.table.name]
+            if parent:
+                allowed = set(frames[parent[0]][fk.column.name])
+            else:
+                allowed = set(v for (v,) in db.session.query(fk.column))
+            values = restored[name]
+            bad = values[values.notnull() & ~values.isin(allowed)]
+            problems += ['{} {}: unknown {} {}'.format(
+                tableClass, ', '.join(str(v) for v in row), name, value)
+                for row, value in zip(
+                    restored.loc[bad.index, KEYS[tableClass]].values, bad)]
+    return problems
+
+
+def _example(row, key, changes=None):
+    example = dict((name, row[name]) for name in key)
+    if changes is not None:
+        example['changes'] = ', '.join(
+            '{}: {} -> {}'.format(name, '' if pd.isnull(old) else old,
+                                  '' if pd.isnull(new) else new)
+            for name, (old, new) in changes.items())
+    return example
+
+
+# ~~~~~~ RESTORE ~~~~~~~ #
+
+def write_changes(tableClass, inserts, updates, deletes):
+    '''Write one table's diff through the bulk loader.'''
+    model = TABLES[tableClass]
+    key = KEYS[tableClass]
+    inserted = records(model, inserts)
+    updated = records(model, updates)
+    if len(key) == 1:
+        bulk_upsert(db.session, model, inserted + updated, key=key[0],
+                    batch_size=CHUNK_SIZE)
+    else:
+        # Access rows are all key, so never updated:
+        bulk_insert(db.session, model, inserted, batch_size=CHUNK_SIZE)
+    if tableClass in ARCHIVES:
+        # Dated today rather than with the rows' old date_edited, so the
+        # restored values are the latest revision, after the accidental
+        # edits; each holds the whole restored row:
+        today = dt.date.today()
+        record_changes(
+            [event(tableClass, row['code'], 'insert', row, today)
+             for row in inserted] +
+            [event(tableClass, row['code'], 'update', row, today)
+             for row in updated] +
+            [event(tableClass, code, 'delete', date_edited=today)
+             for code in deletes['code']])
+
+
+def delete_rows(tableClass, deletes):
+    model = TABLES[tableClass]
+    key = KEYS[tableClass]
+    if len(key) == 1:
+        column = getattr(model, key[0])
+        for batch in batches(deletes[key[0]].tolist(), CHUNK_SIZE):
+            (db.session.query(model).filter(column.in_(batch))
+             .delete(synchronize_session=False))
+    else:
+        for row in deletes.to_dict('records'):
+            (db.session.query(model).filter_by(**row)
+             .delete(synchronize_session=False))
+
+
+def restore(base, cutoff, current=LIVE, apply=False):
+    '''
+    Merge the base and current snapshots around cutoff and diff the result
+    with the live tables. With apply, write it without committing; raises
+    RestoreError (nothing written) if the restore would break references.
+    Returns a report dict.
+    '''
+    cutoff = to_date(cutoff)
+    errors = []
+    bases = read_snapshot(base, errors)
+    currents = bases if current == base else read_snapshot(current, errors)
+    lives = currents if current == LIVE else read_snapshot(LIVE, errors)
+    report = {'base': base, 'current': current, 'cutoff': cutoff,
+              'tables': {}, 'skipped': [], 'errors': errors}
+    restored = {}
+    for tableClass in TABLES:
+        if tableClass not in bases or tableClass not in currents:
+            report['skipped'].append(tableClass)
+            # Left as it is, so references to it are checked against live:
+            restored[tableClass] = lives[tableClass]
+            continue
+        restored[tableClass] = merge_table(tableClass, bases[tableClass],
+                                           currents[tableClass], cutoff)
+    diffs = {}
+    for tableClass in TABLES:
+        if tableClass in report['skipped']:
+            continue
+        errors += broken_references(tableClass, restored[tableClass],
+                                    restored)
+        inserts, updates, deletes, unchanged = diff_table(
+            tableClass, lives[tableClass], restored[tableClass])
+        diffs[tableClass] = (inserts, updates, deletes)
+        key = KEYS[tableClass]
+        report['tables'][tableClass] = {
+            'rows': len(restored[tableClass]), 'inserts': len(inserts),
+            'updates': len(updates), 'deletes': len(deletes),
+            'unchanged': unchanged,
+            'examples': {
+                'inserts': [_example(row, key) for row in
+                            inserts.head(MAX_EXAMPLES).to_dict('records')],
+                'updates': [_example(row, key, row['_changes']) for row in
+                            updates.head(MAX_EXAMPLES).to_dict('records')],
+                'deletes': [_example(row, key) for row in
+                            deletes.head(MAX_EXAMPLES).to_dict('records')]}}
+    if not apply:
+        return report
+    if errors:
+        raise RestoreError('; '.join(errors[:10]))
+    for tableClass, (inserts, updates, deletes) in diffs.items():
+        write_changes(tableClass, inserts, updates, deletes)
+    for tableClass in reversed(list(diffs)):
+        delete_rows(tableClass, diffs[tableClass][2])
+    schedule('project_changes')
+    enqueue('rebuild_rollups')
+    publish(*[('table', tableClass) for tableClass in diffs] +
+            [('user',), ('overdue',), ('wp_summary',)])
+    return report
+
+
+def format_report(report):
+    '''Lines of a plain text summary of a restore report.'''
+    lines = ['Restore of {} with changes since {} from {}'.format(
+        report['base'], report['cutoff'], report['current'])]
+    for tableClass, table in report['tables'].items():
+        lines.append('{}: {} rows, {} inserts, {} updates, {} deletes, '
+                     '{} unchanged'.format(
+                         tableClass, table['rows'], table['inserts'],
+                         table['updates'], table['deletes'],
+                         table['unchanged']))
+        for kind, examples in table['examples'].items():
+            for example in examples:
+                lines.append('  {} {}'.format(kind[:-1], ', '.join(
+                    '{}={}'.format(k, v) for k, v in example.items())))
+    for tableClass in report['skipped']:
+        lines.append('{}: not in both snapshots, left as it is'.format(
+            tableClass))
+    for error in report['errors']:
+        lines.append('ERROR ' + error)
+    return lines
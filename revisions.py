@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''
+revisions.py:
+
+Edit history of one work package, task or deliverable: its archive
+revisions newest first, each with the fields it changed from the revision
+before it.
+
+Pages are keyset paginated on (date_edited, id): a page is the revisions
+strictly before a cursor, read from the (code, date_edited) index with a
+LIMIT, so every page costs the same however many revisions an item has.
+One revision beyond the page is read too, to diff the page's oldest row
+against and to tell whether there is another page. Delta-encoded revisions
+are filled in for the page's id range only (see deltas.py). Once the
+database rows of an item run out, older pages come from the cold tier.
+
+Example:
+    To use::
+        page, cursor = item_revisions('Tasks', 'T-R1.1.1')
+        older, cursor = item_revisions('Tasks', 'T-R1.1.1', before=cursor)
+'''
+import datetime as dt
+
+from sqlalchemy import and_, or_
+
+from extensions import db
+from lazy import lazy_import
+from cold import cold_bounds
+from deltas import ARCHIVES, history, same
+from snapshots import FIELDS
+
+pd = lazy_import('pandas')
+
+PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def parse_cursor(cursor):
+    '''(date_edited, id) of a cursor like 2020-03-31_1234.'''
+    date, _, archive_id = str(cursor).partition('_')
+    return dt.datetime.strptime(date, '%Y-%m-%d').date(), int(archive_id)
+
+
+def format_cursor(date, archive_id):
+    return '{}_{}'.format(date.isoformat(), int(archive_id))
+
+
+def page_ids(archive, code, before, limit):
+    '''Ids of the newest limit database revisions of code before cursor.'''
+    query = db.session.query(archive.id).filter(archive.code == code)
+    if before is not None:
+        date, archive_id = before
+        query = query.filter(or_(archive.date_edited < date,
+                                 and_(archive.date_edited == date,
+                                      archive.id < archive_id)))
+    query = query.order_by(archive.date_edited.desc(), archive.id.desc())
+    return [i for (i,) in query.limit(limit)]
+
+
+def diffs(tableClass, df):
+    '''
+    [{field, before, after}] per revision of df (newest first) against the
+    next row; the last row is compared with nothing, i.e. everything set.
+    '''
+    rows = df[FIELDS[tableClass]].to_dict('records')
+    changes = []
+    for newer, older in zip(rows, rows[1:] + [None]):
+        changes.append([{'field': field,
+                         'before': None if older is None else older[field],
+                         'after': newer[field]}
+                        for field in FIELDS[tableClass]
+                        if (not pd.isnull(newer[field]) if older is None
+                            else not same(field, older[field],
+                                          newer[field]))])
+    return changes
+
+
+def item_revisions(tableClass, code, before=None, per_page=PER_PAGE):
+    '''
+    Up to per_page revisions of code older than the cursor before (None
+    for the newest), newest first, with a 'changes' column of field diffs.
+    Returns (DataFrame, cursor of the next page or None).
+    '''
+    archive = ARCHIVES[tableClass]
+    if before is not None:
+        before = parse_cursor(before)
+    ids = page_ids(archive, code, before, per_page + 1)
+    if len(ids) <= per_page and cold_bounds(tableClass)[0] is not None:
+        # The rest of the history is read from both tiers:
+        df = history(tableClass, code=code,
+                     upto=before[0] if before is not None else None)
+        if before is not None:
+            df = df[(df['date_edited'] < before[0]) |
+                    ((df['date_edited'] == before[0]) &
+                     (df['id'] < before[1]))]
+    elif ids:
+        df = history(tableClass, code=code, min_id=min(ids) - 1,
+                     max_id=max(ids))
+        df = df[df['id'].isin(ids)]
+    else:
+        df = history(tableClass, code=code, max_id=0)
+    df = (df.sort_values(['date_edited', 'id'], ascending=False)
+          .head(per_page + 1).reset_index(drop=True))
+    df['changes'] = diffs(tableClass, df)
+    cursor = None
+    if len(df) > per_page:
+        df = df.head(per_page)
+        last = df.iloc[-1]
+        cursor = format_cursor(last['date_edited'], last['id'])
+    columns = ['id', 'date_edited'] + FIELDS[tableClass] + ['changes']
+    return df[columns], cursor
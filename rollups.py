@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+rollups.py:
+
+Precomputed completion rollups per work package and per partner.
+
+Each row of the rollups table holds, for one work package or partner, the
+number of tasks and deliverables, how many are complete, how many are
+overdue (month_due passed and percent below 100), the mean percent and a
+weighted percent (weights per item type from ROLLUP_WEIGHTS in config.py).
+
+Edits refresh only the groups the edited item belonged to before and after
+the change. Overdue counts depend on today's date, so rows refreshed on an
+earlier day are recomputed the first time they are read.
+
+Example:
+    To use::
+        refresh_rollups([('WP-C1', 'Leeds')])
+        mismatches = check_rollups()
+'''
+import datetime as dt
+from flask import current_app
+from sqlalchemy import func, case
+
+from extensions import db
+from swiftdb.models import Tasks, Deliverables, Rollups
+
+ITEMS = {'Tasks': Tasks, 'Deliverables': Deliverables}
+# Rollup scope -> grouping column on Tasks/Deliverables:
+SCOPES = {'work_package': 'work_package', 'partner': 'partner'}
+
+
+def rollup_keys(db_row):
+    '''(work_package, partner) a task or deliverable currently rolls up to.'''
+    return (db_row.work_package, db_row.partner)
+
+
+def compute_rollups(scope, keys=None, today=None):
+    '''
+    Aggregate tasks and deliverables by scope, optionally only for keys.
+    Returns {key: {column: value}} without touching the rollups table.
+    '''
+    today = today or dt.date.today()
+    weights = current_app.config.get('ROLLUP_WEIGHTS', {})
+    totals = {}
+    for tableClass, model in ITEMS.items():
+        column = getattr(model, SCOPES[scope])
+        query = db.session.query(
+            column, func.count(model.id), func.sum(model.percent),
+            func.sum(case([(model.percent >= 100, 1)], else_=0)),
+            func.sum(case([((model.month_due < today) &
+                            (model.percent < 100), 1)], else_=0)))
+        if keys is not None:
+            query = query.filter(column.in_(keys))
+        weight = weights.get(tableClass, 1)
+        for key, n, percent, complete, overdue in query.group_by(column):
+            total = totals.setdefault(key, {'n_tasks': 0, 'n_deliverables': 0,
+                                            'n_complete': 0, 'n_overdue': 0,
+                                            'percent': 0, 'weighted': 0,
+                                            'weight': 0})
+            total['n_' + tableClass.lower()] = n
+            total['n_complete'] += complete or 0
+            total['n_overdue'] += overdue or 0
+            total['percent'] += percent or 0
+            total['weighted'] += (percent or 0) * weight
+            total['weight'] += n * weight
+    rollups = {}
+    for key, total in totals.items():
+        n = total['n_tasks'] + total['n_deliverables']
+        rollups[key] = {
+            'n_tasks': total['n_tasks'],
+            'n_deliverables': total['n_deliverables'],
+            'n_complete': total['n_complete'],
+            'n_overdue': total['n_overdue'],
+            'mean_percent': float(total['percent']) / n if n else None,
+            'weighted_percent': (float(total['weighted']) / total['weight']
+                                 if total['weight'] else None)}
+    return rollups
+
+
+def store_rollups(scope, rollups, keys=None, today=None):
+    '''Upsert computed rollups, dropping rows for keys with no items left.'''
+    today = today or dt.date.today()
+    query = Rollups.query.filter_by(scope=scope)
+    if keys is not None:
+        query = query.filter(Rollups.key.in_(keys))
+    existing = {row.key: row for row in query}
+    for key, values in rollups.items():
+        row = existing.pop(key, None)
+        if row is None:
+            row = Rollups(scope=scope, key=key)
+            db.session.add(row)
+        for column, value in values.items():
+            setattr(row, column, value)
+        row.date_refreshed = today
+    for row in existing.values():
+        db.session.delete(row)
+
+
+def refresh_rollups(keys):
+    '''
+    Recompute the rollups for the given (work_package, partner) pairs, i.e.
+    the groups an edited item left and joined.
+    '''
+    keys = [k for k in keys if k is not None]
+    for index, scope in enumerate(['work_package', 'partner']):
+        scope_keys = sorted(set(k[index] for k in keys if k[index]))
+        if not scope_keys:
+            continue
+        store_rollups(scope, compute_rollups(scope, scope_keys), scope_keys)
+    db.session.commit()
+
+
+def rebuild_rollups():
+    '''Full recompute of every rollup.'''
+    for scope in SCOPES:
+        store_rollups(scope, compute_rollups(scope))
+    db.session.commit()
+
+
+def rollup_rows(scope):
+    '''
+    Rollups for the dashboard. Only the rollups table is read unless rows
+    were refreshed before today, in which case the scope is recomputed so
+    overdue counts are current.
+    '''
+    rows = Rollups.query.filter_by(scope=scope).order_by(Rollups.key).all()
+    if any(row.date_refreshed != dt.date.today() for row in rows):
+        store_rollups(scope, compute_rollups(scope))
+        db.session.commit()
+        rows = Rollups.query.filter_by(scope=scope).order_by(Rollups.key).all()
+    return rows
+
+
+def check_rollups(tolerance=1e-6):
+    '''
+    Compare stored rollups with a full recompute. Returns a list of
+    (scope, key, column, stored, expected) for every mismatch.
+    '''
+    mismatches = []
+    for scope in SCOPES:
+        expected = compute_rollups(scope)
+        stored = {row.key: row for row in Rollups.query.filter_by(scope=scope)}
+        for key in sorted(set(expected) | set(stored)):
+            if key not in stored:
+                mismatches.append((scope, key, 'row', None, 'present'))
+                continue
+            if key not in expected:
+                mismatches.append((scope, key, 'row', 'present', None))
+                continue
+            for column, value in expected[key].items():
+                have = getattr(stored[key], column)
+                if column == 'n_overdue' and (stored[key].date_refreshed !=
+                                              dt.date.today()):
+                    continue
+                if isinstance(value, float) and have is not None:
+                    if abs(have - value) > tolerance:
+                        mismatches.append((scope, key, column, have, value))
+                elif have != value:
+                    mismatches.append((scope, key, column, have, value))
+    return mismatches
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+routing.py:
+
+Read-replica routing. When replica URLs are configured
+(SQLALCHEMY_REPLICA_URLS in config.py), requests to views marked
+@read_only run their queries against a replica; everything else, and every
+flush, goes to the primary (DATABASE_URL). Reads that must not lag (the
+permission lists, anything filling a long-lived cache) run inside
+`with primary():`.
+
+A user who has just edited something (any non-GET request to a view that
+is not read-only) keeps reading from the primary for
+READ_YOUR_WRITES_SECONDS, so they always see their own change even if the
+replica lags.
+
+Example:
+    To use::
+        @main.route('/task-view')
+        @read_only
+        @is_logged_in
+        def task_view():
+            ...
+
+    To try locally with two databases::
+        createdb -T swift swift_replica
+        export DATABASE_REPLICA_URLS="postgresql://localhost/swift_replica"
+'''
+import contextlib
+import random
+import time
+
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+REPLICA_PREFIX = 'replica_'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def read_only(f):
+    '''Mark a view as safe to serve from a replica (it never writes).'''
+    f.read_only = True
+    return f
+
+
+def replica_key():
+    '''Bind key of the replica chosen for this request, or None.'''
+    if has_request_context():
+        return g.get('replica')
+    return None
+
+
+@contextlib.contextmanager
+def primary():
+    '''Run the block's queries on the primary, even in a read-only view.'''
+    key = replica_key()
+    if key is not None:
+        g.replica = None
+    try:
+        yield
+    finally:
+        if key is not None:
+            g.replica = key
+
+
+class RoutingSession(SignallingSession):
+    '''Session sending reads to the request's replica, writes to primary.'''
+
+    def get_bind(self, mapper=None, clause=None):
+        key = replica_key()
+        if key is not None and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app, bind=key)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_keys(app):
+    return sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {})
+                  if key.startswith(REPLICA_PREFIX))
+
+
+def choose_replica():
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'read_only', False):
+        return None
+    wrote_at = session.get('wrote_at', 0)
+    window = current_app.config.get('READ_YOUR_WRITES_SECONDS', 30)
+    if time.time() - wrote_at < window:
+        return None
+    keys = replica_keys(current_app)
+    return random.choice(keys) if keys else None
+
+
+def remember_write(response):
+    view = current_app.view_functions.get(request.endpoint)
+    if (request.method not in READ_METHODS and
+            not getattr(view, 'read_only', False)):
+        session['wrote_at'] = time.time()
+    return response
+
+
+def init_routing(app):
+    '''
+    Register each replica URL as a bind and the request hooks that pick a
+    replica for read-only views. Call before db.init_app(app).
+    '''
+    urls = app.config.get('SQLALCHEMY_REPLICA_URLS') or []
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for index, url in enumerate(urls):
+        binds[REPLICA_PREFIX + str(index)] = url
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+
+    @app.before_request
+    def route_reads():
+        g.replica = choose_replica()
+
+    app.after_request(remember_write)
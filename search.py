@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+'''
+search.py:
+
+Full-text search over the text columns of work packages, tasks,
+deliverables and their archives.
+
+On PostgreSQL every searchable table carries a ``search_vector`` tsvector
+column kept current by a ``tsvector_update_trigger`` and indexed with GIN
+(see migration 7e3b9a41c5d0). On SQLite (local use) a single FTS5 table,
+``search_index``, is maintained by triggers on the same tables and created
+on first use.
+
+Results are ranked (ts_rank / bm25) and, for users who are neither admin
+nor ViewAll, restricted in SQL to the partners and work packages they lead.
+
+Example:
+    To use::
+        hits = search_items('drought forecast', username='admin')
+'''
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from extensions import db
+from lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# tableClass: (table, live table used for permissions, searchable columns)
+SEARCH_TABLES = [
+    ('Work_Packages', 'work_packages', 'work_packages',
+     ['code', 'name', 'status', 'issues', 'next_deliverable']),
+    ('Tasks', 'tasks', 'tasks',
+     ['code', 'description', 'person_responsible', 'progress', 'papers']),
+    ('Deliverables', 'deliverables', 'deliverables',
+     ['code', 'description', 'person_responsible', 'progress', 'papers']),
+    ('Work_Packages_Archive', 'work_packages_archive', 'work_packages',
+     ['code', 'status', 'issues', 'next_deliverable']),
+    ('Tasks_Archive', 'tasks_archive', 'tasks',
+     ['code', 'person_responsible', 'progress', 'papers']),
+    ('Deliverables_Archive', 'deliverables_archive', 'deliverables',
+     ['code', 'person_responsible', 'progress', 'papers']),
+]
+TS_CONFIG = 'pg_catalog.english'
+# Highlight markers, swapped for <mark> tags after escaping:
+START_SEL = '[[['
+STOP_SEL = ']]]'
+
+
+def document(columns, prefix=''):
+    '''SQL expression concatenating text columns into one document.'''
+    return " || ' ' || ".join("coalesce(" + prefix + col + ", '')"
+                              for col in columns)
+
+
+def permission_clause(tableClass, alias):
+    '''SQL restricting rows to the partners and work packages a user leads.'''
+    wps = ("SELECT work_package FROM users2work_packages "
+           "WHERE username = :username")
+    if tableClass.startswith('Work_Packages'):
+        return alias + ".code IN (" + wps + ")"
+    partners = ("SELECT partner FROM users2partners "
+                "WHERE username = :username")
+    return ("(" + alias + ".partner IN (" + partners + ") OR " + alias +
+            ".work_package IN (" + wps + "))")
+
+
+def source_from(tableClass, table, live, restricted):
+    '''FROM clause for one source; archives join their live table on code.'''
+    if not restricted or table == live:
+        return table + " a", "a"
+    return table + " a JOIN " + live + " p ON p.code = a.code", "p"
+
+
+# ~~~~~~ SQLITE (FTS5) ~~~~~~~ #
+
+def _sqlite_rowid(index, prefix):
+    # Pack source table and row id into one FTS rowid:
+    return "(" + prefix + "id * 8 + " + str(index) + ")"
+
+
+def sqlite_search_ddl():
+    '''Statements creating the FTS5 table and the triggers that feed it.'''
+    ddl = ["CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING "
+           "fts5(table_name UNINDEXED, item_id UNINDEXED, code, body, "
+           "tokenize = 'porter unicode61')"]
+    for index, (tableClass, table, live, columns) in enumerate(SEARCH_TABLES):
+        insert = ("INSERT INTO search_index(rowid, table_name, item_id, "
+                  "code, body) VALUES (" + _sqlite_rowid(index, 'new.') +
+                  ", '" + tableClass + "', new.id, new.code, " +
+                  document(columns, 'new.') + ");")
+        delete = ("DELETE FROM search_index WHERE rowid = " +
+                  _sqlite_rowid(index, 'old.') + ";")
+        ddl.append("CREATE TRIGGER IF NOT EXISTS " + table + "_search_ins "
+                   "AFTER INSERT ON " + table + " BEGIN " + insert + " END")
+        ddl.append("CREATE TRIGGER IF NOT EXISTS " + table + "_search_upd "
+                   "AFTER UPDATE ON " + table + " BEGIN " + delete + " " +
+                   insert + " END")
+        ddl.append("CREATE TRIGGER IF NOT EXISTS " + table + "_search_del "
+                   "AFTER DELETE ON " + table + " BEGIN " + delete + " END")
+    return ddl
+
+
+def ensure_search_index(rebuild=False):
+    '''
+    Create (or with rebuild, repopulate) the search index. On PostgreSQL the
+    migration owns the schema, so rebuilding just re-fires the triggers.
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        if rebuild:
+            for tableClass, table, live, columns in SEARCH_TABLES:
+                db.session.execute(text(
+                    "UPDATE " + table + " SET search_vector = to_tsvector('" +
+                    TS_CONFIG + "', " + document(columns) + ")"))
+            db.session.commit()
+        return
+    exists = db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE name = 'search_index'")).first()
+    if exists and not rebuild:
+        return
+    for statement in sqlite_search_ddl():
+        db.session.execute(text(statement))
+    db.session.execute(text("DELETE FROM search_index"))
+    for index, (tableClass, table, live, columns) in enumerate(SEARCH_TABLES):
+        db.session.execute(text(
+            "INSERT INTO search_index(rowid, table_name, item_id, code, body) "
+            "SELECT " + _sqlite_rowid(index, '') + ", '" + tableClass +
+            "', id, code, " + document(columns) + " FROM " + table))
+    db.session.commit()
+
+
+def fts5_query(query):
+    '''Quote each term so user input can't inject FTS5 query syntax.'''
+    return " ".join('"' + term.replace('"', '""') + '"'
+                    for term in query.split())
+
+
+def sqlite_search(query, username, restricted, limit):
+    sources = []
+    for tableClass, table, live, columns in SEARCH_TABLES:
+        if restricted:
+            # Correlated, so only rows that already match are checked:
+            from_clause, alias = source_from(tableClass, table, live, True)
+            sources.append(
+                "(s.table_name = '" + tableClass + "' AND EXISTS (SELECT 1 "
+                "FROM " + from_clause + " WHERE a.id = s.item_id AND " +
+                permission_clause(tableClass, alias) + "))")
+    sql = ("SELECT s.table_name, s.item_id AS id, s.code, "
+           "snippet(search_index, 3, :start, :stop, '...', 16) AS snippet, "
+           "bm25(search_index) AS rank FROM search_index s "
+           "WHERE search_index MATCH :query")
+    if restricted:
+        sql += " AND (" + " OR ".join(sources) + ")"
+    sql += " ORDER BY rank LIMIT :limit"
+    params = {'query': fts5_query(query), 'username': username,
+              'start': START_SEL, 'stop': STOP_SEL, 'limit': limit}
+    return pd.read_sql(text(sql), db.session.get_bind(), params=params)
+
+
+# ~~~~~~ POSTGRESQL (tsvector) ~~~~~~~ #
+
+def postgres_search(query, username, restricted, limit):
+    sources = []
+    for tableClass, table, live, columns in SEARCH_TABLES:
+        from_clause, alias = source_from(tableClass, table, live, restricted)
+        sql = ("SELECT '" + tableClass + "' AS table_name, a.id, a.code, "
+               "ts_rank(a.search_vector, q) AS rank, " +
+               document(columns, 'a.') + " AS doc FROM " + from_clause +
+               ", plainto_tsquery('" + TS_CONFIG + "', :query) q "
+               "WHERE a.search_vector @@ q")
+        if restricted:
+            sql += " AND " + permission_clause(tableClass, alias)
+        sources.append(sql)
+    # Headlines are costly, so only build them for the page returned:
+    sql = ("SELECT table_name, id, code, ts_headline('" + TS_CONFIG +
+           "', doc, plainto_tsquery('" + TS_CONFIG + "', :query), "
+           ":options) AS snippet, rank FROM (" +
+           " UNION ALL ".join(sources) +
+           ") hits ORDER BY rank DESC LIMIT :limit")
+    params = {'query': query, 'username': username, 'limit': limit,
+              'options': 'StartSel="' + START_SEL + '", StopSel="' +
+              STOP_SEL + '", MaxWords=30, MinWords=10'}
+    return pd.read_sql(text(sql), db.session.get_bind(), params=params)
+
+
+def highlight(snippet):
+    '''Escape a snippet and turn the match markers into <mark> tags.'''
+    if snippet is None:
+        return ''
+    snippet = str(escape(snippet))
+    return Markup(snippet.replace(START_SEL, '<mark>')
+                  .replace(STOP_SEL, '</mark>'))
+
+
+def search_items(query, username, restricted=False, limit=50):
+    '''
+    Ranked matches for query across all searchable tables. With restricted,
+    only items the user leads (as partner or work package leader) match.
+    '''
+    if not query or not query.strip():
+        return pd.DataFrame(columns=['table_name', 'id', 'code', 'snippet',
+                                     'rank'])
+    if db.engine.dialect.name == 'postgresql':
+        hits = postgres_search(query, username, restricted, limit)
+    else:
+        ensure_search_index()
+        hits = sqlite_search(query, username, restricted, limit)
+    hits['snippet'] = hits['snippet'].map(highlight)
+    return hits
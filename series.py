@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+'''
+series.py:
+
+percent over time for tasks, deliverables and the work package and partner
+rollups, built from the *_Archive tables and downsampled to days, weeks or
+months.
+
+An item's percent is a step function: it holds the value of its latest
+revision until the next one. Each item's steps (one value per edit date)
+are cached under ('series', tableClass, code) until an archive row for it
+is written, so only items edited since the last request are read, all in
+one history() call, on the primary even in a read-only view so a lagging
+replica never fills the cache. Resampling is vectorised over every requested item at
+once: the steps go into one frame (one column per item), are forward
+filled and take the last value of each period, labelled by the period's
+end. A rollup is the mean percent of every task and deliverable currently
+in the work package or partner, like mean_percent on the dashboard: a
+member counts as 0 before its first revision, and one never revised with
+its live percent (0 if unset). Periods before any member's first revision
+are left out.
+
+Example:
+    To use::
+        points = percent_series([('Tasks', 'T-R1.1.1'),
+                                 ('work_package', 'WP-C1')],
+                                resolution='month')
+'''
+import datetime as dt
+
+from extensions import db
+from lazy import lazy_import
+from cache import cache_get, cache_set
+from deltas import history
+from routing import primary
+from swiftdb.models import Tasks, Deliverables
+
+pd = lazy_import('pandas')
+
+ITEMS = {'Tasks': Tasks, 'Deliverables': Deliverables}
+ROLLUPS = ['work_package', 'partner']
+# Resolution -> pandas offset alias (periods labelled by their last day):
+RESOLUTIONS = {'day': 'D', 'week': 'W', 'month': 'M'}
+MAX_ITEMS = 500
+# Seconds item steps stay cached (archive writes evict them sooner):
+CACHE_TTL = 24 * 3600
+
+
+def parse_item(item):
+    '''(type, key) of an item given as "Tasks:T-R1.1.1" or a pair.'''
+    if isinstance(item, str):
+        kind, _, key = item.partition(':')
+    else:
+        kind, key = item
+    if kind not in ITEMS and kind not in ROLLUPS:
+        raise ValueError('Unknown item type: ' + str(kind))
+    if not key:
+        raise ValueError('Missing code for ' + str(kind))
+    return kind, key
+
+
+def item_steps(tableClass, codes):
+    '''
+    {code: Series of percent by edit date} for codes of one table, from
+    the cache where possible and otherwise from one archive read.
+    '''
+    steps = {}
+    missing = []
+    for code in codes:
+        cached = cache_get(('series', tableClass, code))
+        if cached is None:
+            missing.append(code)
+        else:
+            steps[code] = cached
+    if missing:
+        with primary():
+            df = history(tableClass, codes=missing)
+        df = df[df['date_edited'].notnull()]
+        df = df.sort_values(['date_edited', 'id'])
+        # The last revision of a day is the day's value:
+        df = df.drop_duplicates(['code', 'date_edited'], keep='last')
+        df['date_edited'] = pd.to_datetime(df['date_edited'])
+        df['percent'] = pd.to_numeric(df['percent'])
+        for code, rows in df.groupby('code'):
+            steps[code] = rows.set_index('date_edited')['percent']
+        for code in missing:
+            steps.setdefault(code, pd.Series([], dtype='float64'))
+            cache_set(('series', tableClass, code), steps[code],
+                      ttl=CACHE_TTL)
+    return steps
+
+
+def rollup_members(scope, keys):
+    '''
+    {key: [(tableClass, code, live percent)]} of the items now in each
+    rollup group.
+    '''
+    members = dict((key, []) for key in keys)
+    for tableClass, model in ITEMS.items():
+        column = getattr(model, scope)
+        for key, code, percent in (db.session.query(column, model.code,
+                                                    model.percent)
+                                   .filter(column.in_(keys))):
+            members[key].append((tableClass, code, percent))
+    return members
+
+
+def resample(steps, resolution, start=None, end=None):
+    '''
+    Frame of percent per period (rows, labelled by period end) and item
+    (columns) from {name: step Series}, between start and end.
+    '''
+    wide = pd.DataFrame(steps)
+    if wide.empty:
+        return wide
+    end = pd.Timestamp(end or dt.date.today())
+    wide = wide.reindex(wide.index.union([end]))
+    wide = wide.ffill().resample(RESOLUTIONS[resolution]).last().ffill()
+    if start is not None:
+        wide = wide[wide.index >= pd.Timestamp(start)]
+    return wide[wide.index <= end.to_period(
+        RESOLUTIONS[resolution]).end_time.normalize()]
+
+
+def rollup_mean(wide, members):
+    '''
+    Mean percent per period of every member, from the resampled frame;
+    periods before any member's first revision are NaN (left out).
+    '''
+    revised = [t + ':' + c for t, c, _ in members
+               if t + ':' + c in wide.columns]
+    if not revised:
+        return pd.Series([], dtype='float64')
+    total = wide[revised].fillna(0).sum(axis=1)
+    # Members never revised hold their live percent throughout:
+    total += sum(float(percent or 0) for t, c, percent in members
+                 if t + ':' + c not in wide.columns)
+    values = total / len(members)
+    return values.where(wide[revised].notnull().any(axis=1))
+
+
+def percent_series(items, resolution='week', start=None, end=None):
+    '''
+    {item: [(period end date, percent)]} for items given as (type, key)
+    pairs, type being a tableClass or a rollup scope. Periods before an
+    item's first revision are left out.
+    '''
+    if resolution not in RESOLUTIONS:
+        raise ValueError('Unknown resolution: ' + str(resolution))
+    items = [parse_item(item) for item in items]
+    if len(items) > MAX_ITEMS:
+        raise ValueError('At most {} items per request'.format(MAX_ITEMS))
+    members = {}
+    for scope in ROLLUPS:
+        keys = sorted(set(key for kind, key in items if kind == scope))
+        if keys:
+            for key, group in rollup_members(scope, keys).items():
+                members[(scope, key)] = group
+    wanted = dict((tableClass, set()) for tableClass in ITEMS)
+    for kind, key in items:
+        for member in members.get((kind, key), [(kind, key)]):
+            wanted[member[0]].add(member[1])
+    columns = {}
+    for tableClass, codes in wanted.items():
+        for code, steps in item_steps(tableClass, sorted(codes)).items():
+            if not steps.empty:
+                columns[tableClass + ':' + code] = steps
+    wide = resample(columns, resolution, start, end)
+    series = {}
+    for kind, key in items:
+        if kind in ROLLUPS:
+            values = rollup_mean(wide, members[(kind, key)])
+        elif kind + ':' + key in wide.columns:
+            values = wide[kind + ':' + key]
+        else:
+            values = pd.Series([], dtype='float64')
+        values = values.dropna()
+        series[(kind, key)] = [(date.date(), float(value))
+                               for date, value in values.items()]
+    return series
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+'''
+snapshots.py:
+
+Point-in-time snapshots of the whole project (work packages, tasks and
+deliverables) materialised from the *_Archive tables.
+
+A snapshot holds, for every code, the latest archive revision dated on or
+before the snapshot date. Each snapshot also records the highest archive id
+it has folded in for every table, so new (or back-dated) archive rows are
+applied incrementally rather than by rebuilding from the whole archive.
+Snapshots are only written by jobs and manage.py: the daily
+month_end_snapshots job creates a 'base' snapshot (empty, the day before
+the first edit) and every month end, and refresh_snapshots folds in new
+archive rows. as_of() only reads, so a date before every snapshot (or
+before the job has first run) gives empty frames rather than a replay of
+the whole archive.
+
+Example:
+    To build every missing month-end snapshot::
+        python manage.py snapshot
+
+    To answer "what did the project look like on date X"::
+        frames, snapshot_date = as_of(dt.date(2020, 3, 31))
+'''
+import datetime as dt
+from sqlalchemy import func
+
+from extensions import db
+from lazy import lazy_import
+from cold import cold_bounds
+from deltas import history
+from swiftdb.changelog import FIELDS, to_date
+from swiftdb.models import (Work_Packages, Tasks, Deliverables,
+                            Work_Packages_Archive, Tasks_Archive,
+                            Deliverables_Archive, Snapshots, Snapshot_Rows)
+
+pd = lazy_import('pandas')
+
+ARCHIVES = {'Work_Packages': Work_Packages_Archive,
+            'Tasks': Tasks_Archive,
+            'Deliverables': Deliverables_Archive}
+LIVE = {'Work_Packages': Work_Packages,
+        'Tasks': Tasks,
+        'Deliverables': Deliverables}
+# Highest archive id folded into a snapshot, per table:
+WATERMARKS = {'Work_Packages': 'wp_archive_id',
+              'Tasks': 'tasks_archive_id',
+              'Deliverables': 'deliverables_archive_id'}
+# Descriptive columns joined from the live tables for display:
+STATIC = {'Work_Packages': ['code', 'name'],
+          'Tasks': ['code', 'work_package', 'description', 'partner',
+                    'month_due'],
+          'Deliverables': ['code', 'work_package', 'description', 'partner',
+                           'month_due']}
+
+
+def month_end(date):
+    '''Last day of the month containing date.'''
+    next_month = date.replace(day=28) + dt.timedelta(days=4)
+    return next_month - dt.timedelta(days=next_month.day)
+
+
+def max_archive_ids():
+    '''Current highest id in each archive table.'''
+    ids = {}
+    for tableClass, archive in ARCHIVES.items():
+        hot = db.session.query(func.max(archive.id)).scalar() or 0
+        ids[tableClass] = max(hot, cold_bounds(tableClass)[1] or 0)
+    return ids
+
+
+def replay(tableClass, after=None, upto=None, min_id=None, max_id=None):
+    '''
+    Latest archive revision per code with after < date_edited <= upto and
+    min_id < id <= max_id. Any bound left as None is open. The bounds hit
+    the date_edited index so only the replayed window is read, from the
+    database and, for old dates, the cold tier (plus, for delta revisions,
+    the rows back to their keyframes).
+    '''
+    df = history(tableClass, after=after, upto=upto, min_id=min_id,
+                 max_id=max_id)
+    df = df.rename(columns={'id': 'archive_id'})
+    df = df.sort_values(['date_edited', 'archive_id'])
+    return df.drop_duplicates('code', keep='last')
+
+
+def snapshot_frame(snapshot, tableClass):
+    '''Materialised rows of one table in a snapshot.'''
+    query = Snapshot_Rows.query.filter_by(snapshot_id=snapshot.id,
+                                          table_name=tableClass)
+    df = pd.read_sql(query.statement, db.session.get_bind())
+    df['date_edited'] = pd.to_datetime(df['date_edited']).dt.date
+    return df[['id', 'code', 'archive_id', 'date_edited'] +
+              FIELDS[tableClass]]
+
+
+def merge_revisions(base, newer):
+    '''
+    Fold newer revisions into base, keeping per code whichever revision is
+    latest by (date_edited, archive id).
+    '''
+    merged = pd.concat([base, newer], sort=False)
+    merged = merged.sort_values(['date_edited', 'archive_id'])
+    return merged.drop_duplicates('code', keep='last')
+
+
+def _records(df, tableClass, snapshot_id):
+    records = []
+    for row in df[['code', 'archive_id', 'date_edited'] +
+                  FIELDS[tableClass]].to_dict('records'):
+        record = {'snapshot_id': snapshot_id, 'table_name': tableClass}
+        for key, value in row.items():
+            if pd.isnull(value):
+                value = None
+            elif key == 'archive_id' or key == 'percent':
+                value = int(value)
+            elif key == 'paper_submission_date':
+                value = str(value)
+            record[key] = value
+        records.append(record)
+    return records
+
+
+def write_rows(snapshot, tableClass, df, existing=None):
+    '''Insert or update snapshot rows for the revisions in df.'''
+    records = _records(df, tableClass, snapshot.id)
+    if existing is None or existing.empty:
+        db.session.bulk_insert_mappings(Snapshot_Rows, records)
+        return
+    row_ids = dict(zip(existing['code'], existing['id']))
+    inserts = [r for r in records if r['code'] not in row_ids]
+    updates = [r for r in records if r['code'] in row_ids]
+    for record in updates:
+        record['id'] = int(row_ids[record['code']])
+    db.session.bulk_insert_mappings(Snapshot_Rows, inserts)
+    db.session.bulk_update_mappings(Snapshot_Rows, updates)
+
+
+def refresh_snapshot(snapshot, max_ids=None):
+    '''
+    Apply archive rows added since the snapshot was last brought up to date.
+    Only rows above the snapshot's per-table watermark are read.
+    '''
+    if max_ids is None:
+        max_ids = max_archive_ids()
+    for tableClass, watermark in WATERMARKS.items():
+        current = getattr(snapshot, watermark)
+        if max_ids[tableClass] <= current:
+            continue
+        newer = replay(tableClass, upto=snapshot.snapshot_date,
+                       min_id=current, max_id=max_ids[tableClass])
+        if not newer.empty:
+            existing = snapshot_frame(snapshot, tableClass)
+            merged = merge_revisions(existing, newer)
+            changed = merged[merged['archive_id'].isin(newer['archive_id'])]
+            write_rows(snapshot, tableClass, changed, existing)
+        setattr(snapshot, watermark, max_ids[tableClass])
+    db.session.commit()
+    return snapshot
+
+
+def refresh_snapshots(since=None):
+    '''
+    Bring snapshots up to date with new archive rows. Passing the
+    date_edited of a new archive row restricts this to the snapshots it can
+    affect.
+    '''
+    query = Snapshots.query
+    if since is not None:
+        query = query.filter(Snapshots.snapshot_date >= to_date(since))
+    snapshots = query.all()
+    if not snapshots:
+        return
+    max_ids = max_archive_ids()
+    for snapshot in snapshots:
+        refresh_snapshot(snapshot, max_ids)
+
+
+def nearest_snapshot(date):
+    '''Latest snapshot taken on or before date, or None.'''
+    return (Snapshots.query.filter(Snapshots.snapshot_date <= date)
+            .order_by(Snapshots.snapshot_date.desc()).first())
+
+
+def create_snapshot(date, label='reporting'):
+    '''
+    Materialise project state at date. Built from the nearest earlier
+    snapshot plus a replay of the archive rows dated in between.
+    '''
+    date = to_date(date)
+    snapshot = Snapshots.query.filter_by(snapshot_date=date).first()
+    if snapshot is not None:
+        return refresh_snapshot(snapshot)
+    max_ids = max_archive_ids()
+    base = (Snapshots.query.filter(Snapshots.snapshot_date < date)
+            .order_by(Snapshots.snapshot_date.desc()).first())
+    if base is not None:
+        refresh_snapshot(base, max_ids)
+    snapshot = Snapshots(snapshot_date=date, label=label,
+                         date_created=dt.date.today())
+    db.session.add(snapshot)
+    db.session.flush()
+    for tableClass, watermark in WATERMARKS.items():
+        if base is not None:
+            rows = snapshot_frame(base, tableClass).drop('id', axis=1)
+            newer = replay(tableClass, after=base.snapshot_date, upto=date,
+                           max_id=max_ids[tableClass])
+            rows = merge_revisions(rows, newer)
+        else:
+            rows = replay(tableClass, upto=date, max_id=max_ids[tableClass])
+        write_rows(snapshot, tableClass, rows)
+        setattr(snapshot, watermark, max_ids[tableClass])
+    db.session.commit()
+    return snapshot
+
+
+def ensure_month_end_snapshots(until=None):
+    '''
+    Create the base snapshot and any missing month-end snapshots from the
+    first archived edit up to until (default today). Each one is built
+    incrementally from the one before.
+    '''
+    until = to_date(until) if until is not None else dt.date.today()
+    firsts = [db.session.query(func.min(archive.date_edited)).scalar()
+              for archive in ARCHIVES.values()]
+    firsts += [cold_bounds(tableClass)[0] for tableClass in ARCHIVES]
+    firsts = [to_date(first) for first in firsts if first is not None]
+    if not firsts:
+        return []
+    created = []
+    # Empty, so every date from the first edit on has an earlier snapshot:
+    base = min(firsts) - dt.timedelta(days=1)
+    if Snapshots.query.filter_by(snapshot_date=base).first() is None:
+        created.append(create_snapshot(base, label='base'))
+    date = month_end(min(firsts))
+    while date <= until:
+        if Snapshots.query.filter_by(snapshot_date=date).first() is None:
+            created.append(create_snapshot(date, label='month-end'))
+        date = month_end(date + dt.timedelta(days=1))
+    return created
+
+
+def as_of(date):
+    '''
+    Project state at date: the nearest earlier snapshot, plus the archive
+    rows dated after it and those it has yet to fold in. Nothing is
+    written. Returns ({tableClass: DataFrame}, date of the snapshot used),
+    with empty frames and None when there is no earlier snapshot.
+    '''
+    date = to_date(date)
+    snapshot = nearest_snapshot(date)
+    frames = {}
+    for tableClass in ARCHIVES:
+        columns = STATIC[tableClass] + ['date_edited'] + FIELDS[tableClass]
+        if snapshot is None:
+            frames[tableClass] = pd.DataFrame(columns=columns)
+            continue
+        rows = snapshot_frame(snapshot, tableClass).drop('id', axis=1)
+        # Rows the refresh_snapshots job has not folded in yet:
+        unfolded = replay(tableClass, upto=snapshot.snapshot_date,
+                          min_id=getattr(snapshot, WATERMARKS[tableClass]))
+        newer = replay(tableClass, after=snapshot.snapshot_date, upto=date)
+        rows = merge_revisions(merge_revisions(rows, unfolded), newer)
+        rows = rows[['code', 'date_edited'] + FIELDS[tableClass]]
+        live = LIVE[tableClass]
+        static = pd.read_sql(db.session.query(live).order_by(live.id)
+                             .statement,
+                             db.session.get_bind())[STATIC[tableClass]]
+        frames[tableClass] = static.merge(rows, on='code', how='inner')
+    if snapshot is None:
+        return frames, None
+    return frames, snapshot.snapshot_date
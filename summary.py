@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+'''
+summary.py:
+
+Tasks and deliverables of one work package, as shown on /wp-summary.
+
+Both tables are read by a single UNION ALL query with a type column, which
+is ordered, paged and has its dates formatted by the database, so only the
+page shown is sent. Pages are cached per work package and evicted, in every
+worker, when any task or deliverable in it is added, edited or deleted (see
+items_changed in SWIFTDBApp.py and bus.py).
+
+Example:
+    To use::
+        data, total = wp_summary_page('WP-C1', page=1, per_page=500)
+'''
+from sqlalchemy import (select, literal, union_all, func, cast, String,
+                        Integer)
+
+from extensions import db
+from lazy import lazy_import
+from cache import cache_get, cache_set
+from bus import publish
+from swiftdb.models import Tasks, Deliverables
+
+pd = lazy_import('pandas')
+
+ITEMS = [('Deliverable', Deliverables), ('Task', Tasks)]
+TEXT = ['code', 'work_package', 'description', 'partner',
+        'person_responsible', 'progress', 'papers']
+MONTHS = 'JanFebMarAprMayJunJulAugSepOctNovDec'
+
+
+def format_date(column, style):
+    '''
+    SQL rendering of a date column as 'Mon YYYY' (style='month') or
+    'DD/MM/YYYY' (style='day'), '' when NULL.
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        pattern = 'Mon YYYY' if style == 'month' else 'DD/MM/YYYY'
+        text = func.to_char(column, pattern)
+    elif style == 'month':
+        month = cast(func.strftime('%m', column), Integer)
+        text = (func.substr(MONTHS, (month - 1) * 3 + 1, 3) + ' ' +
+                func.strftime('%Y', column))
+    else:
+        text = func.strftime('%d/%m/%Y', column)
+    return func.coalesce(text, '')
+
+
+def summary_query(code):
+    '''UNION ALL of the work package's deliverables and tasks.'''
+    selects = []
+    for item_type, model in ITEMS:
+        columns = [literal(item_type, String).label('type'), model.id]
+        columns += [func.coalesce(getattr(model, name), '').label(name)
+                    for name in TEXT]
+        columns += [model.month_due, model.percent,
+                    func.coalesce(cast(model.paper_submission_date, String),
+                                  '').label('paper_submission_date'),
+                    model.date_edited]
+        selects.append(select(columns).where(model.work_package == code))
+    return union_all(*selects).alias('items')
+
+
+def wp_summary_page(code, page=1, per_page=500, ttl=3600):
+    '''
+    One page of the work package summary, ordered by type, month due and
+    code, and the total number of items. Cached until an item changes.
+    '''
+    key = ('wp_summary', code, page, per_page)
+    cached = cache_get(key)
+    if cached is not None:
+        return cached[0].copy(), cached[1]
+    items = summary_query(code)
+    c = items.c
+    statement = (select([c.type, c.id, c.code, c.work_package, c.description,
+                         c.partner, c.person_responsible,
+                         format_date(c.month_due, 'month').label('month_due'),
+                         c.progress, c.percent, c.papers,
+                         c.paper_submission_date,
+                         format_date(c.date_edited, 'day')
+                         .label('date_edited'),
+                         func.count().over().label('total')])
+                 .order_by(c.type, c.month_due, c.code)
+                 .limit(per_page).offset((page - 1) * per_page))
+    data = pd.read_sql(statement, db.session.get_bind())
+    if data.empty:
+        # Past the last page the window count is lost, so count directly:
+        total = db.session.execute(
+            select([func.count()]).select_from(items)).scalar()
+    else:
+        total = int(data['total'].iloc[0])
+    data = data.drop('total', axis=1)
+    cache_set(key, (data, total), ttl=ttl)
+    return data.copy(), total
+
+
+def summary_changed(work_packages):
+    '''Evict cached summaries of the given work packages in every worker.'''
+    publish(*[('wp_summary', code) for code in sorted(set(work_packages))])
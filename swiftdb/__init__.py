@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+'''
+swiftdb:
+
+Data-access package for the SWIFT database: the models, session set-up and
+query / bulk-write helpers. It depends on SQLAlchemy only (pandas is
+imported by read_frame when first called), so scripts and batch jobs can use
+the database without building the web app or setting its secrets.
+
+Example:
+    To use::
+        from swiftdb import connect, session_scope, bulk_insert, Tasks
+        Session = connect()  # DATABASE_URL
+        with session_scope(Session) as session:
+            bulk_insert(session, Tasks, rows)
+'''
+from swiftdb.database import Base, connect, session_scope, create_tables
+from swiftdb.api import (read_frame, read_tab, bulk_insert, bulk_upsert,
+                         delete_all)
+from swiftdb.models import (Partners, Work_Packages, Work_Packages_Archive,
+                            Deliverables, Deliverables_Archive, Users,
+                            Users2Work_Packages, Tasks, Tasks_Archive,
+                            Users2Partners, Counts, Snapshots, Snapshot_Rows,
+                            Rollups, Jobs, Cache_Versions, Change_Log,
+                            Projections)
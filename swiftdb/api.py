@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+'''
+api.py:
+
+Query and bulk-write helpers that work on any SQLAlchemy session, whether a
+script's (swiftdb.connect) or the web app's (db.session).
+
+Rows may be dicts keyed by column name or sequences in the order of the
+model's constructor arguments, which is the column order of the .tab files
+used by the populate scripts.
+
+Example:
+    To use::
+        with session_scope(Session) as session:
+            delete_all(session, Tasks)
+            bulk_insert(session, Tasks, read_tab('tasks.tab'))
+            df = read_frame(session, session.query(Tasks))
+'''
+import csv
+import inspect
+
+BATCH_SIZE = 1000
+
+
+def read_frame(session, query):
+    '''Run a Query (or selectable) and return the result as a DataFrame.'''
+    # Imported here so writing rows never pays for pandas:
+    import pandas as pd
+    statement = getattr(query, 'statement', query)
+    return pd.read_sql(statement, session.get_bind())
+
+
+def read_tab(path, delimiter='\t'):
+    '''Rows of a .tab file as lists of strings.'''
+    with open(path, 'r') as f:
+        for row in csv.reader(f, delimiter=delimiter):
+            yield row
+
+
+def constructor_fields(model):
+    '''Column names in the order of the model's __init__ arguments.'''
+    return inspect.getfullargspec(model.__init__).args[1:]
+
+
+def mappings(model, rows):
+    '''Dicts for rows given as dicts or as constructor-ordered sequences.'''
+    fields = None
+    for row in rows:
+        if isinstance(row, dict):
+            yield row
+            continue
+        if fields is None:
+            fields = constructor_fields(model)
+        yield dict(zip(fields, row))
+
+
+def batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(session, model, rows, batch_size=BATCH_SIZE):
+    '''
+    Insert rows in batches of executemany INSERTs. Nothing is committed, so
+    the caller decides the transaction. Returns the number of rows.
+    '''
+    count = 0
+    for batch in batches(mappings(model, rows), batch_size):
+        session.bulk_insert_mappings(model, batch)
+        count += len(batch)
+    return count
+
+
+def bulk_upsert(session, model, rows, key='code', batch_size=BATCH_SIZE):
+    '''
+    Update rows whose key already exists and insert the rest, one batch at
+    a time. Returns (inserted, updated).
+    '''
+    column = getattr(model, key)
+    inserted = updated = 0
+    for batch in batches(mappings(model, rows), batch_size):
+        keys = [row[key] for row in batch]
+        ids = dict(session.query(column, model.id).filter(column.in_(keys)))
+        inserts, updates = [], []
+        for row in batch:
+            if row[key] in ids:
+                updates.append(dict(row, id=ids[row[key]]))
+            else:
+                inserts.append(row)
+        session.bulk_insert_mappings(model, inserts)
+        session.bulk_update_mappings(model, updates)
+        inserted += len(inserts)
+        updated += len(updates)
+    return inserted, updated
+
+
+def delete_all(session, *models):
+    '''Empty the tables of models, in the order given.'''
+    for model in models:
+        session.query(model).delete(synchronize_session=False)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+'''
+changelog.py:
+
+The change log's events, on any SQLAlchemy session or connection: what the
+populate scripts and migrations need to log their writes without building
+the web app. Projecting and replaying the log is the app's changelog.py.
+
+An event is one Change_Log row: the insert, update or delete of an item,
+or a reset. A reset (code RESET_CODE) starts a table's history over, as
+when the archives are reloaded wholesale: projections ignore the table's
+earlier events. Events are only ever appended, so a reload is logged as a
+reset followed by the loaded revisions rather than by rewriting the log.
+
+Example:
+    To log a script's updates::
+        events = [event('Tasks', row['code'], 'update', row) for row in rows]
+        bulk_insert(session, Change_Log, events)
+
+    To log archives just loaded from files, already projected::
+        seed_events(session.connection(), revisions, reset=True)
+'''
+import collections
+import datetime as dt
+import json
+
+from sqlalchemy import func, select
+
+from swiftdb.api import batches
+from swiftdb.models import Change_Log, Projections, Counts
+
+# Archived fields of each table, i.e. an event's payload:
+FIELDS = {'Work_Packages': ['status', 'issues', 'next_deliverable'],
+          'Tasks': ['person_responsible', 'progress', 'percent', 'papers',
+                    'paper_submission_date'],
+          'Deliverables': ['person_responsible', 'progress', 'percent',
+                           'papers', 'paper_submission_date']}
+ACTIONS = ['insert', 'update', 'delete', 'reset']
+# Actions that project an archive revision:
+REVISIONS = ['insert', 'update']
+# Code of a reset event, which concerns the whole table:
+RESET_CODE = '*'
+PROJECTION = 'archives'
+# Rows per bulk write:
+BATCH_SIZE = 5000
+
+
+def to_date(date):
+    '''Coerce a date, datetime or YYYY-MM-DD string to a date.'''
+    if isinstance(date, dt.datetime):
+        return date.date()
+    if isinstance(date, dt.date):
+        return date
+    return dt.datetime.strptime(str(date)[:10], '%Y-%m-%d').date()
+
+
+def json_value(value):
+    if hasattr(value, 'item'):
+        # A numpy scalar:
+        value = value.item()
+    if value is None or value != value:
+        # Also NaN and NaT:
+        return None
+    if isinstance(value, (dt.date, dt.datetime)):
+        return value.isoformat()
+    return value
+
+
+def payload(tableClass, values):
+    '''JSON of the archived fields present in values.'''
+    return json.dumps(dict((field, json_value(values[field]))
+                           for field in FIELDS[tableClass]
+                           if field in values), sort_keys=True)
+
+
+def event(tableClass, code, action='update', values=None, date_edited=None):
+    '''Mapping of one Change_Log row; date_edited defaults to values'.'''
+    if tableClass not in FIELDS:
+        raise ValueError('Unknown table: ' + str(tableClass))
+    if action not in ACTIONS:
+        raise ValueError('Unknown action: ' + str(action))
+    values = values or {}
+    date_edited = date_edited or values.get('date_edited')
+    return {'recorded_at': dt.datetime.utcnow(), 'table_name': tableClass,
+            'code': code, 'action': action,
+            'date_edited': to_date(date_edited) if date_edited else None,
+            'payload': (payload(tableClass, values)
+                        if action in REVISIONS else None)}
+
+
+def seed_events(bind, revisions, reset=False):
+    '''
+    Log {tableClass: full archive rows (dicts) in id order} on a
+    Connection, each code's first row as its insert, after a reset of each
+    table if reset is set. The log up to them is marked projected and
+    Counts replaced by the rows per code. Returns the number of revisions
+    logged.
+    '''
+    table = Change_Log.__table__
+    counts = collections.Counter()
+    count = 0
+    for tableClass, rows in revisions.items():
+        events = [event(tableClass, RESET_CODE, 'reset')] if reset else []
+        seen = set()
+        for row in rows:
+            events.append(event(tableClass, row['code'],
+                                'update' if row['code'] in seen
+                                else 'insert', row))
+            seen.add(row['code'])
+            counts[row['code']] += 1
+            count += 1
+        for batch in batches(events, BATCH_SIZE):
+            bind.execute(table.insert(), batch)
+    bind.execute(Counts.__table__.delete())
+    for batch in batches([{'code': code, 'count': n}
+                          for code, n in sorted(counts.items())],
+                         BATCH_SIZE):
+        bind.execute(Counts.__table__.insert(), batch)
+    last = bind.execute(select([func.max(table.c.id)])).scalar() or 0
+    marks = Projections.__table__
+    values = {'event_id': last, 'date_refreshed': dt.datetime.utcnow()}
+    if not bind.execute(marks.update().where(marks.c.name == PROJECTION),
+                        values).rowcount:
+        bind.execute(marks.insert(), dict(values, name=PROJECTION))
+    return count
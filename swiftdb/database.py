@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+database.py:
+
+Declarative base shared by the models, and engine / session set-up for use
+outside the web app. Only SQLAlchemy is imported, so a script needs nothing
+but a database URL.
+
+Example:
+    To use::
+        Session = connect('postgresql://localhost/swift')
+        with session_scope(Session) as session:
+            session.query(Tasks).count()
+'''
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+Base = declarative_base()
+
+
+def connect(url=None, **engine_options):
+    '''
+    Session factory bound to a new engine for url, by default the
+    DATABASE_URL environment variable. Each process (or script) should call
+    this once and open as many sessions from it as it needs.
+    '''
+    url = url or os.environ.get('DATABASE_URL')
+    if not url:
+        raise RuntimeError("DATABASE_URL environment variable not set")
+    engine = create_engine(url, **engine_options)
+    return sessionmaker(bind=engine)
+
+
+@contextmanager
+def session_scope(Session):
+    '''One transaction: committed on success, rolled back on any error.'''
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def create_tables(Session):
+    '''Create any missing tables (local databases; Postgres uses migrations).'''
+    Base.metadata.create_all(Session.kw['bind'])
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+'''
+models.py:
+
+Table definitions for the SWIFT database, declared on the plain SQLAlchemy
+base in swiftdb.database so they load without Flask. The web app binds the
+same classes through Flask-SQLAlchemy (see extensions.py), which adds the
+Model.query property.
+
+On PostgreSQL the *_Archive tables are range partitioned by date_edited
+(see partitions.py), with primary key (id, date_edited) in the database.
+The mappings keep id alone as the key, which is still unique.
+
+Tasks_Archive and Deliverables_Archive rows may be deltas holding only the
+fields that changed (see deltas.py); read them through deltas.history().
+The archives and Counts are projections of Change_Log (see changelog.py).
+'''
+from sqlalchemy import (Column, Integer, String, Date, DateTime, Float,
+                        Text, ForeignKey, Index, UniqueConstraint, text)
+from sqlalchemy.orm import relationship
+
+from swiftdb.database import Base
+
+
+class Partners(Base):
+    __tablename__ = 'partners'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(), nullable=False, unique=True)
+    country = Column(String())
+    role = Column(String())
+    Deliverables_Rel = relationship('Deliverables')
+    Tasks_Rel = relationship('Tasks')
+    Users2Partners_Rel = relationship('Users2Partners')
+
+    def __init__(self, name, country, role):
+        self.name = name
+        self.country = country
+        self.role = role
+
+    def __repr__(self):
+        return '<name {}>'.format(self.name)
+
+
+class Work_Packages(Base):
+    __tablename__ = 'work_packages'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String(), nullable=False, unique=True)
+    name = Column(String(), nullable=False)
+    previous_report = Column(String(()))
+    status = Column(String())
+    issues = Column(String())
+    next_deliverable = Column(String())
+    date_edited = Column(Date())
+    Deliverables_Rel = relationship('Deliverables')
+    Tasks_Rel = relationship('Tasks')
+    Users2Work_Packages_Rel = relationship('Users2Work_Packages')
+
+    def __init__(self, code, name, previous_report, status, issues,
+                 next_deliverable, date_edited):
+        self.code = code
+        self.name = name
+        self.previous_report = previous_report
+        self.status = status
+        self.issues = issues
+        self.next_deliverable = next_deliverable
+        self.date_edited = date_edited
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Work_Packages_Archive(Base):
+    __tablename__ = 'work_packages_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    date_edited = Column(Date())
+    code = Column(String(), nullable=False)
+    __table_args__ = (Index('ix_work_packages_archive_code_date', 'code', 'date_edited'),
+                      Index('ix_work_packages_archive_date', 'date_edited'),)
+    status = Column(String())
+    issues = Column(String())
+    next_deliverable = Column(String())
+
+    def __init__(self, date_edited, code, status, issues,
+                 next_deliverable):
+        self.date_edited = date_edited
+        self.code = code
+        self.status = status
+        self.issues = issues
+        self.next_deliverable = next_deliverable
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Deliverables(Base):
+    __tablename__ = 'deliverables'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String(), nullable=False, unique=True)
+    work_package = Column(String(), ForeignKey('work_packages.code'),
+                          nullable=False)
+    description = Column(String(), nullable=False)
+    partner = Column(String(), ForeignKey('partners.name'),
+                     nullable=False)
+    person_responsible = Column(String())
+    month_due = Column(Date, nullable=False)
+    previous_report = Column(String())
+    progress = Column(String())
+    percent = Column(Integer, nullable=False)
+    papers = Column(String())
+    paper_submission_date = Column(Date())
+    date_edited = Column(Date())
+    # Partial index: only incomplete items are ever queued as overdue
+    __table_args__ = (Index('ix_deliverables_incomplete_due', 'month_due',
+                            postgresql_where=text('percent < 100'),
+                            sqlite_where=text('percent < 100')),)
+
+    def __init__(self, code, work_package,  description, partner,
+                 person_responsible, month_due, previous_report, progress,
+                 percent, papers, paper_submission_date,
+                 date_edited):
+        self.code = code
+        self.work_package = work_package
+        self.description = description
+        self.partner = partner
+        self.person_responsible = person_responsible
+        self.month_due = month_due
+        self.previous_report = previous_report
+        self.progress = progress
+        self.percent = percent
+        self.papers = papers
+        self.paper_submission_date = paper_submission_date
+        self.date_edited = date_edited
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Deliverables_Archive(Base):
+    __tablename__ = 'deliverables_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    date_edited = Column(Date())
+    code = Column(String(), nullable=False)
+    __table_args__ = (Index('ix_deliverables_archive_code_date', 'code', 'date_edited'),
+                      Index('ix_deliverables_archive_date', 'date_edited'),)
+    person_responsible = Column(String())
+    progress = Column(String())
+    percent = Column(Integer)
+    papers = Column(String())
+    paper_submission_date = Column(Date())
+    # Fields recorded by a delta revision (NULL for a full row):
+    changed = Column(Integer)
+
+    def __init__(self, date_edited, code, person_responsible,
+                 progress, percent, papers, paper_submission_date,
+                 changed=None):
+        self.date_edited = date_edited
+        self.code = code
+        self.person_responsible = person_responsible
+        self.progress = progress
+        self.percent = percent
+        self.papers = papers
+        self.paper_submission_date = paper_submission_date
+        self.changed = changed
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Users(Base):
+    __tablename__ = 'users'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String(), unique=True)
+    password = Column(String())
+    Users2Work_Packages_Rel = relationship('Users2Work_Packages')
+    Users2Partners_Rel = relationship('Users2Partners')
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Users2Work_Packages(Base):
+    __tablename__ = 'users2work_packages'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String(), ForeignKey('users.username'),
+                      nullable=False)
+    work_package = Column(String(), ForeignKey('work_packages.code'),
+                          nullable=False)
+    __table_args__ = (UniqueConstraint('username', 'work_package',
+                                       name='_username_work_package_uc'),)
+
+    def __init__(self, username, work_package):
+        self.username = username
+        self.work_package = work_package
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Tasks(Base):
+    __tablename__ = 'tasks'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String(), nullable=False, unique=True)
+    work_package = Column(String(), ForeignKey('work_packages.code'),
+                          nullable=False)
+    description = Column(String(), nullable=False)
+    partner = Column(String(), ForeignKey('partners.name'),
+                     nullable=False)
+    person_responsible = Column(String())
+    month_due = Column(Date, nullable=False)
+    previous_report = Column(String())
+    progress = Column(String())
+    percent = Column(Integer, nullable=False)
+    papers = Column(String())
+    paper_submission_date = Column(Date())
+    date_edited = Column(Date())
+    # Partial index: only incomplete items are ever queued as overdue
+    __table_args__ = (Index('ix_tasks_incomplete_due', 'month_due',
+                            postgresql_where=text('percent < 100'),
+                            sqlite_where=text('percent < 100')),)
+
+    def __init__(self, code, work_package, description, partner,
+                 person_responsible, month_due, previous_report, progress,
+                 percent, papers, paper_submission_date,
+                 date_edited):
+        self.code = code
+        self.work_package = work_package
+        self.description = description
+        self.partner = partner
+        self.person_responsible = person_responsible
+        self.month_due = month_due
+        self.previous_report = previous_report
+        self.progress = progress
+        self.percent = percent
+        self.papers = papers
+        self.paper_submission_date = paper_submission_date
+        self.date_edited = date_edited
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Tasks_Archive(Base):
+    __tablename__ = 'tasks_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    date_edited = Column(Date())
+    code = Column(String(), nullable=False)
+    __table_args__ = (Index('ix_tasks_archive_code_date', 'code', 'date_edited'),
+                      Index('ix_tasks_archive_date', 'date_edited'),)
+    person_responsible = Column(String())
+    progress = Column(String())
+    percent = Column(Integer)
+    papers = Column(String())
+    paper_submission_date = Column(Date())
+    # Fields recorded by a delta revision (NULL for a full row):
+    changed = Column(Integer)
+
+    def __init__(self, date_edited, code, person_responsible,
+                 progress, percent, papers, paper_submission_date,
+                 changed=None):
+        self.date_edited = date_edited
+        self.code = code
+        self.person_responsible = person_responsible
+        self.progress = progress
+        self.percent = percent
+        self.papers = papers
+        self.paper_submission_date = paper_submission_date
+        self.changed = changed
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Users2Partners(Base):
+    __tablename__ = 'users2partners'
+
+    id = Column(Integer, primary_key=True)
+    username = Column(String(), ForeignKey('users.username'),
+                      nullable=False)
+    partner = Column(String(), ForeignKey('partners.name'),
+                     nullable=False)
+    __table_args__ = (UniqueConstraint('username', 'partner',
+                                       name='_username_partner_uc'),)
+
+    def __init__(self, username, partner):
+        self.username = username
+        self.partner = partner
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Counts(Base):
+    __tablename__ = 'counts'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    code = Column(String(), nullable=False, unique=True)
+    count = Column(Integer, nullable=False)
+
+    def __init__(self, code, count):
+        self.code = code
+        self.count = count
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Snapshots(Base):
+    __tablename__ = 'snapshots'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    snapshot_date = Column(Date(), nullable=False, unique=True)
+    label = Column(String())
+    wp_archive_id = Column(Integer, nullable=False, default=0)
+    tasks_archive_id = Column(Integer, nullable=False, default=0)
+    deliverables_archive_id = Column(Integer, nullable=False, default=0)
+    date_created = Column(Date())
+    Snapshot_Rows_Rel = relationship('Snapshot_Rows',
+                                     cascade='all, delete-orphan')
+
+    def __init__(self, snapshot_date, label, date_created):
+        self.snapshot_date = snapshot_date
+        self.label = label
+        self.wp_archive_id = 0
+        self.tasks_archive_id = 0
+        self.deliverables_archive_id = 0
+        self.date_created = date_created
+
+    def __repr__(self):
+        return '<snapshot {}>'.format(self.snapshot_date)
+
+
+class Snapshot_Rows(Base):
+    __tablename__ = 'snapshot_rows'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    snapshot_id = Column(Integer, ForeignKey('snapshots.id'),
+                         nullable=False)
+    table_name = Column(String(), nullable=False)
+    code = Column(String(), nullable=False)
+    archive_id = Column(Integer, nullable=False)
+    date_edited = Column(Date())
+    status = Column(String())
+    issues = Column(String())
+    next_deliverable = Column(String())
+    person_responsible = Column(String())
+    progress = Column(String())
+    percent = Column(Integer)
+    papers = Column(String())
+    paper_submission_date = Column(String())
+    __table_args__ = (UniqueConstraint('snapshot_id', 'table_name', 'code',
+                                       name='_snapshot_table_code_uc'),)
+
+    def __init__(self, snapshot_id, table_name, code, archive_id,
+                 date_edited):
+        self.snapshot_id = snapshot_id
+        self.table_name = table_name
+        self.code = code
+        self.archive_id = archive_id
+        self.date_edited = date_edited
+
+    def __repr__(self):
+        return '<id {}>'.format(self.id)
+
+
+class Rollups(Base):
+    __tablename__ = 'rollups'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    scope = Column(String(), nullable=False)
+    key = Column(String(), nullable=False)
+    n_tasks = Column(Integer, nullable=False, default=0)
+    n_deliverables = Column(Integer, nullable=False, default=0)
+    n_complete = Column(Integer, nullable=False, default=0)
+    n_overdue = Column(Integer, nullable=False, default=0)
+    mean_percent = Column(Float)
+    weighted_percent = Column(Float)
+    date_refreshed = Column(Date())
+    __table_args__ = (UniqueConstraint('scope', 'key',
+                                       name='_scope_key_uc'),)
+
+    def __init__(self, scope, key):
+        self.scope = scope
+        self.key = key
+
+    def __repr__(self):
+        return '<rollup {} {}>'.format(self.scope, self.key)
+
+
+class Jobs(Base):
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(), nullable=False)
+    payload = Column(Text())
+    status = Column(String(), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime(), nullable=False)
+    started_at = Column(DateTime())
+    worker = Column(String())
+    finished_at = Column(DateTime())
+    last_error = Column(Text())
+    date_created = Column(DateTime())
+    # Workers only ever look for runnable jobs:
+    __table_args__ = (Index('ix_jobs_status_run_after', 'status',
+                            'run_after'),)
+
+    def __init__(self, kind, payload, run_after, max_attempts=5):
+        self.kind = kind
+        self.payload = payload
+        self.status = 'queued'
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.run_after = run_after
+        self.date_created = run_after
+
+    def __repr__(self):
+        return '<job {} {}>'.format(self.id, self.kind)
+
+
+class Cache_Versions(Base):
+    __tablename__ = 'cache_versions'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    key = Column(String(), nullable=False, unique=True)
+    version = Column(Integer, nullable=False, index=True)
+
+    def __init__(self, key, version):
+        self.key = key
+        self.version = version
+
+    def __repr__(self):
+        return '<cache {} v{}>'.format(self.key, self.version)
+
+
+class Change_Log(Base):
+    __tablename__ = 'change_log'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    recorded_at = Column(DateTime(), nullable=False)
+    table_name = Column(String(), nullable=False)
+    code = Column(String(), nullable=False)
+    action = Column(String(), nullable=False)
+    date_edited = Column(Date())
+    # JSON of the archived fields after the change (NULL for a delete):
+    payload = Column(Text())
+    __table_args__ = (Index('ix_change_log_table_code', 'table_name',
+                            'code'),)
+
+    def __init__(self, recorded_at, table_name, code, action, date_edited,
+                 payload):
+        self.recorded_at = recorded_at
+        self.table_name = table_name
+        self.code = code
+        self.action = action
+        self.date_edited = date_edited
+        self.payload = payload
+
+    def __repr__(self):
+        return '<change {} {} {}>'.format(self.id, self.action, self.code)
+
+
+class Projections(Base):
+    __tablename__ = 'projections'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(), nullable=False, unique=True)
+    # Highest change_log id applied:
+    event_id = Column(Integer, nullable=False, default=0)
+    date_refreshed = Column(DateTime())
+
+    def __init__(self, name, event_id=0):
+        self.name = name
+        self.event_id = event_id
+
+    def __repr__(self):
+        return '<projection {} at {}>'.format(self.name, self.event_id)
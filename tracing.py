@@ -0,0 +1,452 @@
+# -*- coding: utf-8 -*-
+'''
+tracing.py:
+
+Request tracing, for seeing where the time of one slow request went. A
+traced request is a tree of spans: the route, and inside it each SQL
+statement, psql_to_pandas conversion, form construction and
+render_template call, all sharing the request's trace ID (sent back in the
+X-Request-ID header).
+
+Sampling is decided once, when a request starts (head-based): a request
+is traced when an admin adds ?trace=1 to its URL, or otherwise with
+probability TRACE_SAMPLE_RATE. A W3C traceparent header is only honoured
+with TRACE_TRUST_PARENT set, i.e. when the app sits behind a gateway that
+sets or strips it; the request then joins the caller's trace and follows
+its sampled flag. Without it any client could have every request traced.
+An untraced request costs a random number, and each of its SQL statements
+and spans a check for a trace.
+
+Finished traces are handed to a background thread per process, which
+appends them to TRACE_FILE as JSON lines (TRACE_EXPORT = 'jsonl') or posts
+them as OTLP/HTTP JSON to TRACE_ENDPOINT (TRACE_EXPORT = 'otlp'). A trace
+is dropped rather than delaying a request when the queue is full or the
+collector is down. run_collector() is a stand-in for an OpenTelemetry
+collector, receiving OTLP/HTTP JSON and writing the same JSON lines.
+
+Example:
+    To trace 1% of requests in production::
+        export TRACE_SAMPLE_RATE=0.01
+
+    To print the slowest traced request::
+        python manage.py traces -f traces.jsonl
+
+    To trace a block::
+        with span('rollup', scope='partner'):
+            ...
+'''
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACE_ARG = 'trace'
+# Never traced:
+SKIPPED = ('static',)
+QUEUE_SIZE = 1000
+MAX_STATEMENT = 1000
+SERVICE = 'swiftdb'
+# version-trace_id-parent_id-flags:
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+logger = logging.getLogger(__name__)
+_exporter = []
+_exporter_lock = threading.Lock()
+_installed = []
+
+
+def new_id(bits):
+    return '{:0{}x}'.format(random.getrandbits(bits), bits // 4)
+
+
+class Trace(object):
+    '''The spans of one request, and the stack of those still open.'''
+
+    def __init__(self, trace_id=None, parent_id=None):
+        self.trace_id = trace_id or new_id(128)
+        self.spans = []
+        self.stack = [parent_id]
+
+    def start(self, name, attributes=None):
+        span = {'span_id': new_id(64), 'parent_id': self.stack[-1],
+                'name': name, 'start': time.time_ns(), 'end': None,
+                'attributes': attributes or {}, 'error': None}
+        self.spans.append(span)
+        self.stack.append(span['span_id'])
+        return span
+
+    def end(self, span, error=None):
+        span['end'] = time.time_ns()
+        if error is not None:
+            span['error'] = '{}: {}'.format(type(error).__name__, error)
+        if span['span_id'] in self.stack:
+            del self.stack[self.stack.index(span['span_id']):]
+
+
+def current_trace():
+    '''The Trace of the current request, or None if it isn't traced.'''
+    if not has_request_context():
+        return None
+    return g.get('trace')
+
+
+class span(object):
+    '''Context manager timing a block as a span of the current trace.'''
+
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.trace = self.span = None
+
+    def __enter__(self):
+        self.trace = current_trace()
+        if self.trace is not None:
+            self.span = self.trace.start(self.name, self.attributes)
+        return self.span
+
+    def __exit__(self, kind, error, traceback):
+        if self.span is not None:
+            self.trace.end(self.span, error)
+        return False
+
+
+def traced(name, label=None):
+    '''
+    Decorator making each call a span; label names an attribute holding
+    the call's first argument (e.g. the template of render_template).
+    '''
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_trace() is None:
+                return function(*args, **kwargs)
+            attributes = {label: str(args[0])} if label and args else {}
+            with span(name, **attributes):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ~~~~~~ REQUEST HOOKS ~~~~~~~ #
+
+def parent():
+    '''(trace_id, parent span_id, sampled) of a traceparent header.'''
+    match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def start_trace():
+    if request.endpoint in SKIPPED:
+        return
+    remote = parent() if current_app.config.get('TRACE_TRUST_PARENT') \
+        else None
+    if remote is not None:
+        trace_id, parent_id, wanted = remote
+    else:
+        trace_id = parent_id = None
+        rate = current_app.config.get('TRACE_SAMPLE_RATE')
+        wanted = rate and random.random() < rate
+    # An admin's flag traces the request whatever the caller decided:
+    wanted = wanted or (TRACE_ARG in request.args and
+                        (session.get('username') == 'admin' or
+                         session.get('admin') == 'True'))
+    if not wanted:
+        return
+    trace = Trace(trace_id, parent_id)
+    rule = request.url_rule.rule if request.url_rule else request.path
+    g.trace = trace
+    g.trace_root = trace.start(request.method + ' ' + rule, {
+        'http.method': request.method, 'http.route': rule,
+        'http.target': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint or 'unknown'})
+
+
+def tag_response(response):
+    trace = g.get('trace')
+    if trace is not None:
+        g.trace_root['attributes']['http.status_code'] = response.status_code
+        response.headers['X-Request-ID'] = trace.trace_id
+    return response
+
+
+def end_trace(exc=None):
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    trace.end(g.pop('trace_root'), exc)
+    export(current_app.config, trace)
+
+
+# ~~~~~~ SQL ~~~~~~~ #
+
+def before_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    trace = current_trace()
+    if trace is not None and context is not None:
+        context.trace_span = trace.start('sql', {
+            'db.system': conn.dialect.name,
+            'db.statement': statement[:MAX_STATEMENT],
+            'db.executemany': executemany})
+
+
+def after_execute(conn, cursor, statement, parameters, context, executemany):
+    sql = getattr(context, 'trace_span', None)
+    trace = current_trace()
+    if sql is not None and trace is not None:
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            sql['attributes']['db.rowcount'] = cursor.rowcount
+        trace.end(sql)
+
+
+def failed_execute(exception_context):
+    sql = getattr(exception_context.execution_context, 'trace_span', None)
+    trace = current_trace()
+    if sql is not None and trace is not None:
+        trace.end(sql, exception_context.original_exception)
+
+
+def init_tracing(app):
+    '''Register the request hooks and (once per process) the SQL hooks.'''
+    app.before_request(start_trace)
+    app.after_request(tag_response)
+    app.teardown_request(end_trace)
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', before_execute)
+        event.listen(Engine, 'after_cursor_execute', after_execute)
+        event.listen(Engine, 'handle_error', failed_execute)
+        _installed.append(True)
+
+
+# ~~~~~~ EXPORT ~~~~~~~ #
+
+def trace_record(trace):
+    '''JSON-lines record of a finished trace.'''
+    return {'trace_id': trace.trace_id, 'spans': [
+        dict(span, end=span['end'] or span['start']) for span in trace.spans]}
+
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_payload(records):
+    '''OTLP/HTTP JSON body (ExportTraceServiceRequest) of trace records.'''
+    spans = []
+    for record in records:
+        for span in record['spans']:
+            spans.append({
+                'traceId': record['trace_id'], 'spanId': span['span_id'],
+                'parentSpanId': span['parent_id'] or '',
+                'name': span['name'],
+                # Server for the route, client for everything it calls:
+                'kind': 3 if span['name'] == 'sql' else
+                        2 if 'http.route' in span['attributes'] else 1,
+                'startTimeUnixNano': str(span['start']),
+                'endTimeUnixNano': str(span['end']),
+                'attributes': [{'key': key, 'value': otlp_value(value)}
+                               for key, value in span['attributes'].items()],
+                'status': ({'code': 2, 'message': span['error']}
+                           if span['error'] else {'code': 1})})
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name',
+                                     'value': {'stringValue': SERVICE}}]},
+        'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]}]}
+
+
+def from_otlp(payload):
+    '''Trace records of an OTLP/HTTP JSON body.'''
+    traces = {}
+    for resource in payload.get('resourceSpans', []):
+        for scope in resource.get('scopeSpans', []):
+            for span in scope.get('spans', []):
+                attributes = {}
+                for attribute in span.get('attributes', []):
+                    value = attribute.get('value', {})
+                    value = next(iter(value.values())) if value else None
+                    if 'intValue' in attribute.get('value', {}):
+                        value = int(value)
+                    attributes[attribute['key']] = value
+                status = span.get('status', {})
+                traces.setdefault(span['traceId'], []).append({
+                    'span_id': span['spanId'],
+                    'parent_id': span.get('parentSpanId') or None,
+                    'name': span['name'],
+                    'start': int(span['startTimeUnixNano']),
+                    'end': int(span['endTimeUnixNano']),
+                    'attributes': attributes,
+                    'error': (status.get('message') or 'error'
+                              if status.get('code') == 2 else None)})
+    return [{'trace_id': trace_id, 'spans': spans}
+            for trace_id, spans in traces.items()]
+
+
+def write_records(path, records):
+    # One write per batch, so lines of several workers don't interleave:
+    with open(path, 'a') as f:
+        f.write(''.join(json.dumps(record, default=str) + '\n'
+                        for record in records))
+
+
+def post_records(url, records):
+    import urllib.request
+    body = json.dumps(otlp_payload(records), default=str).encode('utf-8')
+    urllib.request.urlopen(urllib.request.Request(
+        url, data=body, headers={'Content-Type': 'application/json'}),
+        timeout=5).close()
+
+
+class Exporter(threading.Thread):
+    '''Writes queued trace records in batches, off the request threads.'''
+
+    def __init__(self, kind, target):
+        threading.Thread.__init__(self, name='trace-exporter', daemon=True)
+        self.kind = kind
+        self.target = target
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < 100:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.kind == 'otlp':
+                    post_records(self.target, records)
+                else:
+                    write_records(self.target, records)
+            except Exception as e:
+                logger.warning('Could not export %d trace(s): %s',
+                               len(records), e)
+            for _ in records:
+                self.queue.task_done()
+
+
+def exporter(config):
+    '''This process's exporter (threads don't survive gunicorn's fork).'''
+    kind = config.get('TRACE_EXPORT', 'jsonl')
+    target = (config.get('TRACE_ENDPOINT') if kind == 'otlp'
+              else config.get('TRACE_FILE', 'traces.jsonl'))
+    with _exporter_lock:
+        if (not _exporter or _exporter[0].pid != os.getpid() or
+                (_exporter[0].kind, _exporter[0].target) != (kind, target)):
+            _exporter[:] = [Exporter(kind, target)]
+            _exporter[0].start()
+        return _exporter[0]
+
+
+def export(config, trace):
+    try:
+        exporter(config).queue.put_nowait(trace_record(trace))
+    except queue.Full:
+        logger.warning('Trace queue full, dropped trace %s', trace.trace_id)
+
+
+def flush_traces():
+    '''Wait until every queued trace has been exported.'''
+    if _exporter:
+        _exporter[0].queue.join()
+
+
+# ~~~~~~ READING ~~~~~~~ #
+
+def read_traces(path):
+    '''Trace records of a JSON-lines file.'''
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def duration_ms(span):
+    return (span['end'] - span['start']) / 1e6
+
+
+def root_span(record):
+    ids = set(span['span_id'] for span in record['spans'])
+    roots = [span for span in record['spans'] if span['parent_id'] not in ids]
+    return min(roots, key=lambda span: span['start']) if roots else None
+
+
+def format_trace(record):
+    '''Indented span tree of a trace record, with durations in ms.'''
+    children = {}
+    for span in record['spans']:
+        children.setdefault(span['parent_id'], []).append(span)
+    ids = set(span['span_id'] for span in record['spans'])
+    lines = ['Trace ' + record['trace_id']]
+
+    def walk(span, depth):
+        detail = span['attributes'].get('db.statement') or \
+            span['attributes'].get('template') or \
+            span['attributes'].get('form') or ''
+        lines.append('{:>10.1f}ms {}{} {}{}'.format(
+            duration_ms(span), '  ' * depth, span['name'],
+            ' '.join(str(detail).split())[:100],
+            ' [' + span['error'] + ']' if span['error'] else '').rstrip())
+        for child in sorted(children.get(span['span_id'], []),
+                            key=lambda s: s['start']):
+            walk(child, depth + 1)
+
+    for span in sorted((s for s in record['spans']
+                        if s['parent_id'] not in ids),
+                       key=lambda s: s['start']):
+        walk(span, 0)
+    return '\n'.join(lines)
+
+
+# ~~~~~~ COLLECTOR ~~~~~~~ #
+
+def run_collector(port, path, host='127.0.0.1'):
+    '''
+    Serve POST /v1/traces (OTLP/HTTP JSON) until interrupted, appending
+    the traces received to path as JSON lines.
+    '''
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/v1/traces':
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                records = from_otlp(json.loads(body.decode('utf-8')))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_error(400, str(e))
+                return
+            write_records(path, records)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()